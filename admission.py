@@ -0,0 +1,183 @@
+"""Admission control for the model path: bounded priority queue, per-user caps.
+
+A burst of camp uploads used to pile up on the model without limit, and
+every request slowed down with it. Each screening now asks the
+``AdmissionController`` for a slot first:
+
+- at most ``max_concurrent`` requests run at once; the rest wait in a
+  queue of at most ``max_queue``, ordered by priority and then by arrival.
+  Interactive screenings (``INTERACTIVE``) go ahead of bulk batches
+  (``BULK``)
+- when the queue is full, an interactive request takes the place of the
+  newest queued bulk batch, which is turned away. Otherwise the new request
+  is refused at once with 503 and a ``Retry-After`` estimated from the
+  backlog
+- one user may hold at most ``per_user`` slots, running or queued (429).
+  A request with no user (``None``) has no per-user cap
+- a request that waits longer than ``queue_timeout`` gives up (503)
+
+Queue wait, rejections by reason, and the running and queued counts are
+exported to ``/metrics``. Limits apply per process.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import metrics
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "oralscan_admission_wait_seconds", "Time a request waited for a model slot", ("priority",))
+REJECTED = metrics.REGISTRY.counter(
+    "oralscan_admission_rejected_total", "Requests refused a model slot", ("priority", "reason"))
+
+
+class Overloaded(Exception):
+    def __init__(self, message, status=503, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, user, priority, seq):
+        self.user = user
+        self.priority = priority
+        self.seq = seq
+        self.event = threading.Event()
+        self.admitted = False
+        self.evicted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Slot:
+    def __init__(self, controller, waiter):
+        self._controller = controller
+        self._waiter = waiter
+        self._started = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._leave(self._waiter, time.perf_counter() - self._started)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=16, max_queue=64, per_user=4, queue_timeout=10.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.per_user = max(1, per_user)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queue = []  # heap of _Waiter
+        self._per_user = defaultdict(int)
+        self._seq = itertools.count()
+        self._service_seconds = 0.5  # moving average of time holding a slot
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        metrics.REGISTRY.register_callback("oralscan_admission_running", "gauge",
+                                           "Requests holding a model slot", lambda: self._running)
+        metrics.REGISTRY.register_callback("oralscan_admission_queued", "gauge",
+                                           "Requests waiting for a model slot", lambda: len(self._queue))
+
+    def retry_after(self):
+        # Rough time for the current backlog to drain
+        backlog = self._running + len(self._queue)
+        return max(1, math.ceil(self._service_seconds * backlog / self.max_concurrent))
+
+    def _reject(self, priority, reason, message, status=503):
+        # Called with the lock held
+        self.rejected[reason] += 1
+        REJECTED.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+        return Overloaded(message, status, self.retry_after())
+
+    def _enter(self, user, priority):
+        with self._lock:
+            if user is not None and self._per_user[user] >= self.per_user:
+                raise self._reject(priority, "user_limit", "Too many screenings in progress for this user", 429)
+            waiter = _Waiter(user, priority, next(self._seq))
+            if self._running < self.max_concurrent and not self._queue:
+                self._running += 1
+                self._per_user[user] += 1
+                self.admitted += 1
+                waiter.admitted = True
+                return waiter, 0.0
+            if len(self._queue) >= self.max_queue:
+                worst = max(self._queue) if self._queue else None
+                if worst is None or worst.priority <= priority:
+                    raise self._reject(priority, "queue_full", "The screening queue is full, please retry shortly")
+                # An interactive screening displaces the newest queued bulk batch
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                self._per_user[worst.user] -= 1
+                worst.evicted = True
+                worst.event.set()
+            heapq.heappush(self._queue, waiter)
+            self._per_user[user] += 1
+        queued = time.perf_counter()
+        if not waiter.event.wait(self.queue_timeout):
+            with self._lock:
+                if not waiter.admitted and not waiter.evicted:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                    self._per_user[user] -= 1
+                    raise self._reject(priority, "timeout", "Timed out waiting for the screening queue")
+        if waiter.evicted:
+            with self._lock:
+                raise self._reject(priority, "evicted", "Bulk screening paused for interactive screenings, please retry")
+        with self._lock:
+            self.admitted += 1
+        return waiter, time.perf_counter() - queued
+
+    def _leave(self, waiter, held_seconds):
+        with self._lock:
+            self._per_user[waiter.user] -= 1
+            if self._per_user[waiter.user] <= 0:
+                del self._per_user[waiter.user]
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * held_seconds
+            if self._queue:
+                # Hand the slot straight to the best waiter
+                successor = heapq.heappop(self._queue)
+                successor.admitted = True
+                successor.event.set()
+            else:
+                self._running -= 1
+
+    def acquire(self, user, priority=INTERACTIVE):
+        """Take a model slot, waiting in the queue if needed; raises ``Overloaded`` if none is given."""
+        waiter, waited = self._enter(user, priority)
+        WAIT_SECONDS.observe(waited, priority=PRIORITY_NAMES[priority])
+        return Slot(self, waiter)
+
+    @contextmanager
+    def admit(self, user, priority=INTERACTIVE):
+        """Hold a model slot for the enclosed block."""
+        slot = self.acquire(user, priority)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": len(self._queue),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "per_user": self.per_user,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "retry_after": self.retry_after(),
+            }
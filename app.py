@@ -1,31 +1,188 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, session
-from keras.models import load_model
-from keras.preprocessing import image
+from flask import Flask, render_template, request, send_file, redirect, url_for, session, jsonify, Response
 import numpy as np
-from fpdf import FPDF
 from datetime import datetime
 import os
+import time
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import unicodedata
-from PIL import Image
-import random
+from model_service import ModelNotReady, service_from_env
+from admission import AdmissionController, Overloaded, INTERACTIVE, BULK
+from tta import ViewPolicy, score_views
+from saliency import HeatmapStore
+from uploads import UploadError, UploadRequest, save_image_upload, save_audio_upload
+from inference_server import InferenceClient, DEFAULT_SOCKET
+from preprocessing import decode_upload, to_model_input
+from artifacts import artifacts_from_env, shard_path
+from dedup import ImageStore, PredictionCache, content_hash
+from derivatives import DerivativeStore, DERIVATIVE_VERSION, CACHE_SECONDS as DERIVATIVE_CACHE_SECONDS
+from storage import create_stores
+from ids import new_record_id
+from reports import ReportService
+from bulk import iter_images, read_symptoms_csv, habits_from_row
+from chat_events import ChatBroker, stream as chat_event_stream
+import metrics
+from metrics import span
+from logs import get_logger
 
 app = Flask(__name__)
+# File parts spool to disk past a small buffer instead of being held in memory
+app.request_class = UploadRequest
 app.secret_key = os.environ.get("SESSION_SECRET", "your_secret_key")
 app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024  # 20 MB
-
-# Dummy user database
-users = {}
-
-model = load_model("oral_cancer_model.h5")
+# Per-route request rate, 5xx rate and latency, served at /metrics
+metrics.instrument(app)
+# Proxy hops whose X-Forwarded-For is trusted; unset means the client address is unknown
+TRUSTED_PROXIES = os.environ.get("TRUSTED_PROXIES")
+if TRUSTED_PROXIES and int(TRUSTED_PROXIES) > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(TRUSTED_PROXIES))
+log = get_logger("app")
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 64))
+BULK_MAX_UPLOAD = int(os.environ.get("BULK_MAX_UPLOAD_MB", 500)) * 1024 * 1024
+
+# The model loads off the import path so pages that do not need it serve
+# straight away; inference routes wait up to MODEL_READY_TIMEOUT for it.
+# INFERENCE_MODE=server shares one model process (inference_server.py)
+# between all workers instead of loading it in each one.
+if os.environ.get("INFERENCE_MODE", "local") == "server":
+    model_service = InferenceClient(
+        os.environ.get("INFERENCE_SOCKET", DEFAULT_SOCKET),
+        slots=int(os.environ.get("INFERENCE_SLOTS", 32)),
+    )
+else:
+    model_service = service_from_env()
+MODEL_LOAD = os.environ.get("MODEL_LOAD", "background")
+MODEL_READY_TIMEOUT = float(os.environ.get("MODEL_READY_TIMEOUT", 30))
+MODEL_RETRY_AFTER = 5
+if MODEL_LOAD != "lazy":
+    model_service.start(background=MODEL_LOAD != "eager")
+
+# Screenings take a slot before touching the model; under overload the
+# queue sheds bulk batches first and answers 503 instead of piling up
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get("ADMISSION_MAX_CONCURRENT", 16)),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 64)),
+    per_user=int(os.environ.get("ADMISSION_PER_USER", 4)),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10)),
+)
+
+# Test-time augmentation for single screenings; the number of views adapts
+# to keep the scoring stage's p95 within the budget
+PREDICT_TTA = os.environ.get("PREDICT_TTA", "0") == "1"
+tta_policy = ViewPolicy(
+    budget_ms=float(os.environ.get("TTA_LATENCY_BUDGET_MS", 400)),
+    max_views=int(os.environ.get("TTA_MAX_VIEWS", 8)),
+)
+
+# Grad-CAM overlays for single screenings, from the same pass as the score
+SALIENCY_HEATMAPS = os.environ.get("SALIENCY_HEATMAPS", "0") == "1" and getattr(model_service, "can_explain", False)
+heatmap_store = HeatmapStore()
 
 UPLOAD_AUDIO_FOLDER = os.path.join("static", "audio")
 UPLOAD_IMAGE_FOLDER = os.path.join("static", "uploads")
+# /upload_image files belong to no record, so they live apart from the swept uploads
+UPLOAD_STANDALONE_FOLDER = os.path.join("static", "standalone_uploads")
 os.makedirs(UPLOAD_IMAGE_FOLDER, exist_ok=True)
+os.makedirs(UPLOAD_STANDALONE_FOLDER, exist_ok=True)
 os.makedirs(UPLOAD_AUDIO_FOLDER, exist_ok=True)
 
-# Global list to store patient records
-patient_records = []
+# Identical images share one archived file and one cached model score
+image_store = ImageStore(UPLOAD_IMAGE_FOLDER)
+# Pages show resized copies of uploads; made at ingest, or on first request for older uploads
+derivative_store = DerivativeStore(UPLOAD_IMAGE_FOLDER)
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL", 86400)),
+)
+metrics.REGISTRY.register_callback("oralscan_prediction_cache_hits_total", "counter",
+                                   "Predictions served from the cache", lambda: prediction_cache.hits)
+metrics.REGISTRY.register_callback("oralscan_prediction_cache_misses_total", "counter",
+                                   "Predictions that ran the model", lambda: prediction_cache.misses)
+metrics.REGISTRY.register_callback("oralscan_prediction_cache_entries", "gauge",
+                                   "Cached predictions", lambda: len(prediction_cache))
+metrics.REGISTRY.register_callback("oralscan_images_deduplicated_total", "counter",
+                                   "Uploads that reused an archived image", lambda: image_store.deduplicated)
+
+# Users and patient records live in memory by default (indexed by record ID,
+# username, status and follow-up); STORAGE_BACKEND=sql persists them instead.
+users, patient_records = create_stores(app)
+
+# PDF reports render on a worker pool and are cached by content hash
+report_service = ReportService(max_workers=int(os.environ.get("REPORT_WORKERS", 2)),
+                               processes=os.environ.get("REPORT_EXECUTOR", "thread") == "process")
+REPORT_TIMEOUT = float(os.environ.get("REPORT_TIMEOUT", 60))
+
+# Uploads and generated files live in hash-sharded directories; files no
+# record owns are removed when the record is deleted or by a background sweep
+artifacts = artifacts_from_env(patient_records, {
+    "uploads": UPLOAD_IMAGE_FOLDER,
+    "audio": UPLOAD_AUDIO_FOLDER,
+    "heatmaps": heatmap_store.folder,
+    "derivatives": derivative_store.cache_dir,
+    "reports": report_service.cache_dir,
+    "standalone": UPLOAD_STANDALONE_FOLDER,
+}, derived=derivative_store.files_for).start()
+
+# Open chat windows subscribe here and get new messages pushed over SSE
+chat_broker = ChatBroker()
+
+def request_user():
+    # Per-user admission caps. Anonymous screenings are counted per client address only
+    # when TRUSTED_PROXIES says where that comes from; behind an unknown proxy every
+    # caller would share one address, so they get no per-user cap (the queue still bounds them)
+    if session.get("username"):
+        return session["username"]
+    return request.remote_addr if TRUSTED_PROXIES is not None else None
+
+def request_record_id():
+    # Pages and links from before record IDs existed still send the timestamp
+    return request.values.get("record_id") or request.values.get("timestamp")
+
+@app.errorhandler(ModelNotReady)
+def model_not_ready(e):
+    headers = {"Retry-After": str(MODEL_RETRY_AFTER)}
+    if request.path.startswith("/api/") or request.path == "/bulk_predict":
+        return jsonify({**model_service.status(), "error": str(e)}), 503, headers
+    return str(e), 503, headers
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    headers = {"Retry-After": str(e.retry_after)}
+    if request.path.startswith("/api/") or request.path == "/bulk_predict":
+        return jsonify({"error": str(e)}), e.status, headers
+    return str(e), e.status, headers
+
+@app.errorhandler(UploadError)
+def upload_rejected(e):
+    if request.path.startswith("/api/") or request.path == "/bulk_predict":
+        return jsonify({"error": str(e)}), e.status
+    return str(e), e.status
+
+def journal_error():
+    # A failed record journal never recovers; the process has to restart and replay it
+    durability = app.extensions.get("record_journal")
+    error = durability.journal.error if durability is not None else None
+    return None if error is None else str(error)
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process serves requests, whether or not the model is loaded
+    error = journal_error()
+    if error:
+        return jsonify({"status": "failed", "journal_error": error}), 503
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: inference routes can answer without waiting for the model
+    status = model_service.status()
+    error = journal_error()
+    if error:
+        return jsonify(dict(status, journal_error=error)), 503
+    if model_service.ready:
+        return jsonify(status)
+    return jsonify(status), 503, {"Retry-After": str(MODEL_RETRY_AFTER)}
 
 @app.route('/')
 def index():
@@ -42,373 +199,315 @@ def start_screening():
 def remove_invalid_chars(text):
     return ''.join(c for c in text if unicodedata.category(c) != 'Mn')
 
+def collect_symptoms(values, habits):
+    return {
+        "pain_level": values.get('pain_level'),
+        "bleeding": values.get('bleeding'),
+        "swelling": values.get('swelling'),
+        "duration": values.get('duration'),
+        "history": values.get('history'),
+        "habits": habits,
+        "tobacco_years": values.get('tobacco_years', ''),
+        "alcohol_years": values.get('alcohol_years', ''),
+        "smoking_years": values.get('smoking_years', ''),
+        "trismus_test": values.get('trismus_test', ''),
+        "mouth_pain": values.get('mouth_pain', ''),
+        "extra_details": values.get('extra_details', '')
+    }
+
+def classify_prediction(prediction):
+    # Scores below 0.5 are the cancer class; confidence is the sigmoid's
+    # probability for whichever class was chosen
+    pred_class = "Risk (Cancer)" if prediction < 0.5 else "Low Risk (Non-Cancer)"
+    confidence = round(100.0 * max(prediction, 1.0 - prediction), 2)
+    return pred_class, confidence
+
+def cached_score(image_hash, img):
+    # Repeat uploads of the same image under the same model skip the forward pass
+    key = (image_hash, model_service.model_version)
+    score = prediction_cache.get(key)
+    if score is None:
+        with span("predict.model_input"):
+            img_array = to_model_input(img)
+        with span("predict.inference"):
+            score = float(model_service.predict(img_array)[0])
+        prediction_cache.put(key, score)
+    return score
+
+def model_forward(batch, cams):
+    # With heatmaps, the pass that scores the batch also yields the first view's activation map
+    if cams is None:
+        return model_service.predict_batch(batch)
+    scores, maps = model_service.explain(batch)
+    cams.append(maps[0])
+    return scores
+
+def screen_score(image_hash, img):
+    """``(score, variance, views, heatmap_path)`` for a single screening.
+
+    Variance is None without TTA, and the heatmap path None without heatmaps.
+    """
+    version = model_service.model_version
+    heatmap_path = heatmap_store.path_for(image_hash, version) if SALIENCY_HEATMAPS else None
+    # A missing heatmap needs the pass to run again, even for a cached score
+    cams = [] if heatmap_path and not heatmap_store.exists(heatmap_path) else None
+    if PREDICT_TTA:
+        # Cached with the views it was first scored with
+        key = (image_hash, version, "tta")
+        result = prediction_cache.get(key)
+        if result is None or cams is not None:
+            score, variance, views, added = score_views(img, tta_policy, lambda batch: model_forward(batch, cams))
+            log.info("predict.tta", views=views, variance=round(variance, 6), added_ms=round(added * 1000.0, 1))
+            result = (score, variance, views)
+            prediction_cache.put(key, result)
+    elif cams is None:
+        result = (cached_score(image_hash, img), None, 1)
+    else:
+        with span("predict.model_input"):
+            img_array = to_model_input(img)
+        with span("predict.inference"):
+            score = float(model_forward(img_array[None], cams)[0][0])
+        prediction_cache.put((image_hash, version), score)
+        result = (score, None, 1)
+    if cams:
+        heatmap_store.save(img, cams[0], heatmap_path)
+    return result + (heatmap_path,)
+
+def new_patient_record(record_id, timestamp, img_path, symptoms, prediction, confidence, username):
+    return {
+        "id": record_id,
+        "timestamp": timestamp,
+        "image_path": img_path,
+        "symptoms": symptoms,
+        "messages": [],  # chat log, appended through patient_records.append_message
+        "status": "Pending",
+        "voice_reply_path": None,
+        "doctor": "Dr. John Doe",
+        "prediction": prediction,
+        "confidence": confidence,
+        "username": username
+    }
+
 @app.route('/predict', methods=['POST'])
 def predict():
+    model_service.wait(MODEL_READY_TIMEOUT)
+    # Taken before the upload is parsed, so a refusal costs almost nothing
+    slot = admission.acquire(request_user(), INTERACTIVE)
     try:
+        artifacts.reserve(request.content_length or 0)
         # Check if an image was uploaded
         if 'image' in request.files and request.files['image'].filename != '':
             file = request.files['image']
             filename = secure_filename(file.filename)
+            record_id = new_record_id()
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_filename = f"{timestamp}.jpg"
-            img_path = os.path.join(UPLOAD_IMAGE_FOLDER, image_filename)
-            # Open the image file and convert to RGB
-            img = Image.open(file)
-            img = img.convert('RGB')
-            img.save(img_path, 'JPEG')
+            # Decode once; the JPEG is archived in the background under its content hash
+            with span("predict.decode"):
+                img = decode_upload(file)
+            with span("predict.hash"):
+                image_hash = content_hash(img)
+            with span("predict.archive"):
+                img_path, _ = image_store.store(img, image_hash)
+                derivative_store.prepare(img, img_path)
         else:
             return "No image provided", 400
 
         # Collect symptom data
-        pain_level = request.form.get('pain_level')
-        bleeding = request.form.get('bleeding')
-        swelling = request.form.get('swelling')
-        duration = request.form.get('duration')
-        history = request.form.get('history')
-        habits = request.form.getlist('habits')
-        tobacco_years = request.form.get('tobacco_years', '')
-        alcohol_years = request.form.get('alcohol_years', '')
-        smoking_years = request.form.get('smoking_years', '')
-        trismus_test = request.form.get('trismus_test', '')
-        mouth_pain = request.form.get('mouth_pain', '')
-        extra_details = request.form.get('extra_details', '')
-    
-        # Load and preprocess the image
-        img = image.load_img(img_path, target_size=(224, 224))
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0) / 255.0
-
-        # Perform prediction
-        prediction = model.predict(img_array)[0][0]
-        confidence = round(random.uniform(77, 97), 2)  # Random confidence between 77% and 97%
-        pred_class = "Risk (Cancer)" if prediction < 0.5 else "Low Risk (Non-Cancer)"
+        symptoms = collect_symptoms(request.form, request.form.getlist('habits'))
+
+        # Perform prediction (cached per image; batched with other in-flight
+        # requests, or one batch of augmented views with TTA)
+        prediction, variance, views, heatmap_path = screen_score(image_hash, img)
+        pred_class, confidence = classify_prediction(prediction)
 
         # Save patient record for history
         username = session.get("username")
-        patient_record = {
-            "timestamp": timestamp,
-            "image_path": img_path,
-            "symptoms": {
-                "pain_level": pain_level,
-                "bleeding": bleeding,
-                "swelling": swelling,
-                "duration": duration,
-                "history": history,
-                "habits": habits,
-                "tobacco_years": tobacco_years,
-                "alcohol_years": alcohol_years,
-                "smoking_years": smoking_years,
-                "trismus_test": trismus_test,
-                "mouth_pain": mouth_pain,
-                "extra_details": extra_details
-            },
-            "doctor_replies": [],  # <-- store all replies here
-            "status": "Pending",
-            "voice_reply_path": None,
-            "doctor": "Dr. John Doe",
-            "prediction": pred_class,
-            "confidence": confidence,
-            "username": username
-        }
-        patient_records.append(patient_record)
+        patient_record = new_patient_record(record_id, timestamp, img_path, symptoms, pred_class, confidence, username)
+        if variance is not None:
+            patient_record.update(score_variance=round(variance, 6), tta_views=views)
+        if heatmap_path:
+            patient_record["heatmap_path"] = heatmap_path
+        with span("predict.save_record"):
+            patient_records.add(patient_record)
+            artifacts.claim(patient_record)
 
         # Render the result page    
-        return render_template(
-            'result.html',
-            prediction=pred_class,
-            confidence=confidence,
-            image_path=img_path,
-            symptoms=patient_record["symptoms"],
-            timestamp=timestamp
-        )
+        with span("predict.render"):
+            return render_template(
+                'result.html',
+                prediction=pred_class,
+                confidence=confidence,
+                score_variance=variance,
+                tta_views=views,
+                heatmap_path=heatmap_path,
+                image_path=img_path,
+                symptoms=patient_record["symptoms"],
+                timestamp=timestamp,
+                record_id=record_id
+            )
+    except UploadError:
+        raise
     except Exception as e:
+        log.exception("predict.failed")
         return f"Error during prediction: {str(e)}", 500
-
-@app.route('/download_pdf', methods=['POST'])
-def download_pdf():
+    finally:
+        slot.release()
+
+@app.route('/bulk_predict', methods=['POST'])
+def bulk_predict():
+    # Camp uploads are far larger than a single screening
+    request.max_content_length = BULK_MAX_UPLOAD
+    model_service.wait(MODEL_READY_TIMEOUT)
+    artifacts.reserve(request.content_length or 0)
+    started = time.perf_counter()
     try:
-        # Extract patient and form data
-        patient_name = request.form.get('name')
-        dob = request.form.get('dob')
-        age = request.form.get('age')
-        sex = request.form.get('sex')
-        address = request.form.get('address')
-
-        prediction = request.form.get('prediction')
-        confidence = request.form.get('confidence')
-        image_path = request.form.get('image_path')
-        pain_level = request.form.get('pain_level')
-        bleeding = request.form.get('bleeding')
-        swelling = request.form.get('swelling')
-        duration = request.form.get('duration')
-        history = request.form.get('history')
-        timestamp = request.form.get('timestamp')
-
-        # Find the matching record by timestamp
-        symptoms = {}
-        for record in patient_records:
-            if record.get("timestamp") == timestamp:
-                symptoms = record.get("symptoms", {})
-                break
-
-        # Create PDF
-        pdf = MyPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.set_left_margin(15)
-        pdf.set_right_margin(15)
-        pdf.add_page()
-        pdf.set_line_width(0.5)
-        pdf.set_draw_color(0, 0, 0)
-        pdf.rect(7, 7, 196, 283)
-        pdf.set_line_width(0.2)
-        pdf.set_draw_color(0, 0, 0)
-        pdf.set_font("Arial", size=12)
-
-        # Report Title
-        pdf.set_font("Times", 'B', size=16)
-        pdf.cell(200, 10, txt="Oral Cancer Detection Report", ln=True, align='C')
-        pdf.ln(10)
-        pdf.set_line_width(0.5)
-        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-        pdf.ln(10)
-
-
-        pdf.set_font("Arial", 'B', 12)
-        pdf.cell(0, 10, "Prediction Results", ln=True)
-        pdf.set_font("Arial", '', 12)
-        pdf.set_fill_color(220, 220, 220)
-        pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
-        pdf.cell(120, 10, "Value", border=1, align='C', fill=True)
-        pdf.ln()
-        pdf.cell(60, 10, "Prediction", border=1)
-        pdf.cell(120, 10, str(prediction), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Confidence", border=1)
-        pdf.cell(120, 10, f"{confidence}%", border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Pain Level", border=1)
-        pdf.cell(120, 10, str(pain_level), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Bleeding", border=1)
-        pdf.cell(120, 10, str(bleeding), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Swelling", border=1)
-        pdf.cell(120, 10, str(swelling), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Duration", border=1)
-        pdf.cell(120, 10, str(duration), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "History", border=1)
-        pdf.cell(120, 10, str(history), border=1)
-        pdf.ln()
-
-        # Add habits and years
-        habits = symptoms.get('habits', []) if symptoms else []
-        pdf.cell(60, 10, "Habits", border=1)
-        pdf.cell(120, 10, ', '.join(habits) if habits else "None", border=1)
-        pdf.ln()
-        if 'Tobacco' in habits:
-            pdf.cell(60, 10, "Tobacco Years", border=1)
-            pdf.cell(120, 10, str(symptoms.get('tobacco_years', '')), border=1)
-            pdf.ln()
-        if 'Smoking' in habits:
-            pdf.cell(60, 10, "Smoking Years", border=1)
-            pdf.cell(120, 10, str(symptoms.get('smoking_years', '')), border=1)
-            pdf.ln()
-
-        # Add trismus test, mouth pain, and extra details
-        pdf.cell(60, 10, "3 Finger Trismus Test", border=1)
-        pdf.cell(120, 10, str(symptoms.get('trismus_test', 'Not answered')), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Pain Opening Mouth", border=1)
-        pdf.cell(120, 10, str(symptoms.get('mouth_pain', 'Not answered')), border=1)
-        pdf.ln()
-        pdf.cell(60, 10, "Extra Details", border=1)
-        pdf.cell(120, 10, str(symptoms.get('extra_details', 'None')), border=1)
-        pdf.ln(15)
-
-        # --- Clinical Observation Table ---
-        pdf.set_font("Arial", 'B', 12)
-        pdf.cell(0, 10, "Clinical Observation", ln=True)
-        pdf.set_font("Arial", '', 12)
-        pdf.set_fill_color(220, 220, 220)
-        pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
-        pdf.cell(120, 10, "Observation", border=1, align='C', fill=True)
-        pdf.ln()
-        if prediction == "Risk (Cancer)":
-            clinical_details = generate_clinical_details()
-            pdf.cell(60, 10, "Location", border=1)
-            pdf.cell(120, 10, clinical_details['location'], border=1)
-            pdf.ln()
-            pdf.cell(60, 10, "Coloration", border=1)
-            pdf.cell(120, 10, clinical_details['coloration'], border=1)
-            pdf.ln()
-            pdf.cell(60, 10, "Surface", border=1)
-            pdf.cell(120, 10, clinical_details['surface'], border=1)
-            pdf.ln()
-            pdf.cell(60, 10, "Approximate Size", border=1)
-            pdf.cell(120, 10, clinical_details['size'], border=1)
-            pdf.ln()
-            pdf.cell(60, 10, "Suggested Stage", border=1)
-            pdf.cell(120, 10, clinical_details['stage'], border=1)
-            pdf.ln()
-        else:
-            for param in ["Location", "Coloration", "Surface", "Approximate Size", "Suggested Stage"]:
-                pdf.cell(60, 10, param, border=1)
-                pdf.cell(120, 10, "-", border=1)
-                pdf.ln()
-        pdf.ln(15)
-
-       
-
-        # Compose a summary based on prediction and clinical details
-        if prediction == "Risk (Cancer)":
-            summary_text = (
-                "Based on the uploaded image and provided symptoms, the system predicts a HIGH RISK of oral cancer. "
-                "Clinical observation suggests the lesion is located at {location}, with a surface described as {surface} "
-                "and coloration as {coloration}. The approximate size is {size}, and the suggested stage is {stage}. "
-                "It is strongly recommended to consult a specialist for further evaluation and management."
-            ).format(
-                location=clinical_details['location'],
-                surface=clinical_details['surface'],
-                coloration=clinical_details['coloration'],
-                size=clinical_details['size'],
-                stage=clinical_details['stage']
-            )
-        else:
-            summary_text = (
-                "Based on the uploaded image and provided symptoms, the system predicts a LOW RISK of oral cancer. "
-                "No alarming features were detected in the clinical observation. "
-                "Continue regular monitoring and consult a healthcare provider if symptoms persist or worsen."
-            )
-
-        # --- Summary Section on a New Page with Border ---
-
-        pdf.add_page()
-        pdf.set_line_width(0.5)
-        pdf.set_draw_color(0, 0, 0)
-        pdf.rect(7, 7, 196, 283)  # Draw border like first page
-
-        pdf.set_font("Arial", 'B', 12)
-        pdf.ln(12)  # Some space from top border
-        pdf.cell(0, 10, "Summary", ln=True)
-
-        pdf.set_font("Arial", '', 12)
-        pdf.ln(5)
-
-        # Set position inside the border for the summary text
-        x = pdf.get_x()
-        y = pdf.get_y()
-        pdf.set_xy(15, y)  # 15mm from left, current y
-
-        # Write the summary text (already defined as summary_text)
-        pdf.multi_cell(180, 10, summary_text)  # 180mm width fits inside the border
-
-        # Second page
-        # pdf.add_page()
-        # pdf.set_line_width(0.5)  # Thinner border
-        # pdf.set_draw_color(0, 0, 0)
-        # pdf.rect(7, 7, 196, 283)
-        # pdf.set_line_width(0.2)
-        # pdf.set_draw_color(0, 0, 0)
-        # pdf.set_font("Arial", '', 12)
-        pdf.ln(8)  # Space after summary
-        pdf.set_font("Arial", 'B', 12)
-        pdf.set_x(15)
-        pdf.cell(0, 10, "Patient Uploads", ln=True)
-        pdf.ln(2)
-        # --- Patient Uploaded Image Table ---
-        pdf.set_font("Arial", 'B', 12)
-        pdf.cell(0, 10, "Patient Uploaded Image", ln=True)
-        pdf.set_font("Arial", '', 12)
-        pdf.set_fill_color(220, 220, 220)
-        pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
-        pdf.cell(120, 10, "Image", border=1, align='C', fill=True)
-        pdf.ln()
-
-        # Uploaded image row
-        pdf.cell(60, 40, "Uploaded image", border=1, align='C', fill=False)
-        abs_path = os.path.abspath(image_path)
-        if abs_path.lower().endswith('.png'):
-            img = Image.open(abs_path).convert('RGB')
-            converted_path = abs_path.replace(".png", "_converted.jpg")
-            img.save(converted_path)
-            abs_path = converted_path
-        if abs_path and os.path.exists(abs_path):
-            x_img = pdf.get_x()
-            y_img = pdf.get_y()
-            pdf.cell(120, 40, "", border=1, fill=False)
-            pdf.image(abs_path, x=x_img + 2, y=y_img + 2, w=36, h=36)
-            pdf.ln(40)
-        else:
-            pdf.cell(120, 40, "Image not found", border=1, align='C', fill=False)
-            pdf.ln(40)
-
-        # Detected lesion pattern row (if you have a processed image, use its path)
-        predicted_img_path = ""  # Set this to your detected lesion image path if available
-        pdf.cell(60, 40, "Detected lesion pattern", border=1, align='C', fill=False)
-        if predicted_img_path and os.path.exists(predicted_img_path):
-            x_img = pdf.get_x()
-            y_img = pdf.get_y()
-            pdf.cell(120, 40, "", border=1, fill=False)
-            pdf.image(predicted_img_path, x=x_img + 2, y=y_img + 2, w=36, h=36)
-            pdf.ln(40)
-        else:
-            pdf.set_font("Arial", 'I', 12)  # Set italic
-            pdf.cell(120, 40, "This Feature is under Development...", border=1, align='C', fill=False)
-            pdf.ln(40)
-            pdf.set_font("Arial", '', 12)   # Reset to normal if needed
-
+        symptom_rows = read_symptoms_csv(request.files.get('symptoms'))
+        uploads = iter_images(request.files.get('archive'), request.files.getlist('images'))
+    except Exception as e:
+        return jsonify({"error": f"Could not read upload: {e}"}), 400
 
-        # Move to 15mm from the bottom of the current page (2nd page)
+    username = session.get("username")
+    results = []
+    batch = []
+
+    def run_batch():
+        # One forward pass for the images not already cached, then one bulk insert
+        pending = [item for item in batch if item["score"] is None]
+        if pending:
+            # One slot per batch, behind any waiting interactive screenings
+            with admission.admit(request_user(), BULK), span("bulk_predict.inference"):
+                scores = model_service.predict_batch(np.stack([item["array"] for item in pending]))
+            for item, score in zip(pending, scores):
+                item["score"] = float(score[0])
+                prediction_cache.put(item["cache_key"], item["score"])
+        records = []
+        for item in batch:
+            pred_class, confidence = classify_prediction(item["score"])
+            row = symptom_rows.get(item["filename"], {})
+            symptoms = collect_symptoms(row, habits_from_row(row))
+            records.append(new_patient_record(item["record_id"], item["timestamp"], item["img_path"],
+                                              symptoms, pred_class, confidence, row.get("username") or username))
+            item["result"].update(record_id=item["record_id"], prediction=pred_class,
+                                  confidence=confidence, image_path=item["img_path"])
+        with span("bulk_predict.save_records"):
+            patient_records.add_many(records)
+            for record in records:
+                artifacts.claim(record)
+        # Bound memory: decoded images wait in the archive pool until written
+        with span("bulk_predict.archive_wait"):
+            for item in batch:
+                item["archived"].result()
+        batch.clear()
 
+    try:
+        for filename, stream in uploads:
+            result = {"filename": filename}
+            results.append(result)
+            try:
+                with span("bulk_predict.decode"):
+                    img = decode_upload(stream)
+            except Exception as e:
+                result["error"] = f"Could not decode image: {e}"
+                continue
+            image_hash = content_hash(img)
+            img_path, archived = image_store.store(img, image_hash)
+            derivative_store.prepare(img, img_path)
+            cache_key = (image_hash, model_service.model_version)
+            score = prediction_cache.get(cache_key)
+            batch.append({
+                "filename": filename,
+                "record_id": new_record_id(),
+                "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+                "img_path": img_path,
+                "cache_key": cache_key,
+                "score": score,
+                "array": to_model_input(img) if score is None else None,
+                "archived": archived,
+                "result": result,
+            })
+            if len(batch) >= BULK_BATCH_SIZE:
+                run_batch()
+        if batch:
+            run_batch()
+    except Overloaded as e:
+        # Batches already screened are saved; the manifest says where it stopped
+        return jsonify({"error": str(e), "results": results}), e.status, {"Retry-After": str(e.retry_after)}
+    except Exception as e:
+        log.exception("bulk_predict.failed", images=len(results))
+        return jsonify({"error": f"Error during bulk prediction: {e}", "results": results}), 500
+
+    elapsed = time.perf_counter() - started
+    processed = sum(1 for result in results if "record_id" in result)
+    log.info("bulk_predict.done", processed=processed, failed=len(results) - processed, seconds=round(elapsed, 3))
+    return jsonify({
+        "processed": processed,
+        "failed": len(results) - processed,
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_second": round(processed / elapsed, 2) if elapsed else None,
+        "results": results,
+    })
 
-        # Now save the PDF
-        pdf_path = os.path.join('static', f"report_{timestamp}.pdf")
-        pdf.output(pdf_path)
+@app.route('/download_pdf', methods=['POST'])
+def download_pdf():
+    try:
+        record_id = request_record_id()
+
+        # Find the matching record by ID
+        with span("download_pdf.lookup"):
+            record = patient_records.get(record_id)
+        symptoms = record.get("symptoms", {}) if record else {}
+
+        data = {
+            "prediction": request.form.get('prediction'),
+            "confidence": request.form.get('confidence'),
+            "image_path": request.form.get('image_path'),
+            "pain_level": request.form.get('pain_level'),
+            "bleeding": request.form.get('bleeding'),
+            "swelling": request.form.get('swelling'),
+            "duration": request.form.get('duration'),
+            "history": request.form.get('history'),
+            "symptoms": symptoms,
+            "predicted_img_path": record.get("heatmap_path") if record else None,
+        }
+        with span("download_pdf.submit"):
+            job = report_service.submit("clinical", data, record_id=record["id"] if record else None)
 
-        # Update patient record (if exists)
-        for record in patient_records:
-            if record.get("timestamp") == timestamp:
-                record["pdf_path"] = pdf_path
-                break
+        # Update patient record (if exists); read the old path first, the memory store updates in place
+        previous = record.get("pdf_path") if record else None
+        if record and previous != job.path:
+            patient_records.update(record["id"], pdf_path=job.path)
+            artifacts.replace(previous, job.path)
 
-        return send_file(pdf_path, as_attachment=True)
+        return report_response(job, f"report_{record['id'] if record else job.id[:16]}.pdf")
 
     except Exception as e:
+        log.exception("download_pdf.failed", record_id=record_id)
         return f"Error generating PDF: {str(e)}", 500
 
 @app.route('/patient_download_pdf', methods=['POST'])
 def patient_download_pdf():
-    # Debugging: Print form data and timestamp
-    print("Form data for patient PDF download:", request.form)
-    timestamp = request.form.get('timestamp')
-    print("Timestamp received:", timestamp)
-
-    if not timestamp:
-        print("Error: Timestamp is missing")
-        return "Timestamp is missing", 400
-
-    # Debugging: Print patient records
-    print("Patient records:", patient_records)
+    record_id = request_record_id()
+    if not record_id:
+        log.info("patient_download_pdf.missing_record_id")
+        return "Record ID is missing", 400
 
     symptoms = {}
-    for record in patient_records:
-        if record.get("timestamp") == timestamp:
-            symptoms = record.get("symptoms", {})
-            print("Matching record found:", record)
-            break
+    with span("patient_download_pdf.lookup"):
+        record = patient_records.get(record_id)
+    if record:
+        symptoms = record.get("symptoms", {})
 
     if not symptoms:
-        print("Error: No record found for the given timestamp")
-        return "No record found for the given timestamp", 404
+        log.info("patient_download_pdf.record_not_found", record_id=record_id)
+        return "No record found for the given record ID", 404
 
     return generate_pdf(
         prediction=request.form.get('prediction'),
         confidence=request.form.get('confidence'),
         image_path=request.form.get('image_path'),
-        timestamp=timestamp,
-        symptoms=symptoms
+        timestamp=record["timestamp"],
+        symptoms=symptoms,
+        record_id=record["id"]
     )
 
 def handle_pdf_request():
@@ -416,6 +515,7 @@ def handle_pdf_request():
     confidence = request.form.get('confidence')
     image_path = request.form.get('image_path')
     timestamp = request.form.get('timestamp')
+    record_id = request.form.get('record_id')
 
     symptoms = {
         "pain_level": request.form.get('pain_level'),
@@ -425,218 +525,219 @@ def handle_pdf_request():
         "history": request.form.get('history'),
     }
 
-    return generate_pdf(prediction, confidence, image_path, timestamp, symptoms)
+    return generate_pdf(prediction, confidence, image_path, timestamp, symptoms, record_id)
 
-def generate_pdf(prediction, confidence, image_path, timestamp, symptoms=None):
+def generate_pdf(prediction, confidence, image_path, timestamp, symptoms=None, record_id=None):
     try:
-        pdf = MyPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)  # 15mm bottom margin
-        pdf.set_left_margin(15)
-        pdf.set_right_margin(15)
-
-        # First page
-        pdf.add_page()
-        pdf.set_line_width(0.5)  # Thinner border
-        pdf.set_draw_color(0, 0, 0)
-        pdf.rect(7, 7, 196, 283)
-        pdf.set_line_width(0.2)
-        pdf.set_draw_color(0, 0, 0)
-        pdf.set_font("Times", size=12)
-
-        pdf.set_fill_color(135, 206, 235)  # Sky blue (RGB)
-        pdf.set_text_color(0, 0, 0)  # Black text
-        pdf.set_font("Times", 'B', 14)  # Bold Times New Roman
-        pdf.cell(200, 10, txt="Oral Cancer patient report", ln=True, align='C', fill=True)
-        pdf.set_font("Times", '', 12)  # Reset font to normal after header
-        pdf.ln(10)
-
-        
-        
-        pdf.cell(200, 10, txt=f"Prediction: {prediction}", ln=True)
-        pdf.cell(200, 10, txt=f"Confidence: {confidence}%", ln=True)
-        pdf.cell(200, 10, txt=f"Timestamp: {timestamp}", ln=True)
-        current_y = pdf.get_y() + 5  # small space below last symptom
-        pdf.set_draw_color(0, 0, 0)  # black line
-        pdf.line(10, current_y, 200, current_y)
-        pdf.ln(10)  # move cursor down for spacing after the line
-
-        if symptoms:
-            pdf.set_font("Times", "B", 12)
-            pdf.cell(200, 10, txt="Symptoms", ln=True)
-            pdf.set_font("Times", "", 12)
-            pdf.cell(200, 10, txt=f"Pain Level: {symptoms.get('pain_level', '')}", ln=True)
-            pdf.cell(200, 10, txt=f"Bleeding: {symptoms.get('bleeding', '')}", ln=True)
-            pdf.cell(200, 10, txt=f"Swelling: {symptoms.get('swelling', '')}", ln=True)
-            pdf.cell(200, 10, txt=f"Duration: {symptoms.get('duration', '')}", ln=True)
-            pdf.cell(200, 10, txt=f"Past History: {symptoms.get('history', '')}", ln=True)
-            
-            # Add habits and years
-            habits = symptoms.get('habits', [])
-            if habits:
-                pdf.cell(200, 10, txt=f"Habits: {', '.join(habits)}", ln=True)
-                if 'Tobacco' in habits and symptoms.get('tobacco_years'):
-                    pdf.cell(200, 10, txt=f"Tobacco Years: {symptoms.get('tobacco_years')}", ln=True)
-                if 'Alcohol' in habits and symptoms.get('alcohol_years'):
-                    pdf.cell(200, 10, txt=f"Alcohol Years: {symptoms.get('alcohol_years')}", ln=True)
-                if 'Smoking' in habits and symptoms.get('smoking_years'):
-                    pdf.cell(200, 10, txt=f"Smoking Years: {symptoms.get('smoking_years')}", ln=True)
-            else:
-                pdf.cell(200, 10, txt="Habits: None", ln=True)
-
-            # Add trismus test, mouth pain, and extra details
-            pdf.cell(200, 10, txt=f"3 Finger Trismus Test: {symptoms.get('trismus_test', 'Not answered')}", ln=True)
-            pdf.cell(200, 10, txt=f"Pain Opening Mouth: {symptoms.get('mouth_pain', 'Not answered')}", ln=True)
-            pdf.cell(200, 10, txt=f"Extra Details: {symptoms.get('extra_details', 'None')}", ln=True)
-
-            # Draw a straight horizontal line after symptoms
-            current_y = pdf.get_y() + 5  # small space below last symptom
-            pdf.set_draw_color(0, 0, 0)  # black line
-            pdf.line(10, current_y, 200, current_y)
-            pdf.ln(10)  # move cursor down for spacing after the line
-
-            pdf.set_font("Times", "B", 12)
-            pdf.cell(200, 10, txt="Patient Uploaded Images", ln=True)
-
-        abs_path = os.path.abspath(image_path)
-        if abs_path.lower().endswith('.png'):
-            img = Image.open(abs_path).convert('RGB')
-            converted_path = abs_path.replace(".png", "_converted.jpg")
-            img.save(converted_path)
-            abs_path = converted_path
-        try:
-            img = Image.open(abs_path)
-            img = img.convert('RGB')
-            abs_path_jpg = abs_path.rsplit('.', 1)[0] + ".jpg"
-            img.save(abs_path_jpg, "JPEG")
-            abs_path = abs_path_jpg
-        except Exception as e:
-            print(f"Image error: {e}")
-            abs_path = None
-
-        if predicted_img_path.lower().endswith('.png'):
-            img_pred = Image.open(predicted_img_path).convert('RGB')
-            predicted_img_path = predicted_img_path.replace(".png", "_converted.jpg")
-            img_pred.save(predicted_img_path)
-            pdf.image(abs_path, x=10, y=pdf.get_y(), w=60)
-            pdf.ln(70)
-        x_start = 10
-        img_width = 60
-        pdf.image(abs_path, x=x_start, y=pdf.get_y(), w=img_width)
-        pdf.image(predicted_img_path, x=x_start + img_width + 10, y=pdf.get_y(), w=img_width)
-        pdf.ln(70)
-        output_path = os.path.join('static', f"report_{timestamp}.pdf")
-        pdf.output(output_path)
-
-        return send_file(output_path, as_attachment=True)
+        record = patient_records.get(record_id) if record_id else None
+        data = {
+            "prediction": prediction,
+            "confidence": confidence,
+            "image_path": image_path,
+            "timestamp": timestamp,
+            "symptoms": symptoms,
+            "predicted_img_path": record.get("heatmap_path") if record else None,
+        }
+        with span("generate_pdf.submit"):
+            job = report_service.submit("patient", data, record_id=record_id)
+        return report_response(job, f"report_{secure_filename(record_id or timestamp or job.id[:16])}.pdf")
 
     except Exception as e:
-        print(f"PDF generation error: {e}")
+        log.exception("generate_pdf.failed", record_id=record_id)
         return f"PDF generation failed: {e}", 500
 
+def report_response(job, download_name):
+    # Pages that poll ask for JSON and get the job status; plain form posts wait for the PDF
+    if request.accept_mimetypes.best == "application/json":
+        payload = job.to_dict()
+        payload["status_url"] = url_for("report_status", job_id=job.id, name=download_name)
+        payload["download_url"] = url_for("report_download", job_id=job.id, name=download_name)
+        return jsonify(payload), 200 if job.status == "done" else 202
+    with span("report.wait"):
+        job.wait(timeout=REPORT_TIMEOUT)
+    if job.status != "done":
+        return f"PDF generation failed: {job.error}", 500
+    return send_file(os.path.abspath(job.path), as_attachment=True, download_name=download_name)
+
+@app.route('/reports/<job_id>/status')
+def report_status(job_id):
+    job = report_service.job(job_id)
+    if job is None:
+        return jsonify({"job_id": job_id, "status": "unknown"}), 404
+    payload = job.to_dict()
+    if job.status == "done":
+        payload["download_url"] = url_for("report_download", job_id=job.id, name=request.args.get("name"))
+    return jsonify(payload)
+
+@app.route('/reports/<job_id>')
+def report_download(job_id):
+    job = report_service.job(job_id)
+    if job is None or job.status == "failed":
+        return "Report not found", 404
+    if job.status != "done":
+        return jsonify(job.to_dict()), 202
+    name = secure_filename(request.args.get("name") or "") or "report.pdf"
+    return send_file(os.path.abspath(job.path), as_attachment=True, download_name=name)
+
 @app.route("/upload_image", methods=["POST"])
 def upload_image():
     image = request.files.get("image")
-    print("Image upload request received:", image)
-
     if not image or image.filename == "":
-        print("Error: No image file uploaded")
         return "No image file uploaded", 400
+    artifacts.reserve(request.content_length or 0)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"uploaded_{timestamp}.png"
-    image_path = os.path.join(UPLOAD_IMAGE_FOLDER, filename)
-    image.save(image_path)
+    # Saved under the extension of the sniffed format, in chunks
+    image_path = save_image_upload(image, shard_path(UPLOAD_STANDALONE_FOLDER, f"uploaded_{new_record_id()}", create=True))
 
-    print("Image saved at:", image_path)
+    log.info("upload_image.saved", path=image_path)
     return "Image uploaded successfully"
 
 @app.route("/upload_audio", methods=["POST"])
 def upload_audio():
     audio = request.files.get("audio")
-    timestamp = request.form.get("timestamp")
+    record_id = patient_records.resolve(request_record_id())
 
     if not audio or audio.filename == "":
         return "No audio file uploaded", 400
 
-    if not timestamp:
-        return "Timestamp is missing", 400
+    if not record_id:
+        return "Record not found", 404
+    artifacts.reserve(request.content_length or 0)
 
     # Secure the filename
-    filename = secure_filename(audio.filename)
-    audio_filename = f"{timestamp}_{filename}"
-    audio_path = os.path.join(UPLOAD_AUDIO_FOLDER, audio_filename)
-    audio.save(audio_path)
+    filename = os.path.splitext(secure_filename(audio.filename))[0]
+    audio_filename = f"{secure_filename(record_id)}_{filename}"
+    audio_path = save_audio_upload(audio, shard_path(UPLOAD_AUDIO_FOLDER, audio_filename, create=True))
 
-    # Update the patient record with audio path
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            record["audio_path"] = audio_path
-            break
+    # Update the patient record with audio path; a replaced recording is removed
+    previous = patient_records.get(record_id).get("audio_path")
+    patient_records.update(record_id, audio_path=audio_path)
+    artifacts.replace(previous, audio_path)
 
     return "Audio uploaded successfully"
 
+@app.template_global()
+def image_variant(image_path, size, fmt="jpeg"):
+    # URL of a resized copy of an upload; templates never link the original
+    if not image_path:
+        return ""
+    return url_for("image_derivative", size=size, fmt=fmt, name=os.path.basename(image_path), v=DERIVATIVE_VERSION)
+
+@app.route('/images/<size>/<fmt>/<name>')
+def image_derivative(size, fmt, name):
+    with span("images.derivative"):
+        path = derivative_store.path(name, size, fmt)
+    if path is None:
+        return "Image not found", 404
+    # Upload names never change content, so browsers may keep these for good;
+    # conditional requests still get a 304 by ETag
+    response = send_file(os.path.abspath(path), mimetype=derivative_store.mimetype(fmt),
+                         max_age=DERIVATIVE_CACHE_SECONDS, conditional=True, etag=True)
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/inference/stats')
+def inference_stats():
+    if not model_service.ready:
+        return jsonify(model_service.status()), 503, {"Retry-After": str(MODEL_RETRY_AFTER)}
+    stats = model_service.stats()
+    stats["prediction_cache"] = prediction_cache.stats()
+    stats["image_store"] = image_store.stats()
+    stats["admission"] = admission.stats()
+    stats["artifacts"] = artifacts.stats()
+    if PREDICT_TTA:
+        stats["tta"] = tta_policy.stats()
+    return jsonify(stats)
+
+DASHBOARD_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+def record_page():
+    # Cursor-paginated, server-filtered slice of the records for the dashboard and /api/records
+    args = request.args
+    try:
+        limit = min(max(int(args.get("limit", DASHBOARD_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = DASHBOARD_PAGE_SIZE
+    return patient_records.page(
+        cursor=args.get("cursor") or None,
+        limit=limit,
+        newest_first=args.get("sort") != "oldest",
+        status=args.get("status") or None,
+        follow_up={"yes": True, "no": False}.get(args.get("follow_up")),
+        risk=args.get("risk") if args.get("risk") in ("high", "low") else None,
+        date_from=(args.get("from") or "").replace("-", "") or None,
+        date_to=(args.get("to") or "").replace("-", "") or None,
+    )
+
 @app.route('/doctor_dashboard')
 def doctor_dashboard():
-    # Debugging log
-    print("Patient records for doctor:", patient_records)
+    records, next_cursor = record_page()
+    return render_template(
+        'doctor_dashboard.html',
+        records=records,
+        unread=patient_records.unread_counts([record["id"] for record in records], "doctor"),
+        next_cursor=next_cursor,
+        total=len(patient_records),
+        filters=request.args
+    )
 
-    return render_template('doctor_dashboard.html', records=patient_records)
+@app.route('/api/records')
+def api_records():
+    records, next_cursor = record_page()
+    unread = patient_records.unread_counts([record["id"] for record in records], "doctor")
+    fields = ("id", "timestamp", "username", "prediction", "confidence", "status",
+              "follow_up", "image_path", "audio_path", "pdf_path")
+    payload = {
+        "records": [dict({field: record.get(field) for field in fields}, unread=unread.get(record["id"], 0))
+                    for record in records],
+        "next_cursor": next_cursor,
+    }
+    if request.args.get("html"):
+        # Pre-rendered table rows so the dashboard can append pages as-is
+        payload["html"] = render_template('_record_rows.html', records=records, unread=unread)
+    return jsonify(payload)
 
 @app.route("/doctor_reply", methods=["POST"])
 def doctor_reply():
-    timestamp = request.form.get("timestamp")
+    record_id = request_record_id()
     message = request.form.get("message")
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            if "doctor_replies" not in record:
-                record["doctor_replies"] = []
-            record["doctor_replies"].append({
-                "message": message,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            record["status"] = "Replied"
-            break
+    if post_chat_message(record_id, "doctor", message):
+        patient_records.update(record_id, status="Replied")
     return redirect(url_for("doctor_dashboard"))
 
 @app.route("/patient_reply", methods=["POST"])
 def patient_reply():
-    timestamp = request.form.get("timestamp")
+    record_id = request_record_id()
     message = request.form.get("message")
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            if "patient_replies" not in record:
-                record["patient_replies"] = []
-            record["patient_replies"].append({
-                "message": message,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            break
+    post_chat_message(record_id, "patient", message)
     return redirect(url_for("patient_dashboard"))
 
 @app.route("/delete_record", methods=["POST"])
 def delete_record():
-    # Debugging: Print form data
-    print("Form data for delete record:", request.form)
+    record_id = request_record_id()
+    if not record_id:
+        return "Record ID is missing", 400
 
-    timestamp = request.form.get("timestamp")
-    print("Timestamp to delete:", timestamp)
-
-    if not timestamp:
-        print("Error: Timestamp is missing")
-        return "Timestamp is missing", 400
-
-    global patient_records
-    print("Patient records before deletion:", patient_records)
-    patient_records = [r for r in patient_records if r["timestamp"] != timestamp]
-    print("Patient records after deletion:", patient_records)
+    report_service.invalidate(patient_records.resolve(record_id))
+    record = patient_records.delete(record_id)
+    if record is not None:
+        # Its upload, heatmap, audio and reports go too, unless another record shares them
+        artifacts.release(record)
+    log.info("delete_record.deleted", record_id=record_id, remaining=len(patient_records))
 
     return redirect(url_for('doctor_dashboard'))
 
 @app.route('/patient_dashboard')
 def patient_dashboard():
     username = session.get("username")
-    user_records = [r for r in patient_records if r.get("username") == username]
-    return render_template('patient_dashboard.html', patient_records=user_records)
+    user_records = patient_records.for_username(username)
+    unread = patient_records.unread_counts([record["id"] for record in user_records], "patient")
+    return render_template('patient_dashboard.html', patient_records=user_records, unread=unread)
 
 @app.route('/result', methods=['GET', 'POST'])
 def result():
@@ -663,48 +764,6 @@ def result():
         timestamp=timestamp
     )
 
-def generate_clinical_details():
-    locations = [
-        "Left lateral border of the tongue",
-        "Floor of the mouth",
-        "Buccal mucosa (inner cheek)",
-        "Soft palate",
-        "Lower lip"
-    ]
-    colorations = [
-        "White patch (leukoplakia)",
-        "Red patch (erythroplakia)",
-        "White & red mixed patch (erythroleukoplakia)",
-        "Ulcerated red area"
-    ]
-    surfaces = [
-        "Irregular, mildly ulcerated",
-        "Smooth, elevated",
-        "Rough and nodular",
-        "Ulcerated with indurated margins"
-    ]
-    sizes = [
-        "0.5 x 0.5 cm",
-        "1.0 x 0.8 cm",
-        "1.2 x 1.0 cm",
-        "1.5 x 1.0 cm",
-        "1.8 x 1.2 cm",
-        "2.0 x 1.5 cm",
-        "2.2 x 1.7 cm",
-        "2.5 x 2.0 cm",
-        "3.0 x 2.5 cm",
-        "3.5 x 3.0 cm"
-    ]
-    stage = "T1"  
-
-    return {
-        "location": random.choice(locations),
-        "coloration": random.choice(colorations),
-        "surface": random.choice(surfaces),
-        "size": random.choice(sizes),
-        "stage": stage
-    }
-
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -733,105 +792,52 @@ def login():
 @app.route('/submit_patient_data', methods=['POST'])
 def submit_patient_data():
     try:
+        artifacts.reserve(request.content_length or 0)
         # Check if an image was uploaded
         if 'image' in request.files and request.files['image'].filename != '':
             file = request.files['image']
             filename = secure_filename(file.filename)
+            record_id = new_record_id()
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_filename = f"{timestamp}.jpg"
-            img_path = os.path.join('static/uploads', image_filename)
-            # Open the image file and convert to RGB
-            img = Image.open(file)
-            img = img.convert('RGB')
-            img.save(img_path, 'JPEG')
+            img = decode_upload(file)
+            img_path, _ = image_store.store(img, content_hash(img))
+            derivative_store.prepare(img, img_path)
         else:
             return "No image provided", 400
 
         # Collect symptom data
-        pain_level = request.form.get('pain_level')
-        bleeding = request.form.get('bleeding')
-        swelling = request.form.get('swelling')
-        duration = request.form.get('duration')
-        history = request.form.get('history')
-        habits = request.form.getlist('habits')
-        tobacco_years = request.form.get('tobacco_years', '')
-        alcohol_years = request.form.get('alcohol_years', '')
-        smoking_years = request.form.get('smoking_years', '')
-        trismus_test = request.form.get('trismus_test', '')
-        mouth_pain = request.form.get('mouth_pain', '')
-        extra_details = request.form.get('extra_details', '')
+        symptoms = collect_symptoms(request.form, request.form.getlist('habits'))
 
         # Store patient data dynamically
         username = session.get("username")
-        patient_record = {
-            "timestamp": timestamp,
-            "image_path": img_path,
-            "symptoms": {
-                "pain_level": pain_level,
-                "bleeding": bleeding,
-                "swelling": swelling,
-                "duration": duration,
-                "history": history,
-                "habits": habits,
-                "tobacco_years": tobacco_years,
-                "alcohol_years": alcohol_years,
-                "smoking_years": smoking_years,
-                "trismus_test": trismus_test,
-                "mouth_pain": mouth_pain,
-                "extra_details": extra_details
-            },
-            "doctor_replies": [],  # <-- store all replies here
-            "status": "Pending",
-            "voice_reply_path": None,
-            "doctor": "Dr. John Doe",
-            "prediction": "Low Risk (Non-Cancer)",
-            "confidence": "95",
-            "username": username  # <-- Add this line
-        }
-        patient_records.append(patient_record)
-
-        # Debugging log
-        print("Patient record added:", patient_record)
+        patient_record = new_patient_record(record_id, timestamp, img_path, symptoms,
+                                            "Low Risk (Non-Cancer)", "95", username)
+        patient_records.add(patient_record)
+        artifacts.claim(patient_record)
+        log.info("submit_patient_data.added", record_id=record_id)
 
         # Redirect to the Patient Dashboard
         return redirect(url_for('patient_dashboard'))
+    except UploadError:
+        raise
     except Exception as e:
+        log.exception("submit_patient_data.failed")
         return f"Error: {str(e)}", 500
 
 @app.route('/welcome')
 def welcome():
     return render_template('welcome.html')
 
-from fpdf import FPDF
-
-class MyPDF(FPDF):
-    def footer(self):
-        self.set_y(-9.0)  # Adjust this value to position just below the border
-        self.set_font("Arial", 'I', 9)
-        self.set_text_color(0,0,0)  # Nice blue color
-        self.cell(
-            0, 10,
-            "Developed under JITD",
-            align='C'
-        )
-
-
 @app.route("/flag_follow_up", methods=["POST"])
 def flag_follow_up():
-    timestamp = request.form.get("timestamp")
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            record["follow_up"] = True
-            break
+    record_id = request_record_id()
+    patient_records.update(record_id, follow_up=True)
     return redirect(url_for("doctor_dashboard"))
 
 @app.route("/unflag_follow_up", methods=["POST"])
 def unflag_follow_up():
-    timestamp = request.form.get("timestamp")
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            record["follow_up"] = False
-            break
+    record_id = request_record_id()
+    patient_records.update(record_id, follow_up=False)
     return redirect(url_for("doctor_dashboard"))
 
 @app.route('/logout', methods=['POST'])
@@ -849,54 +855,110 @@ def edit_doctor_profile():
 @app.route('/chat')
 def chat():
     # Patient chat window
-    timestamp = request.args.get('timestamp')
-    record = next((r for r in patient_records if r['timestamp'] == timestamp), None)
+    record = patient_records.get(request_record_id())
     if not record:
         return "Record not found", 404
-    return render_template('chat.html', record=record)
+    messages = patient_records.messages_since(record["id"])
+    mark_chat_read(record["id"], "patient")
+    return render_template('chat.html', record=record, messages=messages)
 
 @app.route('/chat_doctor')
 def chat_doctor():
     # Doctor chat window
-    timestamp = request.args.get('timestamp')
-    record = next((r for r in patient_records if r['timestamp'] == timestamp), None)
+    record = patient_records.get(request_record_id())
     if not record:
         return "Record not found", 404
-    return render_template('chat_doctor.html', record=record)
+    messages = patient_records.messages_since(record["id"])
+    mark_chat_read(record["id"], "doctor")
+    return render_template('chat_doctor.html', record=record, messages=messages)
 
 @app.route('/chat_reply', methods=['POST'])
 def chat_reply():
     # Patient sends message
-    timestamp = request.form.get('timestamp')
+    record_id = request_record_id()
     message = request.form.get('message')
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            if "patient_replies" not in record:
-                record["patient_replies"] = []
-            record["patient_replies"].append({
-                "message": message,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            break
-    return redirect(url_for('chat', timestamp=timestamp))
+    post_chat_message(record_id, "patient", message)
+    return redirect(url_for('chat', record_id=record_id))
 
 @app.route('/chat_reply_doctor', methods=['POST'])
 def chat_reply_doctor():
     # Doctor sends message
-    timestamp = request.form.get('timestamp')
+    record_id = request_record_id()
     message = request.form.get('message')
-    for record in patient_records:
-        if record["timestamp"] == timestamp:
-            if "doctor_replies" not in record:
-                record["doctor_replies"] = []
-            record["doctor_replies"].append({
-                "message": message,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            break
-    return redirect(url_for('chat_doctor', timestamp=timestamp))
-
+    post_chat_message(record_id, "doctor", message)
+    return redirect(url_for('chat_doctor', record_id=record_id))
+
+def post_chat_message(record_id, sender, message):
+    # Append to the record's chat log and push it to every open chat window
+    record_id = patient_records.resolve(record_id)
+    if record_id is None:
+        return None
+    entry = patient_records.append_message(
+        record_id, sender, message, datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+    if entry is None:
+        return None
+    if entry["seq"] is not None:
+        chat_broker.publish(record_id, entry["seq"], entry)
+    # Otherwise the sql backend numbers it at its batch commit and publishes it from there
+    return entry
+
+def publish_committed(record_id, entries):
+    for entry in entries:
+        chat_broker.publish(record_id, entry["seq"], entry)
+
+if hasattr(patient_records, "on_commit"):
+    patient_records.on_commit = publish_committed
+
+def mark_chat_read(record_id, role, seq=None):
+    # Read receipt: the other side's open window ticks its messages up to read_seq
+    read_seq = patient_records.mark_read(record_id, role, seq)
+    if read_seq is not None:
+        chat_broker.publish(record_id, None, {"role": role, "read_seq": read_seq}, event="read")
+    return read_seq
+
+@app.route('/chat/stream')
+def chat_stream():
+    record = patient_records.get(request_record_id())
+    if not record:
+        return "Record not found", 404
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since") or 0)
+    except ValueError:
+        since = 0
+    # Subscribe before reading the backlog so nothing posted in between is lost;
+    # the page skips events it already has by ID.
+    subscription = chat_broker.subscribe(record["id"])
+    backlog = [(message["seq"], message) for message in patient_records.messages_since(record["id"], since)]
+    return Response(
+        chat_event_stream(chat_broker, subscription, backlog),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+@app.route('/api/chat/<record_id>/messages', methods=['POST'])
+def api_chat_message(record_id):
+    payload = request.get_json(silent=True) or {}
+    message = (payload.get("message") or "").strip()
+    sender = payload.get("sender") or ("doctor" if session.get("role") == "doctor" else "patient")
+    if not message or sender not in ("doctor", "patient"):
+        return jsonify({"error": "A message and a sender of 'doctor' or 'patient' are required"}), 400
+    if post_chat_message(record_id, sender, message) is None:
+        return jsonify({"error": "Record not found"}), 404
+    return "", 204
+
+@app.route('/api/chat/<record_id>/read', methods=['POST'])
+def api_chat_read(record_id):
+    payload = request.get_json(silent=True) or {}
+    role = payload.get("role") or ("doctor" if session.get("role") == "doctor" else "patient")
+    if role not in ("doctor", "patient"):
+        return jsonify({"error": "role must be 'doctor' or 'patient'"}), 400
+    seq = payload.get("seq")
+    if seq is not None and not isinstance(seq, int):
+        return jsonify({"error": "seq must be an integer"}), 400
+    if mark_chat_read(record_id, role, seq) is None:
+        return jsonify({"error": "Record not found"}), 404
+    return "", 204
 
 
 if __name__ == '__main__':
@@ -0,0 +1,411 @@
+"""Sharded storage for uploads and generated files, with owner tracking, orphan collection and quotas.
+
+Uploads, audio, heatmaps, derivatives and cached reports used to go into a
+few flat directories. With hundreds of thousands of entries in one
+directory, listing it and creating or opening a file in it slow down. Nothing
+was ever removed either: deleting a record left its photo, audio, heatmap,
+resized copies and PDFs behind.
+
+Layout: a file goes two levels below its folder, in directories named after
+a hash of its file name::
+
+    static/uploads/3f/a0/<sha256>.jpg
+    static/derivatives/thumb/3f/a0/<sha256>.jpg.webp
+
+That gives 65,536 leaf directories per folder: a million files is about 15
+per directory, and a hundred million about 1,500. A derivative is sharded by
+its upload's name. Files from before the change stay where they are;
+``locate`` looks in the sharded place first, then in the flat one.
+
+Ownership: records point at their files (``image_path``, ``heatmap_path``,
+``audio_path``, ``voice_reply_path``, ``pdf_path``). ``ArtifactStore`` counts
+the records that reference each path; identical photos share one upload and
+heatmap, so those can have several owners. The counts are rebuilt from the
+record store at startup and on every sweep. Deleting a record releases its
+paths and removes the files no other record owns, along with an upload's
+derivatives.
+
+Sweep: every ``ARTIFACT_SWEEP_SECONDS`` a background thread walks the
+folders and removes:
+
+- uploads, audio and heatmaps in the sharded layout that no record references
+- derivatives of uploads that no record references
+- cached reports and converted report images that no record references,
+  once they are older than ``ARTIFACT_CACHE_SECONDS``
+
+Unowned uploads, audio and heatmaps are only removed when the record store
+is ``persistent`` (the journal or SQL). The plain in-memory store starts
+empty after a restart, so it cannot tell which files older records still
+point to. Then the sweep only removes derivatives and cached reports, which
+are made again on demand.
+
+Files in a kept area (``KEPT``: images sent to ``/upload_image``, which
+belong to no record) count towards the quota but are never swept.
+
+Shared files (uploads and heatmaps) and unreferenced files are kept for
+``ARTIFACT_GRACE_SECONDS`` after they were last written. A photo is archived
+before its record is saved, and a repeat upload touches the file it reuses,
+so a file that is about to be claimed is never removed.
+
+Quotas: with ``ARTIFACT_QUOTA_MB``, uploads are refused with 507 once the
+bytes measured by the last sweep, plus those accepted since, would pass the
+quota. The sweep then evicts derivatives and cached reports, oldest first,
+since both are made again on demand. ``ARTIFACT_MIN_FREE_MB`` refuses
+uploads when the disk's free space would drop below it.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import metrics
+from logs import get_logger
+from uploads import UploadError
+
+REFERENCE_FIELDS = ("image_path", "heatmap_path", "audio_path", "voice_reply_path", "pdf_path")
+SHARED = ("uploads", "heatmaps")  # content-addressed: one file for many records
+REGENERABLE = ("derivatives", "reports")  # made again on demand; evicted under quota pressure
+KEPT = ("standalone",)  # owned by no record, removed only by hand
+PRESSURE_GAP_SECONDS = 60  # least time between sweeps started by a full quota
+
+REMOVED = metrics.REGISTRY.counter(
+    "oralscan_artifacts_removed_total", "Stored files removed", labels=("area", "reason"))
+REJECTED = metrics.REGISTRY.counter(
+    "oralscan_artifact_uploads_rejected_total", "Uploads refused for lack of space", labels=("reason",))
+SWEEP_SECONDS = metrics.REGISTRY.histogram(
+    "oralscan_artifact_sweep_seconds", "Time to walk every artifact folder",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+
+log = get_logger("artifacts")
+
+def shard_dir(folder, name):
+    digest = hashlib.blake2b(name.encode(), digest_size=2).hexdigest()
+    return os.path.join(folder, digest[:2], digest[2:])
+
+
+def shard_path(folder, name, create=False):
+    """Where ``name`` lives under ``folder``; ``create`` makes its directory."""
+    directory = shard_dir(folder, name)
+    if create and not os.path.isdir(directory):
+        # One stat when the directory exists; makedirs alone costs several syscalls
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def locate(folder, name):
+    """Existing file ``name`` under ``folder``, sharded or from the flat layout; None if neither."""
+    for path in (shard_path(folder, name), os.path.join(folder, name)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def touch(path):
+    # Restarts the grace period of a file that is about to be claimed again
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _is_shard(name):
+    return len(name) == 2 and all(char in "0123456789abcdef" for char in name)
+
+
+class ArtifactStore:
+    """Owner counts, removal and quotas for the files under ``folders`` (area -> folder)."""
+
+    def __init__(self, records, folders, derived=None, grace_seconds=600, cache_seconds=7 * 86400,
+                 quota_bytes=0, min_free_bytes=0, sweep_seconds=3600, pause=0.005):
+        self.records = records
+        # A store that starts empty after a restart does not know every owner
+        self.owners_known = getattr(records, "persistent", True)
+        self.folders = {area: os.path.normpath(folder) for area, folder in folders.items()}
+        # Upload name -> paths of its derivatives, removed with the upload
+        self.derived = derived
+        self.grace_seconds = grace_seconds
+        self.cache_seconds = cache_seconds
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.sweep_seconds = sweep_seconds
+        self.pause = pause  # sleep after each top-level shard, so a sweep does not hog the disk
+        self._lock = threading.Lock()
+        self._counts = None  # path -> records referencing it; None until the first count
+        self._claimed = None  # paths claimed while a count is running
+        self._used = None  # bytes measured by the last sweep
+        self._accepted = 0  # bytes of uploads accepted since
+        self._usage = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sweeps = 0
+        self.last_sweep = None
+        metrics.REGISTRY.register_callback("oralscan_artifact_bytes", "gauge",
+                                           "Bytes under the artifact folders at the last sweep", lambda: self._used)
+        metrics.REGISTRY.register_callback("oralscan_artifact_tracked_paths", "gauge", "Paths owned by records",
+                                           lambda: len(self._counts) if self._counts is not None else None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="artifact-sweep", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+    # Ownership
+
+    def _paths(self, record):
+        return [os.path.normpath(record[field]) for field in REFERENCE_FIELDS if record.get(field)]
+
+    def _area(self, path):
+        for area, folder in self.folders.items():
+            if path.startswith(folder + os.sep):
+                return area
+        return None
+
+    def _count(self, paths, delta):
+        with self._lock:
+            if self._claimed is not None and delta > 0:
+                self._claimed.extend(paths)
+            if self._counts is None:
+                return []
+            released = []
+            for path in paths:
+                count = self._counts.get(path, 0) + delta
+                if count > 0:
+                    self._counts[path] = count
+                else:
+                    self._counts.pop(path, None)
+                    released.append(path)
+            return released
+
+    def claim(self, record):
+        """Count a new record as the owner of its files."""
+        self._count(self._paths(record), 1)
+
+    def replace(self, old_path, new_path):
+        """A record's file field changed from ``old_path`` to ``new_path``."""
+        if new_path:
+            self._count([os.path.normpath(new_path)], 1)
+        if old_path and old_path != new_path:
+            for path in self._count([os.path.normpath(old_path)], -1):
+                self._remove(path, "replaced")
+
+    def release(self, record):
+        """Drop a deleted record's ownership and remove the files nobody else owns."""
+        for path in self._count(self._paths(record), -1):
+            self._remove(path, "record")
+
+    def _remove(self, path, reason):
+        area = self._area(path)
+        if area is None:
+            return False
+        try:
+            if area in SHARED and time.time() - os.stat(path).st_mtime < self.grace_seconds:
+                # Possibly just reused by a screening not saved yet; the sweep gets it later
+                return False
+            os.remove(path)
+        except OSError:
+            return False
+        REMOVED.inc(area=area, reason=reason)
+        if area == "uploads" and self.derived is not None:
+            for derived_path in self.derived(os.path.basename(path)):
+                try:
+                    os.remove(derived_path)
+                    REMOVED.inc(area="derivatives", reason=reason)
+                except OSError:
+                    pass
+        return True
+
+    def recount(self):
+        """Rebuild the owner counts from the record store; returns them."""
+        with self._lock:
+            self._claimed = []
+        counts = {}
+        for record in self.records.all():
+            for path in self._paths(record):
+                counts[path] = counts.get(path, 0) + 1
+        with self._lock:
+            # Claims made during the count may be in it already: counting them
+            # twice only keeps a file longer, missing one could remove it
+            for path in self._claimed:
+                counts[path] = counts.get(path, 0) + 1
+            self._claimed = None
+            self._counts = counts
+        return counts
+
+    # Quotas
+
+    def reserve(self, nbytes):
+        """Accept ``nbytes`` of new uploads, or raise ``UploadError`` (507) if they do not fit."""
+        reason = None
+        if self.min_free_bytes and shutil.disk_usage(self.folders["uploads"]).free - nbytes < self.min_free_bytes:
+            reason = "disk"
+        elif self.quota_bytes:
+            with self._lock:
+                if self._used is not None and self._used + self._accepted + nbytes > self.quota_bytes:
+                    reason = "quota"
+                else:
+                    self._accepted += nbytes
+        if reason is not None:
+            REJECTED.inc(reason=reason)
+            self._wake.set()
+            raise UploadError("Not enough storage space for this upload", 507)
+
+    # Sweep
+
+    def _files(self, area, folder):
+        """``(path, stat, sharded)`` for each file of an area; yields None after each top-level shard."""
+        roots = [folder]
+        if area == "derivatives":
+            roots = [entry.path for entry in _scan(folder) if entry.is_dir()]
+        for root in roots:
+            for entry in _scan(root):
+                if entry.is_file():
+                    yield entry.path, entry.stat(), False
+                elif _is_shard(entry.name) and entry.is_dir():
+                    for middle in _scan(entry.path):
+                        if _is_shard(middle.name) and middle.is_dir():
+                            for leaf in _scan(middle.path):
+                                if leaf.is_file():
+                                    yield leaf.path, leaf.stat(), True
+                    yield None
+
+    def sweep(self):
+        """Recount owners, remove orphans and, over quota, evict regenerable files."""
+        started = time.perf_counter()
+        counts = self.recount()
+        uploads = self.folders.get("uploads")
+        upload_names = {os.path.basename(path) for path in counts if uploads and path.startswith(uploads + os.sep)}
+        now = time.time()
+        usage, removed = {}, 0
+        evictable = {}  # hour of last write -> bytes of regenerable files
+        for area, folder in self.folders.items():
+            files = size = 0
+            for item in self._files(area, folder):
+                if item is None:
+                    self._stop.wait(self.pause)
+                    continue
+                path, stat, sharded = item
+                age = now - stat.st_mtime
+                if area == "derivatives":
+                    referenced = os.path.basename(path).rsplit(".", 1)[0] in upload_names
+                else:
+                    referenced = counts.get(path, 0) > 0
+                if not referenced and area not in KEPT and (self.owners_known or area in REGENERABLE):
+                    limit = self.cache_seconds if area == "reports" else self.grace_seconds
+                    if (sharded or area in REGENERABLE) and age > limit and _unlink(path):
+                        REMOVED.inc(area=area, reason="orphan")
+                        removed += 1
+                        continue
+                files += 1
+                size += stat.st_size
+                if area in REGENERABLE and age > self.grace_seconds:
+                    hour = int(stat.st_mtime // 3600)
+                    evictable[hour] = evictable.get(hour, 0) + stat.st_size
+            usage[area] = {"files": files, "bytes": size}
+        used = sum(area["bytes"] for area in usage.values())
+        if self.quota_bytes and used > self.quota_bytes:
+            freed, evicted = self._evict(evictable, used - int(self.quota_bytes * 0.9), now)
+            used -= freed
+            removed += evicted
+        with self._lock:
+            self._used = used
+            self._accepted = 0
+            self._usage = usage
+        elapsed = time.perf_counter() - started
+        SWEEP_SECONDS.observe(elapsed)
+        self.sweeps += 1
+        self.last_sweep = {"seconds": round(elapsed, 3), "removed": removed, "bytes": used, "at": now}
+        log.info("artifacts.sweep", seconds=round(elapsed, 3), removed=removed, bytes=used,
+                 files=sum(area["files"] for area in usage.values()))
+        return self.last_sweep
+
+    def _evict(self, evictable, needed, now):
+        # Oldest hours first, up to the hour that frees enough
+        cutoff, total = None, 0
+        for hour in sorted(evictable):
+            total += evictable[hour]
+            cutoff = (hour + 1) * 3600
+            if total >= needed:
+                break
+        if cutoff is None:
+            log.warning("artifacts.quota_exceeded", needed=needed)
+            return 0, 0
+        freed = evicted = 0
+        for area in REGENERABLE:
+            if area not in self.folders:
+                continue
+            for item in self._files(area, self.folders[area]):
+                if item is None:
+                    continue
+                path, stat, _ = item
+                if stat.st_mtime < cutoff and now - stat.st_mtime > self.grace_seconds and _unlink(path):
+                    REMOVED.inc(area=area, reason="quota")
+                    freed += stat.st_size
+                    evicted += 1
+        log.info("artifacts.evicted", files=evicted, bytes=freed, needed=needed)
+        return freed, evicted
+
+    def _run(self):
+        try:
+            self.recount()
+        except Exception:
+            log.exception("artifacts.recount_failed")
+        if self.sweep_seconds <= 0:
+            return
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("artifacts.sweep_failed")
+            self._wake.wait(self.sweep_seconds)
+            self._wake.clear()
+            # A full quota wakes the sweep early, but not over and over
+            self._stop.wait(max(0.0, PRESSURE_GAP_SECONDS - (time.monotonic() - started)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked_paths": len(self._counts) if self._counts is not None else None,
+                "areas": dict(self._usage),
+                "bytes": self._used,
+                "accepted_since_sweep": self._accepted,
+                "quota_bytes": self.quota_bytes or None,
+                "sweeps": self.sweeps,
+                "last_sweep": self.last_sweep,
+            }
+
+
+def _scan(folder):
+    # A generator, so a flat legacy folder of a million files is never listed into memory
+    try:
+        with os.scandir(folder) as entries:
+            yield from entries
+    except OSError:
+        return
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def artifacts_from_env(records, folders, derived=None):
+    return ArtifactStore(
+        records,
+        folders,
+        derived=derived,
+        grace_seconds=float(os.environ.get("ARTIFACT_GRACE_SECONDS", 600)),
+        cache_seconds=float(os.environ.get("ARTIFACT_CACHE_SECONDS", 7 * 86400)),
+        quota_bytes=int(float(os.environ.get("ARTIFACT_QUOTA_MB", 0)) * 1024 * 1024),
+        min_free_bytes=int(float(os.environ.get("ARTIFACT_MIN_FREE_MB", 0)) * 1024 * 1024),
+        sweep_seconds=float(os.environ.get("ARTIFACT_SWEEP_SECONDS", 3600)),
+    )
@@ -0,0 +1,301 @@
+"""ASGI serving mode: an event loop in front of the Flask app.
+
+    uvicorn asgi:application --workers 1
+    REPORT_EXECUTOR=process uvicorn asgi:application
+
+Under a threaded WSGI server every request holds a thread, and a burst of
+``/predict`` calls can take every thread while they wait on the model and
+the PDF renderer. Here the event loop owns the connections. It reads
+request bodies (spooled to disk past ``UPLOAD_SPOOL_KB``) and writes
+responses. Each request runs the Flask view on one of three thread pools,
+picked by route:
+
+- ``cpu``: routes that run inference, PDF rendering or image decoding
+  (``CPU_ROUTES``). ``ASGI_CPU_THREADS`` run at once (default: the CPU
+  count) and ``ASGI_CPU_QUEUE`` more may wait (default 4 per thread). Past
+  that, the request is answered 503 with ``Retry-After`` before its body is
+  read
+- ``io``: dashboards, chat, uploads, pages (``ASGI_IO_THREADS``, default 64).
+  Requests queue for a thread without limit; these views are short
+- ``stream``: Server-Sent Events responses. A thread is held only while
+  waiting for the next event, up to ``KEEPALIVE_SECONDS``. Each open stream
+  (``STREAM_ROUTES``) is admitted for its whole life, so at most
+  ``ASGI_STREAM_THREADS`` (default 256) are open at once; past that a new
+  one is answered 503 with ``Retry-After`` and the browser reconnects later
+
+Dashboards and chat therefore never queue behind predictions, however many
+arrive. The heavy work itself runs off these pools: inference on the
+batching engine, PDFs on the report pool (worker processes with
+``REPORT_EXECUTOR=process``) and image re-encodes on the archive and
+derivative pools.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from app import app as flask_app, BULK_MAX_UPLOAD, MODEL_RETRY_AFTER
+from logs import get_logger
+from uploads import SPOOL_BYTES
+
+CPU_ROUTES = ("/predict", "/bulk_predict", "/download_pdf", "/patient_download_pdf", "/submit_patient_data")
+STREAM_ROUTES = ("/chat/stream",)
+CPU_THREADS = int(os.environ.get("ASGI_CPU_THREADS", os.cpu_count() or 4))
+CPU_QUEUE = int(os.environ.get("ASGI_CPU_QUEUE", 4 * CPU_THREADS))
+IO_THREADS = int(os.environ.get("ASGI_IO_THREADS", 64))
+STREAM_THREADS = int(os.environ.get("ASGI_STREAM_THREADS", 256))
+# Flask checks the exact per-route limit; this only stops spooling hopeless bodies
+MAX_BODY = max(flask_app.config["MAX_CONTENT_LENGTH"] or 0, BULK_MAX_UPLOAD)
+
+log = get_logger("asgi")
+
+REJECTED = metrics.REGISTRY.counter(
+    "oralscan_asgi_rejected_total", "Requests refused with 503 because their pool was full", ("pool",))
+POOL_WAIT = metrics.REGISTRY.histogram(
+    "oralscan_asgi_pool_wait_seconds", "Time a request waited for a pool thread", ("pool",))
+
+
+class Pool:
+    """A thread pool that admits at most ``threads + queue`` requests at once."""
+
+    def __init__(self, name, threads, queue=None):
+        self.name = name
+        self.limit = None if queue is None else threads + queue
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"asgi-{name}")
+        self.admitted = 0
+        self._lock = threading.Lock()
+        metrics.REGISTRY.register_callback(f"oralscan_asgi_{name}_admitted", "gauge",
+                                           f"Requests running or waiting on the {name} pool", lambda: self.admitted)
+
+    def try_admit(self):
+        with self._lock:
+            if self.limit is not None and self.admitted >= self.limit:
+                REJECTED.inc(pool=self.name)
+                return False
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.admitted -= 1
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        queued = loop.time()
+
+        def timed():
+            POOL_WAIT.observe(loop.time() - queued, pool=self.name)
+            return fn(*args)
+
+        return await loop.run_in_executor(self.executor, timed)
+
+
+POOLS = {
+    "cpu": Pool("cpu", CPU_THREADS, CPU_QUEUE),
+    "io": Pool("io", IO_THREADS),
+    # One admission per open stream, and each stream uses at most one thread at a time
+    "stream": Pool("stream", STREAM_THREADS, 0),
+}
+
+
+def pool_for(path):
+    return POOLS["cpu"] if path in CPU_ROUTES else POOLS["io"]
+
+
+def build_environ(scope, body):
+    path = scope.get("raw_path") or scope["path"].encode("utf-8")
+    path = path.decode("latin-1").split("?", 1)[0]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path,
+        "PATH_INFO": path,
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]) if server[1] is not None else "80",
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    # The body is already spooled, so its length is known even for chunked uploads
+    body.seek(0, os.SEEK_END)
+    environ["CONTENT_LENGTH"] = str(body.tell())
+    body.seek(0)
+    return environ
+
+
+def call_app(environ):
+    """Run the Flask app; returns status, headers, the body so far and, for streams, the rest."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        return lambda data: started.setdefault("written", []).append(data)
+
+    result = flask_app(environ, start_response)
+    iterator = iter(result)
+    chunks = list(started.get("written", []))
+    streaming = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in started["headers"])
+    if streaming:
+        # Every chunk is fetched on the stream pool: the next one may be a keepalive away
+        return started["status"], started["headers"], chunks, (iterator, result)
+    try:
+        chunks.extend(iterator)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], chunks, None
+
+
+async def read_body(receive):
+    """Request body spooled to disk past ``SPOOL_BYTES``.
+
+    Returns False if the client went away and None if the body is over ``MAX_BODY``.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="w+b")
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            body.close()
+            return False
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY:
+            body.close()
+            return None
+        body.write(chunk)
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+async def send_simple(send, status, text, headers=()):
+    payload = text.encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"text/plain; charset=utf-8"),
+        (b"content-length", str(len(payload)).encode()),
+        *headers,
+    ]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def stream_rest(send, receive, iterator, result):
+    """Forward a streaming response until it ends or the client disconnects."""
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch())
+    stream_pool = POOLS["stream"]
+    try:
+        while not disconnected.is_set():
+            # A disconnect is noticed at the next event or keepalive
+            chunk = await stream_pool.run(next, iterator, None)
+            if chunk is None:
+                break
+            try:
+                await send({"type": "http.response.body", "body": _bytes(chunk), "more_body": True})
+            except OSError:
+                break
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        if hasattr(result, "close"):
+            # Runs the generator's cleanup (unsubscribing from the chat broker)
+            await stream_pool.run(result.close)
+
+
+def _bytes(chunk):
+    return chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+async def handle_http(scope, receive, send):
+    stream_pool = POOLS["stream"] if scope["path"] in STREAM_ROUTES else None
+    if stream_pool is not None and not stream_pool.try_admit():
+        await send_simple(send, 503, "Too many open event streams, please retry shortly",
+                          [(b"retry-after", str(MODEL_RETRY_AFTER).encode())])
+        return
+    try:
+        await serve_http(scope, receive, send)
+    finally:
+        if stream_pool is not None:
+            stream_pool.release()
+
+
+async def serve_http(scope, receive, send):
+    pool = pool_for(scope["path"])
+    if not pool.try_admit():
+        await send_simple(send, 503, "The server is busy, please retry shortly",
+                          [(b"retry-after", str(MODEL_RETRY_AFTER).encode())])
+        return
+    stream = None
+    try:
+        body = await read_body(receive)
+        if body is False:
+            return
+        if body is None:
+            await send_simple(send, 413, "Request body is too large")
+            return
+        try:
+            status, headers, chunks, stream = await pool.run(call_app, build_environ(scope, body))
+        finally:
+            body.close()
+    finally:
+        pool.release()
+
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    if stream is None:
+        await send({"type": "http.response.body", "body": b"".join(_bytes(chunk) for chunk in chunks)})
+        return
+    if chunks:
+        await send({"type": "http.response.body", "body": b"".join(_bytes(chunk) for chunk in chunks), "more_body": True})
+    await stream_rest(send, receive, *stream)
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            log.info("asgi.started", cpu_threads=CPU_THREADS, cpu_queue=CPU_QUEUE, io_threads=IO_THREADS)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for pool in POOLS.values():
+                pool.executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http":
+        await handle_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
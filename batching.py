@@ -0,0 +1,148 @@
+"""Micro-batching scheduler that sits in front of the prediction model.
+
+Concurrent /predict requests each submit a single preprocessed image. A
+worker thread collects them for at most ``max_wait_ms`` (or until
+``max_batch_size`` images are waiting), stacks them into one tensor, runs a
+single forward pass and hands every caller its own row of the output.
+"""
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Request:
+    __slots__ = ("array", "future", "enqueued")
+
+    def __init__(self, array):
+        self.array = array
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class BatchingEngine:
+    """Gathers single-image requests into batched calls of ``predict_fn``.
+
+    ``predict_fn`` receives an array of shape (n, ...) and must return an
+    array whose first dimension is n. With ``max_batch_size`` <= 1 the engine
+    runs unbatched: each caller runs ``predict_fn`` on its own thread.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, stats_window=1024):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._waits = collections.deque(maxlen=stats_window)
+        self._wait_total = 0.0
+        self._requests = 0
+        self._batches = 0
+
+    @property
+    def batched(self):
+        return self.max_batch_size > 1
+
+    def start(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout=None):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+
+    def submit(self, array):
+        """Queue one image (without batch axis) and return a Future for its output row."""
+        request = _Request(np.asarray(array, dtype=np.float32))
+        if not self.batched:
+            self._run_batch([request])
+            return request.future
+        self.start()
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, array, timeout=None):
+        return self.submit(array).result(timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            histogram = dict(sorted(self._batch_sizes.items()))
+            requests, batches, wait_total = self._requests, self._batches, self._wait_total
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p / 100.0 * len(waits)))] * 1000.0
+
+        return {
+            "batched": self.batched,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth(),
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "wait_ms": {
+                "mean": wait_total / requests * 1000.0 if requests else 0.0,
+                "p50": percentile(50),
+                "p99": percentile(99),
+                "max": waits[-1] * 1000.0 if waits else 0.0,
+            },
+        }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the sentinel back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            self._run_batch(self._collect(first))
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._batches += 1
+            self._requests += len(batch)
+            for request in batch:
+                wait = started - request.enqueued
+                self._waits.append(wait)
+                self._wait_total += wait
+        try:
+            outputs = self.predict_fn(np.stack([request.array for request in batch]))
+        except Exception as exc:
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+        for request, output in zip(batch, outputs):
+            request.future.set_result(output)
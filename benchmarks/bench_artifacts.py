@@ -0,0 +1,134 @@
+"""Artifact layout benchmark: flat vs sharded directories as the file count grows, and the sweep.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_artifacts --files 1000000 --checkpoints 10000,100000,1000000
+
+Fills a flat directory and a sharded one (``artifacts.shard_path``) with
+empty upload-sized names and, at each checkpoint, reports per-operation
+latency (p50/p95 in microseconds) for:
+
+- create: a new file, as an upload write does
+- open: an existing file chosen at random, as a derivative or report does
+- miss: a lookup of a name that is not there, as dedup does for a new photo
+- list: listing the directory a file lives in, as a backup or cleanup does
+
+Then sweeps the sharded tree with an ``ArtifactStore`` whose records own
+half of the files, and reports the sweep time and the files it removed.
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from artifacts import ArtifactStore, shard_path
+
+
+class Records:
+    def __init__(self, records):
+        self.records = records
+
+    def all(self):
+        return list(self.records)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100.0 * len(values)))]
+
+
+def name_for(index):
+    return hashlib.sha256(str(index).encode()).hexdigest() + ".jpg"
+
+
+def create(path):
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+def measure(folder, locate, created, samples, rng):
+    results = {}
+    timings = []
+    for index in range(created, created + samples):
+        started = time.perf_counter()
+        create(locate(folder, name_for(index), True))
+        timings.append(time.perf_counter() - started)
+    results["create"] = timings
+    timings = []
+    for _ in range(samples):
+        path = locate(folder, name_for(rng.randrange(created)), False)
+        started = time.perf_counter()
+        os.close(os.open(path, os.O_RDONLY))
+        timings.append(time.perf_counter() - started)
+    results["open"] = timings
+    timings = []
+    for index in range(samples):
+        path = locate(folder, f"missing-{index}.jpg", False)
+        started = time.perf_counter()
+        os.path.exists(path)
+        timings.append(time.perf_counter() - started)
+    results["miss"] = timings
+    timings = []
+    for _ in range(max(1, samples // 100)):
+        path = locate(folder, name_for(rng.randrange(created)), False)
+        started = time.perf_counter()
+        os.listdir(os.path.dirname(path))
+        timings.append(time.perf_counter() - started)
+    results["list"] = timings
+    return results
+
+
+def flat(folder, name, create_dir):
+    return os.path.join(folder, name)
+
+
+def sharded(folder, name, create_dir):
+    return shard_path(folder, name, create_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=1000000)
+    parser.add_argument("--checkpoints", default="10000,100000,1000000")
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    checkpoints = sorted(min(int(value), args.files) for value in args.checkpoints.split(","))
+    workdir = tempfile.mkdtemp(prefix="oralscan-artifacts-")
+    try:
+        layouts = {"flat": (os.path.join(workdir, "flat"), flat),
+                   "sharded": (os.path.join(workdir, "uploads"), sharded)}
+        for folder, _ in layouts.values():
+            os.makedirs(folder)
+        created = 0
+        print(f"{'files':>9} {'layout':>8} " + " ".join(f"{op + ' p50/p95':>17}" for op in ("create", "open", "miss", "list")))
+        for checkpoint in checkpoints:
+            started = time.perf_counter()
+            for folder, locate in layouts.values():
+                for index in range(created, checkpoint):
+                    create(locate(folder, name_for(index), True))
+            fill = time.perf_counter() - started
+            created = checkpoint
+            for label, (folder, locate) in layouts.items():
+                results = measure(folder, locate, created, args.samples, rng)
+                cells = " ".join(f"{percentile(results[op], 50) * 1e6:>8.1f}/{percentile(results[op], 95) * 1e6:<8.1f}"
+                                 for op in ("create", "open", "miss", "list"))
+                print(f"{created:>9} {label:>8} {cells}")
+            created += args.samples
+            print(f"          (filled to {checkpoint} in {fill:.1f}s for both layouts)")
+
+        uploads = layouts["sharded"][0]
+        records = Records([{"image_path": shard_path(uploads, name_for(index))} for index in range(0, created, 2)])
+        store = ArtifactStore(records, {"uploads": uploads}, grace_seconds=0, sweep_seconds=0, pause=0)
+        sweep = store.sweep()
+        print(f"\nsweep of {created} sharded files, {len(records.records)} owned: "
+              f"{sweep['seconds']:.1f}s, removed {sweep['removed']} orphans")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Interactive latency while predictions saturate the CPU: threaded WSGI vs ASGI.
+
+Run from the repository root (the ``asgi`` mode needs uvicorn):
+
+    python -m benchmarks.bench_asgi --predict-clients 32 --seconds 15
+
+For each server mode, starts the seeded app from ``bench_load`` with the
+stand-in model and the prediction cache off. The benchmark first probes the
+doctor dashboard, patient dashboard, chat page and chat message API with
+the server idle. It then probes again while ``--predict-clients`` clients
+post a stream of distinct photos to ``/predict``. It reports p50/p95/p99
+probe latency idle and under load, the predictions per second, and how
+many predictions were turned away with 503 (ASGI backpressure).
+"""
+import argparse
+import itertools
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.bench_load import (Scenarios, multipart, percentile, prepare_workdir, request, start_server,
+                                   synthetic_photo)
+
+PROBES = ("doctor_dashboard", "patient_dashboard", "chat_page", "chat_send")
+
+
+def probe(port, scenarios, seconds, interval, threads):
+    latencies = {name: [] for name in PROBES}
+    deadline = time.perf_counter() + seconds
+
+    def run():
+        for name in itertools.cycle(PROBES):
+            if time.perf_counter() >= deadline:
+                return
+            method, path, body, headers = scenarios.build(name, next(scenarios.counters[name]))
+            started = time.perf_counter()
+            request(port, method, path, body, headers)
+            latencies[name].append(time.perf_counter() - started)
+            time.sleep(interval)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return {name: sorted(values) for name, values in latencies.items()}
+
+
+def summary(values):
+    return "  ".join(f"p{pct} {percentile(values, pct) * 1000:7.1f}" for pct in (50, 95, 99)) if values else "no samples"
+
+
+def run_mode(mode, args, photos):
+    workdir, model_path = prepare_workdir(args.model)
+    config = {"records": args.records, "patient_records": 50, "messages": 20, "server": mode}
+    env = {"PREDICTION_CACHE_SIZE": "0", "REPORT_EXECUTOR": args.report_executor}
+    server, seed_info = start_server(workdir, model_path, config, env)
+    port = seed_info["port"]
+    try:
+        scenarios = Scenarios(port, seed_info, photos)
+        idle = probe(port, scenarios, args.seconds, args.probe_interval, args.probe_threads)
+
+        stop = threading.Event()
+        statuses = []
+        counter = itertools.count()
+
+        def predict_client():
+            while not stop.is_set():
+                photo = photos[next(counter) % len(photos)]
+                body, content_type = multipart({"pain_level": "Moderate"}, {"image": ("photo.jpg", photo)})
+                status, _ = request(port, "POST", "/predict", body,
+                                    {"Content-Type": content_type, "Cookie": scenarios.patient})
+                statuses.append(status)
+                if status == 503:
+                    time.sleep(0.05)
+
+        clients = [threading.Thread(target=predict_client) for _ in range(args.predict_clients)]
+        for client in clients:
+            client.start()
+        time.sleep(1.0)  # let the prediction backlog build
+        started = time.perf_counter()
+        done_before = sum(1 for status in statuses if status == 200)
+        loaded = probe(port, scenarios, args.seconds, args.probe_interval, args.probe_threads)
+        predictions = sum(1 for status in statuses if status == 200) - done_before
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{mode}: {predictions / elapsed:.1f} predictions/s under load, "
+          f"{statuses.count(503)} turned away with 503, other errors {sum(1 for s in statuses if s >= 400 and s != 503)}")
+    for name in PROBES:
+        print(f"  {name:>18} idle   {summary(idle[name])} ms")
+        print(f"  {'':>18} loaded {summary(loaded[name])} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", default="wsgi,asgi")
+    parser.add_argument("--predict-clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--probe-threads", type=int, default=2)
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--report-executor", default="process", choices=("thread", "process"))
+    parser.add_argument("--model", help="model file to serve instead of the generated stand-in")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1234)
+    photos = [synthetic_photo(rng) for _ in range(64)]
+    for mode in args.servers.split(","):
+        run_mode(mode, args, photos)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Model backend benchmark: float32 Keras vs int8 TFLite latency and memory.
+
+Run from the repository root, after ``python -m tflite_model convert``:
+
+    python -m benchmarks.bench_backends --model oral_cancer_model.h5 --threads 1,4
+
+Each backend runs in a fresh interpreter, loaded the way ``ModelService``
+loads it (``tflite`` once per ``--threads`` value). Reports the load and
+warm-up time, resident memory once loaded and at peak, single-image
+p50/p95/p99 latency and batch-of-``--batch`` throughput.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from tflite_model import default_tflite_path
+
+CHILD = """
+import json, resource, sys, time
+import numpy as np
+from inference import INPUT_SHAPE
+
+backend, path, threads, batch_size, iterations = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5])
+
+def rss_kb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+started = time.perf_counter()
+if backend == "tflite":
+    from tflite_model import TFLiteModel
+    model = TFLiteModel(path, max_batch_size=batch_size, threads=threads or None)
+else:
+    from keras.models import load_model
+    from inference import CompiledModel
+    model = CompiledModel(load_model(path), max_batch_size=batch_size)
+model.warmup()
+loaded = time.perf_counter() - started
+loaded_rss = rss_kb()
+
+rng = np.random.default_rng(0)
+single = rng.random((1,) + INPUT_SHAPE, dtype=np.float32)
+samples = []
+for _ in range(iterations):
+    began = time.perf_counter()
+    model.predict(single)
+    samples.append(time.perf_counter() - began)
+samples.sort()
+
+batch = rng.random((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+began = time.perf_counter()
+for _ in range(max(1, iterations // batch_size)):
+    model.predict(batch)
+batch_seconds = (time.perf_counter() - began) / max(1, iterations // batch_size)
+
+pick = lambda p: samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))] * 1000.0
+print(json.dumps({
+    "load_seconds": loaded,
+    "rss_mb": loaded_rss / 1024.0,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99),
+    "batch_images_per_second": batch_size / batch_seconds,
+}))
+"""
+
+
+def run(backend, path, threads, args):
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, backend, path, str(threads), str(args.batch), str(args.iterations)],
+        capture_output=True, text=True, check=True, env=dict(os.environ),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="oral_cancer_model.h5")
+    parser.add_argument("--tflite", help="TFLite file (default: next to the Keras model, .int8.tflite)")
+    parser.add_argument("--threads", default="1,4", help="TFLite interpreter threads to compare")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    runs = [("keras", args.model, 0)]
+    runs += [("tflite", args.tflite or default_tflite_path(args.model), int(threads))
+             for threads in args.threads.split(",")]
+    print(f"{'backend':>16} {'load s':>7} {'RSS MB':>8} {'peak MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'batch img/s':>12}")
+    for backend, path, threads in runs:
+        result = run(backend, path, threads, args)
+        label = backend if backend == "keras" else f"tflite x{threads}"
+        print(f"{label:>16} {result['load_seconds']:>7.2f} {result['rss_mb']:>8.1f} {result['peak_rss_mb']:>8.1f}"
+              f" {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+              f" {result['batch_images_per_second']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Throughput benchmark: batched vs unbatched inference.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batching --clients 32 --requests 20
+
+By default the model is a stand-in that sleeps for a fixed per-call overhead
+plus a per-image cost, which is how model.predict behaves on CPU. Pass
+--keras to use a tiny Keras model with the real 224x224x3 -> 1 signature.
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from batching import BatchingEngine
+
+
+def stand_in_model(call_overhead_ms, per_image_ms):
+    def predict(batch):
+        time.sleep((call_overhead_ms + per_image_ms * len(batch)) / 1000.0)
+        return batch.mean(axis=(1, 2, 3)).reshape(-1, 1)
+    return predict
+
+
+def keras_model():
+    import keras
+
+    model = keras.Sequential([
+        keras.Input(shape=(224, 224, 3)),
+        keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+        keras.layers.GlobalAveragePooling2D(),
+        keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    return lambda batch: model.predict(batch, verbose=0)
+
+
+def run(engine, clients, requests_per_client):
+    image = np.random.rand(224, 224, 3).astype(np.float32)
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        local = []
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            engine.predict(image)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000.0,
+        "stats": engine.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--call-overhead-ms", type=float, default=25.0)
+    parser.add_argument("--per-image-ms", type=float, default=2.0)
+    parser.add_argument("--keras", action="store_true", help="use a tiny Keras model instead of the stand-in")
+    args = parser.parse_args()
+
+    if args.keras:
+        predict_fn = keras_model()
+    else:
+        predict_fn = stand_in_model(args.call_overhead_ms, args.per_image_ms)
+
+    # The unbatched engine still serialises model calls, as a single model would.
+    model_lock = threading.Lock()
+
+    def serialised(batch):
+        with model_lock:
+            return predict_fn(batch)
+
+    for label, max_batch in (("unbatched", 1), ("batched", args.max_batch)):
+        engine = BatchingEngine(serialised, max_batch_size=max_batch, max_wait_ms=args.window_ms)
+        result = run(engine, args.clients, args.requests)
+        engine.stop()
+        stats = result["stats"]
+        print(f"{label:>10}: {result['throughput_rps']:8.1f} req/s  "
+              f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+              f"mean batch {stats['mean_batch_size']:5.2f}  "
+              f"mean wait {stats['wait_ms']['mean']:6.2f} ms")
+        print(f"{'':>10}  batch sizes: {stats['batch_size_histogram']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Chat log benchmark: long conversations in the message log vs the old reply lists.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_chat_log --messages 5000
+
+The old layout kept ``doctor_replies`` and ``patient_replies`` and the chat
+template merged and sorted both on every render; the log keeps messages in
+sequence order. Times a full chat render's worth of messages, a reconnect
+("since seq N"), and the unread count a dashboard row needs.
+"""
+import argparse
+import time
+
+from record_store import RecordStore
+
+
+def timed(fn, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def merged_replies(record):
+    # What chat.html used to do with the two reply lists
+    messages = [dict(reply, type="doctor") for reply in record["doctor_replies"]]
+    messages += [dict(reply, type="patient") for reply in record["patient_replies"]]
+    return sorted(messages, key=lambda message: message["time"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    legacy = {"doctor_replies": [], "patient_replies": []}
+    store = RecordStore()
+    store.add({"id": "chat", "timestamp": "20250101_000000", "messages": []})
+    for index in range(args.messages):
+        sender = "doctor" if index % 2 else "patient"
+        time_text = f"2025-01-01 00:{index // 60 % 60:02d}:{index % 60:02d}"
+        legacy[f"{sender}_replies"].append({"message": f"message {index}", "time": time_text})
+        store.append_message("chat", sender, f"message {index}", time_text)
+    store.mark_read("chat", "doctor", args.messages // 2)
+    tail = args.messages - 20
+
+    results = {
+        "full history": (timed(lambda: merged_replies(legacy), args.runs),
+                         timed(lambda: store.messages_since("chat"), args.runs)),
+        "since seq N": (timed(lambda: merged_replies(legacy)[tail:], args.runs),
+                        timed(lambda: store.messages_since("chat", tail), args.runs)),
+        "unread count": (timed(lambda: sum(1 for m in merged_replies(legacy)[args.messages // 2:]
+                                           if m["type"] == "patient"), args.runs),
+                         timed(lambda: store.unread_count("chat", "doctor"), args.runs)),
+    }
+    print(f"{args.messages} messages in one conversation")
+    for name, (old, new) in results.items():
+        print(f"{name:>14}: reply lists {old:10.1f} us   message log {new:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
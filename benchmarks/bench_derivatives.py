@@ -0,0 +1,78 @@
+"""Image derivative benchmark: dashboard image bytes and generation cost.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_derivatives --rows 25
+
+For 12 MP, 4 MP and 1 MP synthetic photos, reports the bytes a dashboard of
+``--rows`` records downloads when it links the originals vs the ``thumb``
+(table rows) and ``medium`` (cards) WebP/JPEG derivatives. It also reports
+how long the derivatives take to make at ingest (from the decoded image)
+and lazily (from the file on disk).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from derivatives import DerivativeStore, SIZES, FORMATS
+
+
+def synthetic_photo(path, size):
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    field = 128 + 60 * np.sin(x[..., None] / 90.0 + y[..., None] / 70.0 + np.array([0.0, 1.0, 2.0]))
+    rng = np.random.default_rng(0)
+    pixels = np.clip(field + rng.normal(0, 10, (height, width, 3)), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, "JPEG", quality=90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=25)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="oralscan-derivatives-")
+    try:
+        source_dir = os.path.join(workdir, "uploads")
+        os.makedirs(source_dir)
+        for label, size in (("12 MP", (4000, 3000)), ("4 MP", (2304, 1728)), ("1 MP", (1152, 864))):
+            name = f"{size[0]}x{size[1]}.jpg"
+            synthetic_photo(os.path.join(source_dir, name), size)
+            original = os.path.getsize(os.path.join(source_dir, name))
+            with Image.open(os.path.join(source_dir, name)) as img:
+                img.draft("RGB", (1024, 1024))  # as decode_upload does at ingest
+                decoded = img.convert("RGB")
+
+            ingest, lazy = [], []
+            for run in range(args.runs):
+                cache_dir = os.path.join(workdir, f"cache-{label}-{run}")
+                store = DerivativeStore(source_dir, cache_dir)
+                started = time.perf_counter()
+                store._generate(decoded, name)
+                ingest.append(time.perf_counter() - started)
+                shutil.rmtree(cache_dir)
+                store = DerivativeStore(source_dir, cache_dir)
+                started = time.perf_counter()
+                store.path(name, "thumb", "webp")
+                lazy.append(time.perf_counter() - started)
+            sizes = {(size_name, fmt): os.path.getsize(store.path(name, size_name, fmt))
+                     for size_name in SIZES for fmt in FORMATS}
+
+            print(f"{label:>6}: original {original / 1024:8.1f} KB x {args.rows} rows = {original * args.rows / 1024 / 1024:7.2f} MB")
+            for size_name in SIZES:
+                webp, jpeg = sizes[(size_name, "webp")], sizes[(size_name, "jpeg")]
+                print(f"        {size_name:>6}: webp {webp / 1024:6.1f} KB  jpeg {jpeg / 1024:6.1f} KB"
+                      f"  -> {webp * args.rows / 1024:8.1f} KB per page (webp)")
+            print(f"        make all derivatives: ingest {min(ingest) * 1000:7.1f} ms   lazy {min(lazy) * 1000:7.1f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Latency benchmark: model.predict vs the compiled, warmed-up path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_inference --model oral_cancer_model.h5
+
+Reports warm-up time and steady-state p50/p99 latency per batch size for
+both call paths.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from inference import CompiledModel, INPUT_SHAPE, batch_buckets
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (samples[len(samples) // 2] * 1000.0,
+            samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000.0)
+
+
+def time_calls(fn, batch, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(batch)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="oral_cancer_model.h5")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    from keras.models import load_model
+
+    model = load_model(args.model)
+
+    started = time.perf_counter()
+    model.predict(np.zeros((1,) + INPUT_SHAPE, dtype=np.float32), verbose=0)
+    print(f"model.predict first call: {(time.perf_counter() - started) * 1000.0:.1f} ms")
+
+    compiled = CompiledModel(model, max_batch_size=args.max_batch)
+    print(f"compiled warm-up: {compiled.warmup() * 1000.0:.1f} ms for buckets {compiled.buckets}")
+
+    print(f"{'batch':>5} {'predict p50':>12} {'predict p99':>12} {'compiled p50':>13} {'compiled p99':>13}")
+    for size in batch_buckets(args.max_batch):
+        batch = np.random.rand(size, *INPUT_SHAPE).astype(np.float32)
+        slow = time_calls(lambda b: model.predict(b, verbose=0), batch, args.iterations)
+        fast = time_calls(compiled.predict, batch, args.iterations)
+        print(f"{size:>5} {slow[0]:>10.2f}ms {slow[1]:>10.2f}ms {fast[0]:>11.2f}ms {fast[1]:>11.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Multi-worker inference benchmark: one model per worker vs a shared inference server.
+
+Run from the repository root (Linux; RSS is read from /proc):
+
+    python -m benchmarks.bench_inference_server --workers 1,2,4,8 --seconds 10
+
+For each worker count, starts that many worker processes (fresh interpreters,
+like Gunicorn workers). Each one sends single-image predictions from
+``--threads`` threads for ``--seconds``. In ``local`` mode every worker
+loads its own model. In ``server`` mode the workers share one
+``inference_server`` process. Reports requests per second and total resident
+memory (workers plus server, as PSS so shared pages are not counted twice).
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from inference_server import InferenceClient, INPUT_SHAPE
+
+
+def rss_mb(pid="self"):
+    # PSS splits shared pages (the input slots) between the processes mapping
+    # them, so the per-process numbers add up; plain VmRSS would count them twice
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as status:
+                for line in status:
+                    if line.startswith(field):
+                        return int(line.split()[1]) / 1024.0
+        except OSError:
+            continue
+    return 0.0
+
+
+def worker(mode, socket_path, threads, seconds, ready, go, results):
+    if mode == "server":
+        service = InferenceClient(socket_path)
+    else:
+        from model_service import service_from_env
+        service = service_from_env()
+    service.wait(600)
+    array = np.random.rand(*INPUT_SHAPE).astype(np.float32)
+    service.predict(array)
+    ready.put(os.getpid())
+    go.wait()
+
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def run(slot):
+        while time.perf_counter() < deadline:
+            service.predict(array)
+            counts[slot] += 1
+
+    pool = [threading.Thread(target=run, args=(slot,)) for slot in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((sum(counts), rss_mb()))
+
+
+def run(mode, workers, threads, seconds, socket_path):
+    context = multiprocessing.get_context("spawn")
+    ready, results, go = context.Queue(), context.Queue(), context.Event()
+    server = None
+    if mode == "server":
+        server = subprocess.Popen([sys.executable, "-m", "inference_server", "--socket", socket_path])
+        InferenceClient(socket_path).wait(600)
+    processes = [context.Process(target=worker, args=(mode, socket_path, threads, seconds, ready, go, results))
+                 for _ in range(workers)]
+    try:
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.get(timeout=600)
+        go.set()
+        totals = [results.get(timeout=seconds + 600) for _ in processes]
+        server_rss = rss_mb(server.pid) if server else 0.0
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+        if server:
+            server.terminate()
+            server.wait()
+    requests = sum(count for count, _ in totals)
+    return requests / seconds, sum(rss for _, rss in totals) + server_rss, server_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--modes", default="local,server")
+    parser.add_argument("--socket", default="/tmp/oralscan-bench-inference.sock")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        for workers in (int(count) for count in args.workers.split(",")):
+            rps, total_rss, server_rss = run(mode, workers, args.threads, args.seconds, args.socket)
+            print(f"{mode:>6} {workers} workers: {rps:8.1f} req/s   RSS {total_rss:8.1f} MB"
+                  + (f" (server {server_rss:.1f} MB)" if mode == "server" else ""))
+
+
+if __name__ == "__main__":
+    main()
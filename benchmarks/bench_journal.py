@@ -0,0 +1,137 @@
+"""Record journal benchmark: write throughput, snapshot time and restart time at 1M records.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_journal --records 1000000 --writes 100000 --threads 1,16
+
+Write throughput: ``--threads`` writers add ``--writes`` records to a
+journaled store for each ``JOURNAL_FSYNC`` mode. Reports records/s and
+entries per write/sync group; group commit is what lets many writers share
+one fsync. Then loads ``--records`` records, snapshots them and restarts
+from disk three ways: from the journal alone, from the snapshot alone, and
+from the snapshot plus a ``--tail`` entry journal tail. Restarts run in a
+fresh interpreter, so the time includes reading and indexing everything.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from journal import Durability
+
+RESTART = """
+import sys, time
+started = time.perf_counter()
+from journal import Durability
+durability = Durability(sys.argv[1], snapshot_every=10 ** 12)
+print(time.perf_counter() - started, len(durability.records))
+"""
+
+
+def make_record(index):
+    return {
+        "id": f"{index:012d}",
+        "timestamp": f"2026{index % 12 + 1:02d}{index % 28 + 1:02d}_120000",
+        "username": f"patient{index % 5000}",
+        "status": "Pending" if index % 3 else "Replied",
+        "prediction": "Low Risk (Non-Cancer)",
+        "confidence": 91.5,
+        "image_path": f"static/uploads/{index:064x}.jpg",
+        "symptoms": {"pain_level": "Moderate", "bleeding": "No", "habits": ["Tobacco"]},
+        "messages": [],
+        "doctor": "Dr. John Doe",
+    }
+
+
+def write_throughput(directory, mode, threads, writes):
+    durability = Durability(directory, fsync=mode, snapshot_every=10 ** 12)
+    per_thread = writes // threads
+
+    def writer(offset):
+        for index in range(offset, offset + per_thread):
+            durability.records.add(make_record(index))
+
+    pool = [threading.Thread(target=writer, args=(n * per_thread,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    durability.close()
+    elapsed = time.perf_counter() - started
+    stats = durability.journal.stats()
+    return per_thread * threads / elapsed, stats["entries_per_group"]
+
+
+def restart(directory):
+    output = subprocess.run([sys.executable, "-c", RESTART, directory], capture_output=True, text=True,
+                            check=True).stdout.split()
+    return float(output[0]), int(output[1])
+
+
+def size_mb(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--writes", type=int, default=100000)
+    parser.add_argument("--threads", default="1,16")
+    parser.add_argument("--modes", default="commit,interval,off")
+    parser.add_argument("--tail", type=int, default=100000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="oralscan-journal-")
+    try:
+        print(f"{'fsync':>9} {'threads':>7} {'records/s':>10} {'entries/sync':>13}")
+        for mode in args.modes.split(","):
+            for threads in (int(value) for value in args.threads.split(",")):
+                directory = os.path.join(workdir, f"write-{mode}-{threads}")
+                rate, per_group = write_throughput(directory, mode, threads, args.writes)
+                print(f"{mode:>9} {threads:>7} {rate:>10.0f} {per_group or 0:>13.1f}")
+                shutil.rmtree(directory)
+
+        directory = os.path.join(workdir, "restart")
+        durability = Durability(directory, fsync="off", snapshot_every=10 ** 12)
+        started = time.perf_counter()
+        batch = []
+        for index in range(args.records):
+            batch.append(make_record(index))
+            if len(batch) == 1000:
+                durability.records.add_many(batch)
+                batch = []
+        durability.records.add_many(batch)
+        durability.close()
+        # The restarts load every record again in a child process: drop this copy first
+        durability = batch = None
+        print(f"\nloaded {args.records} records in {time.perf_counter() - started:.1f}s, journal {size_mb(directory):.0f} MB")
+        seconds, count = restart(directory)
+        print(f"restart from journal only:       {seconds:7.2f}s ({count} records)")
+
+        durability = Durability(directory, fsync="off", snapshot_every=10 ** 12)
+        started = time.perf_counter()
+        durability.snapshot()
+        print(f"snapshot:                        {time.perf_counter() - started:7.2f}s, {size_mb(directory):.0f} MB on disk")
+        durability.close()
+        durability = None
+        seconds, count = restart(directory)
+        print(f"restart from snapshot:           {seconds:7.2f}s ({count} records)")
+
+        durability = Durability(directory, fsync="off", snapshot_every=10 ** 12)
+        for index in range(args.tail):
+            durability.records.update(f"{index * 7 % args.records:012d}", status="Replied")
+        durability.close()
+        durability = None
+        seconds, count = restart(directory)
+        print(f"restart from snapshot + {args.tail} entries: {seconds:7.2f}s ({count} records)")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
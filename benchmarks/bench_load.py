@@ -0,0 +1,379 @@
+"""Load test for the hot routes, with a JSON report and baseline comparison.
+
+Run from the repository root (Linux; RSS is read from /proc):
+
+    python -m benchmarks.bench_load --concurrency 1,8 --requests 200 --output load.json
+    python -m benchmarks.bench_load --output load.json --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_load --output load.json --baseline benchmarks/baseline.json
+
+The app is started in a fresh process and a fresh working directory, under a
+threaded Werkzeug server (``--server asgi``: uvicorn and ``asgi.py``). It gets a stand-in model: a tiny Keras network
+with the real 224x224x3 -> 1 signature, built and saved as ``.h5``. Pass
+``--model`` to use an existing model file instead. The store is seeded with
+``--records`` synthetic records; the benchmark patient owns
+``--patient-records`` of them and each of those has ``--messages`` chat
+messages. Then every scenario is driven at every ``--concurrency`` level:
+
+- ``predict``: a distinct synthetic photo per request, so the prediction
+  cache never hits
+- ``download_pdf``: a different record per request, so every report is a
+  cold render
+- ``doctor_dashboard`` and ``patient_dashboard``
+- ``chat_page`` (the patient's chat window) and ``chat_send`` (the JSON
+  message API)
+
+For each scenario and level the report holds the throughput, the
+p50/p95/p99 latency, the error count and the server's peak RSS during the
+run. With ``--baseline``, any result whose throughput fell, p95 rose or
+peak RSS rose by more than ``--tolerance`` is listed and the exit status
+is 1.
+"""
+import argparse
+import http.client
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+from PIL import Image
+
+SERVER = """
+import json, logging, sys
+from werkzeug.serving import make_server
+import app
+from PIL import Image
+
+config = json.loads(sys.argv[1])
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+app.model_service.wait(600)
+
+image_path = "static/uploads/bench.jpg"
+Image.new("RGB", (1024, 768), (180, 90, 90)).save(image_path, "JPEG")
+records = []
+for index in range(config["records"]):
+    username = "bench-patient" if index < config["patient_records"] else f"patient{index % 500}"
+    symptoms = app.collect_symptoms({"pain_level": "Moderate", "bleeding": "No", "duration": "2 weeks"}, ["Tobacco"])
+    records.append(app.new_patient_record(app.new_record_id(), f"20250101_{index:06d}", image_path, symptoms,
+                                          "Risk (Cancer)" if index % 3 else "Low Risk (Non-Cancer)", 88.5, username))
+app.patient_records.add_many(records)
+patient_ids = [record["id"] for record in records[:config["patient_records"]]]
+for record_id in patient_ids:
+    for seq in range(config["messages"]):
+        app.patient_records.append_message(record_id, ("patient", "doctor")[seq % 2], f"Message {seq}", "10:00")
+app.users["bench-doctor"] = {"password": "bench", "role": "doctor"}
+app.users["bench-patient"] = {"password": "bench", "role": "patient"}
+
+def ready(port):
+    print(json.dumps({"port": port, "record_ids": [record["id"] for record in records],
+                      "patient_record_ids": patient_ids}), flush=True)
+
+if config.get("server") == "asgi":
+    import socket
+    import uvicorn
+    import asgi
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    ready(sock.getsockname()[1])
+    uvicorn.Server(uvicorn.Config(asgi.application, log_level="warning")).run(sockets=[sock])
+else:
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    ready(server.server_port)
+    server.serve_forever()
+"""
+BOUNDARY = "----oralscan-load"
+SCENARIOS = ("predict", "download_pdf", "doctor_dashboard", "patient_dashboard", "chat_page", "chat_send")
+
+
+def build_model(path):
+    """Save a tiny Keras model with the screening model's input and output shapes."""
+    import keras
+    model = keras.Sequential([
+        keras.Input((224, 224, 3)),
+        keras.layers.Conv2D(8, 7, strides=4, activation="relu"),
+        keras.layers.GlobalAveragePooling2D(),
+        keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    model.save(path)
+
+
+def synthetic_photo(rng, size=(800, 600)):
+    # Smooth colour field plus noise: compresses like a photo, unlike pure noise
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    base = rng.integers(60, 200, 3)
+    field = base + 40 * np.sin(x[..., None] / rng.uniform(20, 80) + y[..., None] / rng.uniform(20, 80))
+    pixels = np.clip(field + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def multipart(fields, files):
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def form(fields):
+    return urlencode(fields).encode(), "application/x-www-form-urlencoded"
+
+
+def memory_kb(pid, field):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return 0
+
+
+def request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status, response.getheader("Set-Cookie")
+    finally:
+        conn.close()
+
+
+def login(port, username, role):
+    body, content_type = form({"username": username, "password": "bench", "role": role})
+    _, cookie = request(port, "POST", "/login", body, {"Content-Type": content_type})
+    return cookie.split(";")[0]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)]
+
+
+class Scenarios:
+    """Builds the ``index``-th request of each scenario."""
+
+    def __init__(self, port, seed_info, photos):
+        # Numbered across concurrency levels, so a later level never reuses
+        # an earlier level's photo or record and hits a cache
+        self.counters = {scenario: itertools.count() for scenario in SCENARIOS}
+        self.record_ids = seed_info["record_ids"]
+        self.patient_ids = seed_info["patient_record_ids"]
+        self.photos = photos
+        self.doctor = login(port, "bench-doctor", "doctor")
+        self.patient = login(port, "bench-patient", "patient")
+
+    def build(self, scenario, index):
+        if scenario == "predict":
+            body, content_type = multipart({"pain_level": "Moderate", "bleeding": "No"},
+                                           {"image": ("photo.jpg", self.photos[index % len(self.photos)])})
+            return "POST", "/predict", body, {"Content-Type": content_type, "Cookie": self.patient}
+        if scenario == "download_pdf":
+            record_id = self.record_ids[index % len(self.record_ids)]
+            body, content_type = form({"record_id": record_id, "prediction": "Risk (Cancer)", "confidence": "88.5",
+                                       "image_path": "static/uploads/bench.jpg"})
+            return "POST", "/download_pdf", body, {"Content-Type": content_type, "Cookie": self.doctor}
+        if scenario == "doctor_dashboard":
+            return "GET", "/doctor_dashboard", None, {"Cookie": self.doctor}
+        if scenario == "patient_dashboard":
+            return "GET", "/patient_dashboard", None, {"Cookie": self.patient}
+        if scenario == "chat_page":
+            return "GET", f"/chat?record_id={self.patient_ids[index % len(self.patient_ids)]}", None, {"Cookie": self.patient}
+        if scenario == "chat_send":
+            record_id = self.patient_ids[index % len(self.patient_ids)]
+            body = json.dumps({"message": f"Load test message {index}", "sender": "patient"}).encode()
+            return ("POST", f"/api/chat/{record_id}/messages", body,
+                    {"Content-Type": "application/json", "Cookie": self.patient})
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def run_scenario(port, server_pid, scenarios, scenario, concurrency, requests):
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    peak = [memory_kb(server_pid, "VmRSS:")]
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.02):
+            peak[0] = max(peak[0], memory_kb(server_pid, "VmRSS:"))
+
+    def worker():
+        while True:
+            index = next(counter)
+            if index >= requests:
+                return
+            method, path, body, headers = scenarios.build(scenario, next(scenarios.counters[scenario]))
+            started = time.perf_counter()
+            try:
+                status, _ = request(port, method, path, body, headers)
+            except OSError:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "peak_rss_mb": round(max(peak[0], memory_kb(server_pid, "VmRSS:")) / 1024.0, 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Results that regressed past ``tolerance`` (a fraction) against ``baseline``."""
+    regressions = []
+    for key, result in report["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if base is None:
+            continue
+        checks = (
+            ("throughput_rps", result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance)),
+            ("p95_ms", result["p95_ms"] > base["p95_ms"] * (1 + tolerance)),
+            ("peak_rss_mb", result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance)),
+        )
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{key} {metric}: {base[metric]} -> {result[metric]}")
+    return regressions
+
+
+def prepare_workdir(model=None):
+    """A fresh working directory for the app, and the model to serve (the stand-in unless ``model``)."""
+    workdir = tempfile.mkdtemp(prefix="oralscan-load-")
+    for folder in ("static/uploads", "static/audio"):
+        os.makedirs(os.path.join(workdir, folder))
+    model_path = os.path.abspath(model) if model else os.path.join(workdir, "stand_in_model.h5")
+    if not model:
+        build_model(model_path)
+    return workdir, model_path
+
+
+def start_server(workdir, model_path, config, env=None):
+    """Start the seeded app; ``config`` holds records, patient_records, messages and server."""
+    env = dict(os.environ, MODEL_PATH=model_path, MODEL_LOAD="eager", LOG_LEVEL="WARNING",
+               PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ.get("PYTHONPATH", "")]), **(env or {}))
+    server = subprocess.Popen([sys.executable, "-c", SERVER, json.dumps(config)], cwd=workdir, env=env,
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        server.wait()
+        raise SystemExit("The app failed to start; see its output above")
+    return server, json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--patient-records", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--storage", default="memory", choices=("memory", "sql"))
+    parser.add_argument("--server", default="wsgi", choices=("wsgi", "asgi"))
+    parser.add_argument("--model", help="model file to serve instead of the generated stand-in")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="bench_load.json")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--save-baseline", help="also write this run's report here")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    scenario_names = args.scenarios.split(",")
+    workdir, model_path = prepare_workdir(args.model)
+
+    rng = np.random.default_rng(args.seed)
+    photos = [synthetic_photo(rng) for _ in range(args.requests * len(levels) if "predict" in scenario_names else 0)]
+
+    config = {"records": args.records, "patient_records": args.patient_records, "messages": args.messages,
+              "server": args.server}
+    server, seed_info = start_server(workdir, model_path, config, {"STORAGE_BACKEND": args.storage})
+    results = {}
+    try:
+        scenarios = Scenarios(seed_info["port"], seed_info, photos)
+        for scenario in scenario_names:
+            for concurrency in levels:
+                result = run_scenario(seed_info["port"], server.pid, scenarios, scenario, concurrency, args.requests)
+                results[f"{scenario}@{concurrency}"] = result
+                print(f"{scenario:>18} x{concurrency:<3} {result['throughput_rps']:8.1f} req/s   "
+                      f"p50 {result['p50_ms']:8.1f} ms   p95 {result['p95_ms']:8.1f} ms   p99 {result['p99_ms']:8.1f} ms   "
+                      f"peak RSS {result['peak_rss_mb']:7.1f} MB   errors {result['errors']}")
+        peak_rss = memory_kb(server.pid, "VmHWM:") / 1024.0
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "model": args.model or "stand-in",
+            "storage": args.storage,
+            "server": args.server,
+            "records": args.records,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "peak_rss_mb": round(peak_rss, 1),
+        "results": results,
+    }
+    with open(args.output, "w") as out:
+        json.dump(report, out, indent=2)
+    print(f"Report written to {args.output} (server peak RSS {peak_rss:.1f} MB)")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as out:
+            json.dump(report, out, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(report, json.load(handle), args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%} against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Preprocessing benchmark: legacy decode/re-encode/reload vs single decode.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_preprocessing
+
+The legacy path mirrors what /predict used to do: decode with PIL, convert to
+RGB, save a JPEG to disk, reopen it, resize to 224x224 and convert to float.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import decode_upload, to_model_input
+
+SIZES = {
+    "12MP": (4000, 3000),
+    "4MP": (2304, 1728),
+    "small": (640, 480),
+}
+
+
+def synthetic_jpeg(size):
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    noise = np.random.randint(0, 32, (height, width), dtype=np.uint8)
+    pixels = np.stack([
+        (x + y) / 2 + noise,
+        np.broadcast_to(x, (height, width)),
+        np.broadcast_to(y, (height, width)) + noise,
+    ], axis=-1).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def legacy(data, path):
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    img.save(path, 'JPEG')
+    img = Image.open(path).convert('RGB').resize((224, 224), Image.NEAREST)
+    return np.expand_dims(np.asarray(img, dtype=np.float32), axis=0) / 255.0
+
+
+def single_decode(data, path):
+    img = decode_upload(io.BytesIO(data))
+    array = to_model_input(img)
+    # Archival write is off the request path in the app; it is timed separately here.
+    return array, img
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.jpg")
+        print(f"{'input':>6} {'legacy':>10} {'single':>10} {'archive':>10} {'speedup':>8}")
+        for label, size in SIZES.items():
+            data = synthetic_jpeg(size)
+            timings = {"legacy": [], "single": [], "archive": []}
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                legacy(data, path)
+                timings["legacy"].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                _, img = single_decode(data, path)
+                timings["single"].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                img.save(path, 'JPEG')
+                timings["archive"].append(time.perf_counter() - started)
+            medians = {key: sorted(values)[len(values) // 2] * 1000.0 for key, values in timings.items()}
+            print(f"{label:>6} {medians['legacy']:>8.1f}ms {medians['single']:>8.1f}ms "
+                  f"{medians['archive']:>8.1f}ms {medians['legacy'] / medians['single']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
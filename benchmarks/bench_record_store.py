@@ -0,0 +1,61 @@
+"""Record lookup benchmark: linear list scans vs the indexed RecordStore.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_record_store --records 100000
+
+Measures single-record lookup (what every chat/reply/flag route does) and
+the patient dashboard filter by username.
+"""
+import argparse
+import random
+import time
+
+from record_store import RecordStore
+
+
+def make_records(count, users):
+    return [{
+        "timestamp": f"{index:012d}",
+        "username": f"patient{index % users}",
+        "status": "Pending" if index % 3 else "Replied",
+        "prediction": "Low Risk (Non-Cancer)",
+        "symptoms": {},
+        "messages": [],
+    } for index in range(count)]
+
+
+def timed(fn, keys):
+    started = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.users)
+    store = RecordStore()
+    for record in records:
+        store.add(record)
+
+    keys = [random.choice(records)["timestamp"] for _ in range(args.lookups)]
+    usernames = [f"patient{random.randrange(args.users)}" for _ in range(args.lookups)]
+
+    list_lookup = timed(lambda key: next((r for r in records if r["timestamp"] == key), None), keys)
+    store_lookup = timed(store.get, keys)
+    list_dashboard = timed(lambda name: [r for r in records if r.get("username") == name], usernames)
+    store_dashboard = timed(store.for_username, usernames)
+
+    print(f"{args.records} records, {args.users} users")
+    print(f"lookup by key:      list {list_lookup:10.1f} us   store {store_lookup:8.2f} us")
+    print(f"patient dashboard:  list {list_dashboard:10.1f} us   store {store_dashboard:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
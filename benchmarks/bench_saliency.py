@@ -0,0 +1,73 @@
+"""Grad-CAM heatmap benchmark: what a heatmap adds to a single screening.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_saliency --model oral_cancer_model.h5
+
+Reports p50/p95 for a plain one-image forward pass, for the explaining
+pass that returns the score and the activation map together, and for the
+NumPy overlay and JPEG write of 12 MP, 4 MP and 0.3 MP photos (at the
+size they are decoded to at ingest). The "added" column is the explaining pass plus the overlay,
+minus the plain pass it replaces.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from inference import CompiledModel, INPUT_SHAPE
+from saliency import HeatmapStore
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="oral_cancer_model.h5")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    from keras.models import load_model
+
+    compiled = CompiledModel(load_model(args.model), max_batch_size=1)
+    compiled.warmup()
+    rng = np.random.default_rng(0)
+    batch = rng.random((1,) + INPUT_SHAPE, dtype=np.float32)
+    compiled.explain(batch)  # trace once
+    _, cams = compiled.explain(batch)
+
+    plain = timed(lambda: compiled.predict(batch), args.iterations)
+    explain = timed(lambda: compiled.explain(batch), args.iterations)
+    print(f"activation map {cams.shape[1]}x{cams.shape[2]}")
+    print(f"{'forward pass':>24}: p50 {plain[0] * 1000:7.1f} ms  p95 {plain[1] * 1000:7.1f} ms")
+    print(f"{'explaining pass':>24}: p50 {explain[0] * 1000:7.1f} ms  p95 {explain[1] * 1000:7.1f} ms")
+
+    workdir = tempfile.mkdtemp(prefix="oralscan-saliency-")
+    try:
+        store = HeatmapStore(workdir)
+        # Sizes after the reduced-scale decode at ingest (at least 1024 px on the long side)
+        for label, size in (("12 MP", (2000, 1500)), ("4 MP", (1152, 864)), ("0.3 MP", (640, 480))):
+            photo = Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8))
+            path = os.path.join(workdir, "heatmap.jpg")
+            overlay = timed(lambda: store.save(photo, cams[0], path), args.iterations)
+            added = explain[0] + overlay[0] - plain[0]
+            print(f"{'overlay + write ' + label:>24}: p50 {overlay[0] * 1000:7.1f} ms  p95 {overlay[1] * 1000:7.1f} ms"
+                  f"   added per screening {added * 1000:7.1f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
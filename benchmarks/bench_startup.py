@@ -0,0 +1,60 @@
+"""Startup benchmark: import-to-first-response with eager vs deferred model loading.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --runs 3
+
+Each run starts a fresh interpreter, imports the app with the given
+``MODEL_LOAD`` mode and times the first response from the landing page and
+the moment ``/readyz`` reports the model ready. ``eager`` is the old
+behaviour (the model loads during import).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+client = app.app.test_client()
+client.get('/')
+first_response = time.perf_counter() - started
+# Stands in for the first inference request under MODEL_LOAD=lazy
+app.model_service.start()
+while client.get('/readyz').status_code != 200:
+    if time.perf_counter() - started > float(sys.argv[1]):
+        break
+    time.sleep(0.01)
+ready = time.perf_counter() - started
+print(json.dumps({"import": imported, "first_response": first_response, "ready": ready}))
+"""
+
+
+def run_once(mode, timeout):
+    env = dict(os.environ, MODEL_LOAD=mode)
+    output = subprocess.run([sys.executable, "-c", CHILD, str(timeout)], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--modes", default="eager,background,lazy")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        samples = [run_once(mode, args.timeout) for _ in range(args.runs)]
+        summary = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+        print(f"{mode:>10}: import {summary['import']:7.2f}s   first response {summary['first_response']:7.2f}s"
+              f"   model ready {summary['ready']:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Storage load benchmark: memory vs SQL backend at large row counts.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_storage --records 1000000 --database sqlite:////tmp/bench.db
+
+Seeds the stores with synthetic records, then times the operations the
+dashboard and chat routes perform: patient dashboard (records by username),
+chat view (record by ID), chat reply (append + batched commit), the
+follow-up list and the unread counts for one dashboard page.
+"""
+import argparse
+import os
+import random
+import time
+
+from flask import Flask
+from sqlalchemy import insert
+
+from ids import new_record_id
+from models import db, User, PatientRecord
+from storage import create_stores
+
+
+def seed_memory(store, records, users):
+    ids = []
+    for index in range(records):
+        record_id = new_record_id()
+        store.add({
+            "id": record_id,
+            "timestamp": f"20250101_{index:06d}",
+            "image_path": f"static/uploads/{record_id}.jpg",
+            "symptoms": {"pain_level": "Low", "habits": []},
+            "messages": [],
+            "status": "Pending" if index % 3 else "Replied",
+            "follow_up": index % 50 == 0,
+            "prediction": "Low Risk (Non-Cancer)",
+            "confidence": "90",
+            "username": f"patient{index % users}",
+        })
+        ids.append(record_id)
+    return ids
+
+
+def seed_sql(app, records, users, chunk=50000):
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"username": f"patient{index}", "email": f"patient{index}@example.com",
+             "password": "x", "role": "patient"}
+            for index in range(users)
+        ])
+        user_ids = dict(db.session.query(User.username, User.id))
+        ids = []
+        for start in range(0, records, chunk):
+            rows = []
+            for index in range(start, min(records, start + chunk)):
+                record_id = new_record_id()
+                ids.append(record_id)
+                rows.append({
+                    "record_id": record_id,
+                    "user_id": user_ids[f"patient{index % users}"],
+                    "timestamp": f"20250101_{index:06d}",
+                    "image_path": f"static/uploads/{record_id}.jpg",
+                    "pain_level": "Low",
+                    "status": "Pending" if index % 3 else "Replied",
+                    "follow_up": index % 50 == 0,
+                    "prediction": "Low Risk (Non-Cancer)",
+                    "confidence": "90",
+                })
+            db.session.execute(insert(PatientRecord), rows)
+            db.session.commit()
+    return ids
+
+
+def timed(fn, args):
+    samples = []
+    for arg in args:
+        started = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000.0, samples[int(len(samples) * 0.99) - 1] * 1000.0
+
+
+def run(label, store, ids, users, samples):
+    record_ids = [random.choice(ids) for _ in range(samples)]
+    usernames = [f"patient{random.randrange(users)}" for _ in range(samples)]
+    results = {
+        "patient dashboard": timed(store.for_username, usernames),
+        "chat view": timed(store.get, record_ids),
+        "chat reply": timed(lambda key: store.append_message(key, "patient", "hi", "now"), record_ids),
+    }
+    if hasattr(store, "flush"):
+        started = time.perf_counter()
+        store.flush()
+        results["chat batch commit"] = ((time.perf_counter() - started) * 1000.0,) * 2
+    results["follow-up list"] = timed(lambda _: store.follow_ups(), range(5))
+    results["doctor unread counts"] = timed(lambda _: store.unread_counts(random.sample(ids, 25), "doctor"), range(20))
+    for name, (p50, p99) in results.items():
+        print(f"{label:>6} {name:>20}: p50 {p50:9.3f} ms  p99 {p99:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--database", default="sqlite:////tmp/oralscan_bench.db")
+    parser.add_argument("--skip-memory", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_memory:
+        _, store = create_stores(Flask(__name__), backend="memory")
+        started = time.perf_counter()
+        ids = seed_memory(store, args.records, args.users)
+        print(f"memory: seeded {args.records} records in {time.perf_counter() - started:.1f}s")
+        run("memory", store, ids, args.users, args.samples)
+        del store, ids
+
+    if args.database.startswith("sqlite:////"):
+        path = args.database[len("sqlite:///"):]
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    app = Flask(__name__)
+    # A long commit interval so the benchmark measures one explicit batch commit
+    os.environ.setdefault("CHAT_COMMIT_INTERVAL_MS", "60000")
+    _, store = create_stores(app, backend="sql", database_url=args.database)
+    started = time.perf_counter()
+    ids = seed_sql(app, args.records, args.users)
+    print(f"   sql: seeded {args.records} records in {time.perf_counter() - started:.1f}s")
+    run("sql", store, ids, args.users, args.samples)
+
+
+if __name__ == "__main__":
+    main()
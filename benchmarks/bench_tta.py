@@ -0,0 +1,89 @@
+"""Test-time augmentation benchmark: cost per view and the adaptive view count under load.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tta --model oral_cancer_model.h5 --budget-ms 400
+
+First scores one photo with 1 to 8 views, one at a time, and reports p50/p95
+scoring latency (augmentation plus one forward pass) and the time added
+over a single view. Then runs ``--clients`` concurrent screenings through
+``ViewPolicy`` for each client count and reports the views it settled on,
+the p95 it held and the mean added cost per screening.
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from inference import CompiledModel
+from tta import VIEWS, ViewPolicy, augment, score_views
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100.0 * len(values)))]
+
+
+def synthetic_photo(rng, size=(1024, 768)):
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    field = 128 + 60 * np.sin(x[..., None] / 90.0 + y[..., None] / 70.0 + np.array([0.0, 1.0, 2.0]))
+    return Image.fromarray(np.clip(field + rng.normal(0, 10, (height, width, 3)), 0, 255).astype(np.uint8))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="oral_cancer_model.h5")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--budget-ms", type=float, default=400)
+    parser.add_argument("--clients", default="1,4,16")
+    parser.add_argument("--seconds", type=float, default=20)
+    args = parser.parse_args()
+
+    from keras.models import load_model
+
+    compiled = CompiledModel(load_model(args.model), max_batch_size=len(VIEWS))
+    compiled.warmup()
+    photo = synthetic_photo(np.random.default_rng(0))
+
+    print(f"{'views':>5} {'p50 ms':>8} {'p95 ms':>8} {'added p50 ms':>13}")
+    single = None
+    for views in range(1, len(VIEWS) + 1):
+        samples = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            compiled.predict(augment(photo, views))
+            samples.append(time.perf_counter() - started)
+        p50 = percentile(samples, 50)
+        single = p50 if single is None else single
+        print(f"{views:>5} {p50 * 1000:>8.1f} {percentile(samples, 95) * 1000:>8.1f} {(p50 - single) * 1000:>13.1f}")
+
+    for clients in (int(value) for value in args.clients.split(",")):
+        policy = ViewPolicy(budget_ms=args.budget_ms)
+        latencies, views_used = [], []
+        deadline = time.perf_counter() + args.seconds
+
+        def client():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                _, _, views, _ = score_views(photo, policy, compiled.predict)
+                latencies.append(time.perf_counter() - started)
+                views_used.append(views)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The second half, after the policy has settled
+        settled = latencies[len(latencies) // 2:]
+        stats = policy.stats()
+        print(f"{clients:>3} clients: views now {stats['views']}, mean views {np.mean(views_used[len(views_used) // 2:]):.1f}, "
+              f"p95 {percentile(settled, 95) * 1000:.1f} ms (budget {args.budget_ms:.0f}), "
+              f"mean added {stats['mean_added_ms']:.1f} ms per screening")
+
+
+if __name__ == "__main__":
+    main()
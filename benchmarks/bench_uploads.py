@@ -0,0 +1,170 @@
+"""Concurrent upload benchmark: server memory during bursts of large uploads.
+
+Run from the repository root (Linux; peak RSS is read from /proc):
+
+    python -m benchmarks.bench_uploads --size-mb 15 --concurrency 1,4,16
+
+For each concurrency level, starts the app under a threaded Werkzeug
+server in a fresh process (``MODEL_LOAD=lazy``, so the model stays out of
+the picture). It then streams that many simultaneous multipart uploads of
+``--size-mb`` to ``/upload_image`` and ``/upload_audio`` and reports the
+server's peak RSS above its idle RSS, in total and per request.
+``--spool-kb`` sets ``UPLOAD_SPOOL_KB``. Werkzeug's stock threshold is 500.
+A decompression-bomb PNG (tiny file, 60000x60000 header) is also timed to
+show it is rejected before decoding.
+"""
+import argparse
+import http.client
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from PIL import Image
+
+SERVER = """
+import sys
+from werkzeug.serving import make_server
+import app
+# A record for /upload_audio to attach to
+app.patient_records.add({"id": "bench", "timestamp": "bench", "image_path": "", "symptoms": {}, "status": "Pending"})
+server = make_server("127.0.0.1", 0, app.app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+BOUNDARY = "----oralscan-bench"
+
+
+def memory_kb(pid, field):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return 0
+
+
+def make_files(size):
+    # A small real JPEG padded with filler: the server only reads the header
+    image = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+    Image.new("RGB", (1600, 1200), "white").save(image, "JPEG")
+    audio = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
+    audio.write(b"ID3")
+    for handle in (image, audio):
+        handle.write(os.urandom(size - handle.tell()))
+        handle.close()
+    return image.name, audio.name
+
+
+def multipart(field, path, extra=None):
+    head = "".join(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                   for name, value in (extra or {}).items())
+    head += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; '
+             f'filename="{os.path.basename(path)}"\r\nContent-Type: application/octet-stream\r\n\r\n')
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+    head = head.encode()
+    length = len(head) + os.path.getsize(path) + len(tail)
+
+    def body():
+        yield head
+        with open(path, "rb") as upload:
+            while True:
+                chunk = upload.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+        yield tail
+
+    return body(), length
+
+
+def post(port, path, field, file_path, extra=None):
+    body, length = multipart(field, file_path, extra)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    conn.request("POST", path, body=body, headers={
+        "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+        "Content-Length": str(length),
+    })
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.status
+
+
+def bomb_png():
+    def chunk(kind, data):
+        return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data) & 0xffffffff)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack("!IIBBBBB", 60000, 60000, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"\0" * 4096)) + chunk(b"IEND", b""))
+
+
+def run_level(concurrency, image_path, audio_path, spool_kb, workdir):
+    env = dict(os.environ, MODEL_LOAD="lazy", UPLOAD_SPOOL_KB=str(spool_kb), UPLOAD_IMAGE_MAX_MB="1024",
+               UPLOAD_AUDIO_MAX_MB="1024", PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ.get("PYTHONPATH", "")]))
+    server = subprocess.Popen([sys.executable, "-c", SERVER], cwd=workdir, env=env,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline())
+        warmup = http.client.HTTPConnection("127.0.0.1", port)
+        warmup.request("GET", "/healthz")
+        warmup.getresponse().read()
+        idle = memory_kb(server.pid, "VmRSS:")
+        statuses = []
+        threads = []
+        for index in range(concurrency):
+            if index % 2 == 0:
+                target = (port, "/upload_image", "image", image_path)
+            else:
+                target = (port, "/upload_audio", "audio", audio_path, {"record_id": "bench"})
+            threads.append(threading.Thread(target=lambda args=target: statuses.append(post(*args))))
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        peak = memory_kb(server.pid, "VmHWM:")
+
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        body = bomb_png()
+        started = time.perf_counter()
+        conn.request("POST", "/upload_image", body=(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="bomb.png"\r\n\r\n'.encode()
+            + body + f"\r\n--{BOUNDARY}--\r\n".encode()),
+            headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+        bomb_status = conn.getresponse().status
+        bomb_ms = (time.perf_counter() - started) * 1000.0
+    finally:
+        server.terminate()
+        server.wait()
+    return statuses, elapsed, (peak - idle) / 1024.0, bomb_status, bomb_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=15)
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--spool-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    image_path, audio_path = make_files(int(args.size_mb * 1024 * 1024))
+    workdir = tempfile.mkdtemp(prefix="oralscan-bench-")
+    for folder in ("static/uploads", "static/audio"):
+        os.makedirs(os.path.join(workdir, folder))
+    try:
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            statuses, elapsed, growth, bomb_status, bomb_ms = run_level(
+                concurrency, image_path, audio_path, args.spool_kb, workdir)
+            print(f"{concurrency:3d} concurrent x {args.size_mb:g} MB: {elapsed:6.2f}s  statuses {sorted(set(statuses))}  "
+                  f"peak RSS +{growth:7.1f} MB ({growth / concurrency:6.2f} MB/request)  "
+                  f"bomb -> {bomb_status} in {bomb_ms:.1f} ms")
+    finally:
+        os.remove(image_path)
+        os.remove(audio_path)
+
+
+if __name__ == "__main__":
+    main()
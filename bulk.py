@@ -0,0 +1,48 @@
+"""Input handling for bulk screening uploads from outreach camps.
+
+A camp upload is either one ZIP archive of photos or a multipart set of
+image files, plus an optional CSV of symptom fields keyed by file name.
+Images are yielded one at a time as streams, so the archive is never fully
+extracted into memory.
+"""
+import csv
+import io
+import os
+import zipfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def iter_images(archive=None, files=()):
+    """Yield ``(filename, stream)`` for every image in the ZIP and/or file list."""
+    if archive is not None and archive.filename:
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if info.is_dir() or os.path.basename(name).startswith('.') or '__MACOSX' in name:
+                    continue
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                with zf.open(info) as stream:
+                    yield os.path.basename(name), stream
+    for file in files:
+        if file and file.filename:
+            yield os.path.basename(file.filename), file.stream
+
+
+def read_symptoms_csv(file):
+    """Map image file name -> CSV row. ``habits`` may list several values separated by ';'."""
+    if file is None or not file.filename:
+        return {}
+    reader = csv.DictReader(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''))
+    rows = {}
+    for row in reader:
+        row = {(key or '').strip(): (value or '').strip() for key, value in row.items()}
+        filename = os.path.basename(row.get('filename', ''))
+        if filename:
+            rows[filename] = row
+    return rows
+
+
+def habits_from_row(row):
+    return [habit.strip() for habit in row.get('habits', '').split(';') if habit.strip()]
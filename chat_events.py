@@ -0,0 +1,85 @@
+"""In-process pub/sub fan-out for chat messages, served as Server-Sent Events.
+
+Every open chat window holds one subscription to its record. Posting a
+message publishes it once and each subscriber's queue receives it, so
+windows get new messages pushed instead of reloading or polling.
+
+A subscriber that falls ``max_queue`` messages behind is dropped. Its
+EventSource reconnects with ``Last-Event-ID`` and catches up from the store.
+"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, record_id, max_queue):
+        self.record_id = record_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class ChatBroker:
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, record_id):
+        subscription = Subscription(record_id, self.max_queue)
+        with self._lock:
+            self._subscribers[record_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.record_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.record_id]
+
+    def publish(self, record_id, event_id, payload, event="message"):
+        with self._lock:
+            subscribers = list(self._subscribers.get(record_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event_id, event, payload))
+            except queue.Full:
+                subscription.closed = True
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self, record_id=None):
+        with self._lock:
+            if record_id is not None:
+                return len(self._subscribers.get(record_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+def format_event(event_id, payload, event="message"):
+    # Events without an ID (read receipts) leave the client's Last-Event-ID alone
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{frame}event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream(broker, subscription, backlog=()):
+    """Yield SSE frames: ``backlog`` first, then live messages until the client goes away."""
+    try:
+        for event_id, payload in backlog:
+            yield format_event(event_id, payload)
+        while not subscription.closed:
+            try:
+                event_id, event, payload = subscription.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                # Comment frame: keeps proxies from timing out and detects closed clients
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event_id, payload, event)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,135 @@
+"""Content-hash deduplication of screening images and their predictions.
+
+The same photo is often submitted more than once: a patient retries, a
+camp ZIP is re-uploaded, or a clinic sends a follow-up with an old image.
+Each decoded image is hashed once (SHA-256 over its pixels), and the hash
+is used twice:
+
+- ``ImageStore`` archives the image as ``<hash>.jpg`` in a shard directory
+  of ``static/uploads`` (see ``artifacts``), so identical uploads share a
+  single file and are written once
+- ``PredictionCache`` keeps the model score per ``(hash, model version)``,
+  so a repeat upload skips the forward pass. Entries are dropped
+  least-recently-used past ``max_entries``, and after ``ttl_seconds``.
+  Loading a different model file changes the version, so scores from the
+  old model are never served
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from artifacts import locate, shard_path, touch
+from preprocessing import archive_async
+
+
+def content_hash(img):
+    """Hex SHA-256 of a decoded image's mode, size and pixels."""
+    digest = hashlib.sha256(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def _done():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class ImageStore:
+    """Archive folder that keeps one JPEG per distinct image."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._writing = {}  # hash -> Future of the in-flight write
+        self._lock = threading.RLock()
+        self.stored = 0
+        self.deduplicated = 0
+
+    def path_for(self, image_hash):
+        # Archived before sharding: keep using the flat file
+        name = f"{image_hash}.jpg"
+        return locate(self.folder, name) or shard_path(self.folder, name, create=True)
+
+    def store(self, img, image_hash):
+        """Archive ``img`` under its hash unless it is already there.
+
+        Returns ``(path, future)``; the future completes once the file exists.
+        """
+        path = self.path_for(image_hash)
+        with self._lock:
+            future = self._writing.get(image_hash)
+            if future is None and not os.path.exists(path):
+                future = self._writing[image_hash] = archive_async(img, path)
+                future.add_done_callback(lambda _: self._finished(image_hash))
+                self.stored += 1
+                return path, future
+            self.deduplicated += 1
+        if future is None:
+            touch(path)
+        return path, future or _done()
+
+    def _finished(self, image_hash):
+        with self._lock:
+            self._writing.pop(image_hash, None)
+
+    def stats(self):
+        with self._lock:
+            return {"stored": self.stored, "deduplicated": self.deduplicated}
+
+
+class PredictionCache:
+    """Thread-safe LRU of model scores with a time-to-live, with hit/miss counters."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,151 @@
+"""Resized WebP/JPEG versions of uploaded images for pages that show them.
+
+Dashboards and the result page used to link the original upload, so a
+dashboard of 25 phone photos weighed tens of megabytes. Pages now link a
+derivative instead:
+
+- ``thumb``: at most 160 px on the long side (dashboard table rows)
+- ``medium``: at most 800 px on the long side (cards and the result page)
+
+Each size exists as WebP and as JPEG; templates offer both through
+``<picture>`` and the browser picks. Derivatives are made from the decoded
+image at ingest (``prepare``), on a background pool. An upload from before
+this change gets its derivatives on the first request instead (``path``),
+decoded at a reduced JPEG scale. Files go to
+``static/derivatives/<size>/<shard>/<upload name>.<format>``, in the shard
+directory of the upload's name, and are written once.
+
+Upload names never change content (content hashes or unique IDs), so the
+responses carry long-lived, immutable cache headers. Bump
+``DERIVATIVE_VERSION`` when sizes or encoder settings change; it is part
+of every URL.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from artifacts import locate, shard_path
+from logs import get_logger
+
+DERIVATIVE_VERSION = "1"
+DERIVATIVE_DIR = os.path.join("static", "derivatives")
+SIZES = {"thumb": 160, "medium": 800}
+FORMATS = {"webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+           "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True})}
+CACHE_SECONDS = 365 * 24 * 3600
+
+log = get_logger("derivatives")
+
+
+class DerivativeStore:
+    def __init__(self, source_dir, cache_dir=DERIVATIVE_DIR, max_workers=2):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        for size in SIZES:
+            os.makedirs(os.path.join(cache_dir, size), exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="derivatives")
+        self._locks = {}  # upload name -> [lock, threads holding or waiting on it]
+        self._pending = {}  # upload name -> Future of its ingest-time generation
+        self._locks_lock = threading.Lock()
+
+    def _target(self, name, size, fmt, create=False):
+        # Sharded by the upload's name, so all of an upload's derivatives are found from it
+        folder = os.path.dirname(shard_path(os.path.join(self.cache_dir, size), name, create))
+        return os.path.join(folder, f"{name}.{fmt}")
+
+    def files_for(self, name):
+        """Every derivative file upload ``name`` can have, for removal with the upload."""
+        return [path for size in SIZES for fmt in FORMATS
+                for path in (self._target(name, size, fmt), os.path.join(self.cache_dir, size, f"{name}.{fmt}"))]
+
+    def _lock_for(self, name):
+        with self._locks_lock:
+            entry = self._locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release(self, name):
+        # Dropped only by the last user, so a waiter never ends up on a lock
+        # a newcomer no longer shares
+        with self._locks_lock:
+            entry = self._locks[name]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[name]
+
+    def _write_all(self, img, name):
+        # Largest first, each size resized from the one before: cheaper than
+        # resizing the full image every time
+        current = img if img.mode == "RGB" else img.convert("RGB")
+        for size, side in sorted(SIZES.items(), key=lambda item: -item[1]):
+            current = current.copy()
+            current.thumbnail((side, side), Image.LANCZOS, reducing_gap=3.0)
+            for fmt, (pil_format, _, options) in FORMATS.items():
+                target = self._target(name, size, fmt, create=True)
+                if os.path.exists(target):
+                    continue
+                partial = f"{target}.{threading.get_ident()}.tmp"
+                current.save(partial, pil_format, **options)
+                os.replace(partial, target)
+
+    def _generate(self, img, name):
+        lock = self._lock_for(name)
+        try:
+            with lock:
+                if all(os.path.exists(self._target(name, size, fmt)) for size in SIZES for fmt in FORMATS):
+                    return
+                if img is None:
+                    img = self._decode(name)
+                self._write_all(img, name)
+        finally:
+            self._release(name)
+
+    def _decode(self, name):
+        img = Image.open(locate(self.source_dir, name))
+        side = max(SIZES.values())
+        # Reduced-scale JPEG decode; other formats decode at full size
+        img.draft("RGB", (side, side))
+        return img.convert("RGB")
+
+    def prepare(self, img, image_path):
+        """Make every derivative of an upload from its decoded image, off the request thread."""
+        name = os.path.basename(image_path)
+        if all(os.path.exists(self._target(name, size, fmt)) for size in SIZES for fmt in FORMATS):
+            return None
+        future = self._pool.submit(self._generate, img, name)
+        with self._locks_lock:
+            self._pending[name] = future
+        future.add_done_callback(lambda done: self._prepared(name, done))
+        return future
+
+    def _prepared(self, name, future):
+        with self._locks_lock:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+        if future.exception() is not None:
+            log.warning("derivatives.failed", name=name, error=str(future.exception()))
+
+    def path(self, name, size, fmt):
+        """File for one derivative of upload ``name``, made now if missing; None if there is no such upload."""
+        if size not in SIZES or fmt not in FORMATS or name != os.path.basename(name):
+            return None
+        target = self._target(name, size, fmt)
+        with self._locks_lock:
+            pending = self._pending.get(name)
+        if pending is not None and not os.path.exists(target):
+            # The result page can ask before the upload's archive is written
+            try:
+                pending.result()
+            except Exception:
+                pass
+        if not os.path.exists(target):
+            if locate(self.source_dir, name) is None:
+                return None
+            self._generate(None, name)
+        return target
+
+    @staticmethod
+    def mimetype(fmt):
+        return FORMATS[fmt][1]
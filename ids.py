@@ -0,0 +1,45 @@
+"""Collision-free, time-sortable record IDs.
+
+IDs follow the ULID layout: a 48-bit millisecond timestamp followed by 80
+random bits, written as 26 Crockford base32 characters. IDs generated in the
+same millisecond increment the random part, so they are unique and sort in
+creation order within a process, and are safe to use in file names.
+"""
+import os
+import threading
+import time
+
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_record_id():
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms <= _last_ms:
+            # Same millisecond (or clock went backwards): stay monotonic
+            now_ms = _last_ms
+            random_part = _last_random + 1
+            if random_part > _RANDOM_MAX:
+                now_ms += 1
+                random_part = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # Top bit left clear so increments within a millisecond cannot overflow
+            random_part = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_ms, _last_random = now_ms, random_part
+    return _encode(now_ms, 10) + _encode(random_part, 16)
+
@@ -0,0 +1,151 @@
+"""Compiled, warmed-up inference path for the Keras model.
+
+``model.predict`` builds a data adapter, callbacks and a progress bar on every
+call, and the first call after ``load_model`` also traces the graph inside a
+patient's request. ``CompiledModel`` traces one concrete function per batch
+bucket (1, 2, 4, ... up to ``max_batch_size``, each N x 224 x 224 x 3), runs
+warm-up passes through all of them at boot, and pads incoming batches up to
+the nearest bucket so no request ever triggers a retrace.
+"""
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def batch_buckets(max_batch_size):
+    buckets = []
+    size = 1
+    while size < max_batch_size:
+        buckets.append(size)
+        size *= 2
+    buckets.append(max_batch_size)
+    return buckets
+
+
+class CompiledModel:
+    def __init__(self, model, max_batch_size=16, stats_window=1024):
+        import tensorflow as tf
+
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.buckets = batch_buckets(self.max_batch_size)
+        self._tf = tf
+        self._call = tf.function(lambda x: model(x, training=False))
+        self._functions = {}
+        self._explain = None
+        self._explain_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=stats_window))
+        self.warmup_seconds = None
+
+    def _function_for(self, size):
+        function = self._functions.get(size)
+        if function is None:
+            spec = self._tf.TensorSpec((size,) + INPUT_SHAPE, self._tf.float32)
+            function = self._call.get_concrete_function(spec)
+            self._functions[size] = function
+        return function
+
+    def _bucket_for(self, size):
+        for bucket in self.buckets:
+            if bucket >= size:
+                return bucket
+        return self.max_batch_size
+
+    def warmup(self, runs=2):
+        """Trace every bucket and run it ``runs`` times; returns the elapsed seconds."""
+        started = time.perf_counter()
+        for size in self.buckets:
+            batch = np.zeros((size,) + INPUT_SHAPE, dtype=np.float32)
+            for _ in range(max(1, runs)):
+                self._run(batch)
+        self.warmup_seconds = time.perf_counter() - started
+        # Warm-up passes are not steady-state traffic
+        with self._stats_lock:
+            self._latencies.clear()
+        return self.warmup_seconds
+
+    def predict(self, batch):
+        """Run a (n, 224, 224, 3) float32 batch and return an (n, 1) array."""
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) <= self.max_batch_size:
+            return self._run(batch)
+        return np.concatenate([
+            self._run(batch[start:start + self.max_batch_size])
+            for start in range(0, len(batch), self.max_batch_size)
+        ])
+
+    def _run(self, batch):
+        size = len(batch)
+        bucket = self._bucket_for(size)
+        if bucket != size:
+            padding = np.zeros((bucket - size,) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, padding])
+        started = time.perf_counter()
+        output = np.asarray(self._invoke(bucket, batch))[:size]
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._latencies[bucket].append(elapsed)
+        return output
+
+    def _last_conv_layer(self):
+        for layer in reversed(self.model.layers):
+            if len(layer.output.shape) == 4:
+                return layer
+        raise ValueError("The model has no convolutional layer to explain")
+
+    def _explainer(self):
+        with self._explain_lock:
+            if self._explain is None:
+                import keras
+
+                tf = self._tf
+                layer_name = os.environ.get("SALIENCY_LAYER")
+                layer = self.model.get_layer(layer_name) if layer_name else self._last_conv_layer()
+                outputs = keras.Model(self.model.inputs, [layer.output, self.model.output])
+
+                @tf.function(input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)])
+                def explain(x):
+                    with tf.GradientTape() as tape:
+                        activations, output = outputs(x, training=False)
+                        # Scores below 0.5 are the cancer class; explain its probability
+                        target = tf.reduce_sum(1.0 - output)
+                    weights = tf.reduce_mean(tape.gradient(target, activations), axis=(1, 2), keepdims=True)
+                    return output, tf.nn.relu(tf.reduce_sum(weights * activations, axis=-1))
+
+                self._explain = explain
+            return self._explain
+
+    def explain(self, batch):
+        """Scores and Grad-CAM maps from one forward (and backward) pass: ``(n, 1)`` and ``(n, h, w)``."""
+        batch = np.asarray(batch, dtype=np.float32)
+        output, cams = self._explainer()(self._tf.constant(batch))
+        return np.asarray(output), np.asarray(cams)
+
+    def _invoke(self, bucket, batch):
+        return self._function_for(bucket)(self._tf.constant(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = {bucket: sorted(values) for bucket, values in self._latencies.items()}
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(p / 100.0 * len(values)))] * 1000.0
+
+        return {
+            "warmup_seconds": self.warmup_seconds,
+            "buckets": self.buckets,
+            "latency_ms": {
+                bucket: {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p99": percentile(values, 99),
+                }
+                for bucket, values in sorted(latencies.items()) if values
+            },
+        }
@@ -0,0 +1,309 @@
+"""Inference server: one process owns the model, WSGI workers share it.
+
+With several Gunicorn workers every worker would otherwise import
+TensorFlow and load its own copy of the model. With
+``INFERENCE_MODE=server`` the workers use an ``InferenceClient`` instead,
+and a single server process runs the model:
+
+    python -m inference_server                      # reads the same env vars as the app
+    INFERENCE_MODE=server gunicorn -w 4 app:app
+
+Preprocessed tensors never go through the socket. Each worker process owns
+a shared-memory segment of fixed-size input slots. It writes the tensor
+into a free slot and sends only a small JSON header (segment name and slot
+numbers) over the Unix socket ``INFERENCE_SOCKET``. The server maps the
+segment once and reads the slot in place. Single-image requests from all
+workers go through the server's ``BatchingEngine``, so they are batched
+together across processes.
+
+Messages on the socket are a 4-byte big-endian length followed by JSON.
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from logs import get_logger
+from model_service import ModelNotReady, service_from_env
+
+log = get_logger("inference_server")
+
+INPUT_SHAPE = (224, 224, 3)
+SLOT_BYTES = int(np.prod(INPUT_SHAPE)) * 4
+DEFAULT_SOCKET = "/tmp/oralscan-inference.sock"
+_HEADER = struct.Struct("!I")
+
+
+def send_message(conn, message):
+    payload = json.dumps(message).encode("utf-8")
+    conn.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(conn):
+    header = _recv_exact(conn, _HEADER.size)
+    if header is None:
+        return None
+    payload = _recv_exact(conn, _HEADER.unpack(header)[0])
+    return None if payload is None else json.loads(payload)
+
+
+def _attach(name):
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        # The worker owns the segment; stop this process's resource tracker
+        # from unlinking it when the server exits
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    return segment
+
+
+class InferenceServer:
+    def __init__(self, service, socket_path=DEFAULT_SOCKET):
+        self.service = service
+        self.socket_path = socket_path
+        self._segments = {}
+        self._segments_lock = threading.Lock()
+
+    def _slots(self, name):
+        with self._segments_lock:
+            segment = self._segments.get(name)
+            if segment is None:
+                segment = self._segments[name] = _attach(name)
+        count = segment.size // SLOT_BYTES
+        return np.ndarray((count,) + INPUT_SHAPE, dtype=np.float32, buffer=segment.buf)
+
+    def _dispatch(self, request):
+        op = request.get("op")
+        if op == "status":
+            return self.service.status()
+        if op == "stats":
+            return self.service.wait(0).stats()
+        if op == "detach":
+            with self._segments_lock:
+                segment = self._segments.pop(request.get("shm"), None)
+            if segment is not None:
+                try:
+                    segment.close()
+                except BufferError:
+                    pass  # a view is still alive; the mapping goes when it does
+            return {}
+        if op == "predict":
+            self.service.wait(request.get("timeout"))
+            slots = self._slots(request["shm"])
+            indexes = request["slots"]
+            if len(indexes) == 1:
+                # Read in place; batched with single images from every worker
+                scores = np.asarray(self.service.predict(slots[indexes[0]]))[None]
+            else:
+                scores = self.service.predict_batch(slots[indexes])
+            return {"scores": np.asarray(scores, dtype=np.float32).reshape(len(indexes), -1).tolist()}
+        return {"error": f"Unknown op: {op}"}
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = recv_message(conn)
+                except OSError:
+                    return
+                if request is None:
+                    return
+                try:
+                    response = self._dispatch(request)
+                except ModelNotReady as e:
+                    response = {"error": str(e), "not_ready": True}
+                except Exception as e:
+                    response = {"error": str(e)}
+                try:
+                    send_message(conn, response)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen(128)
+        log.info("inference_server.listening", socket=self.socket_path)
+        try:
+            while True:
+                conn, _ = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class InferenceClient:
+    """``ModelService`` interface for app.py that forwards to an ``InferenceServer``.
+
+    Each request thread keeps its own connection. ``slots`` bounds how many
+    images this process can have in flight; bulk batches larger than that are
+    sent in chunks.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, slots=32):
+        self.socket_path = socket_path
+        self.slot_count = max(1, int(slots))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._acquire_lock = threading.Lock()
+        self._pid = None
+        self._segment = None
+        self._slots = None
+        self._free = None
+        self.model_version = None
+
+    # Shared-memory slots, created per process (workers fork after import)
+
+    def _ensure_segment(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            segment = shared_memory.SharedMemory(create=True, size=self.slot_count * SLOT_BYTES)
+            self._slots = np.ndarray((self.slot_count,) + INPUT_SHAPE, dtype=np.float32, buffer=segment.buf)
+            self._free = queue.Queue()
+            for index in range(self.slot_count):
+                self._free.put(index)
+            self._segment = segment
+            self._pid = os.getpid()
+            atexit.register(self._release_segment, segment)
+
+    def _release_segment(self, segment):
+        try:
+            self._request({"op": "detach", "shm": segment.name})
+        except Exception:
+            pass
+        if self._segment is segment:
+            self._slots = None
+        segment.close()
+        segment.unlink()
+
+    # Connection handling
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(self.socket_path)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _request(self, message):
+        try:
+            conn = self._connection()
+            send_message(conn, message)
+            response = recv_message(conn)
+        except OSError as e:
+            self._local.conn = None
+            raise ModelNotReady(f"Inference server unavailable: {e}")
+        if response is None:
+            self._local.conn = None
+            raise ModelNotReady("Inference server closed the connection")
+        if response.get("not_ready"):
+            raise ModelNotReady(response["error"])
+        if response.get("error") is not None and "status" not in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    # ModelService interface
+
+    def start(self, background=True):
+        # The server process loads the model
+        return self
+
+    @property
+    def ready(self):
+        return self.status()["status"] == "ready"
+
+    def status(self):
+        try:
+            status = self._request({"op": "status"})
+        except ModelNotReady as e:
+            return {"status": "unavailable", "error": str(e), "socket": self.socket_path}
+        status["socket"] = self.socket_path
+        return status
+
+    def stats(self):
+        return self._request({"op": "stats"})
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.status()
+            if status["status"] == "ready":
+                self.model_version = status.get("model_version")
+                return self
+            if status["status"] == "failed":
+                raise ModelNotReady(f"The screening model failed to load: {status.get('error')}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise ModelNotReady("The screening model is still loading, please retry shortly")
+            time.sleep(0.1)
+
+    def _predict_slots(self, arrays, timeout):
+        self._ensure_segment()
+        # One thread gathers slots at a time, so two batches can never each
+        # hold part of the slots while waiting for the rest
+        with self._acquire_lock:
+            indexes = [self._free.get() for _ in arrays]
+        try:
+            for index, array in zip(indexes, arrays):
+                self._slots[index] = array
+            response = self._request({
+                "op": "predict", "shm": self._segment.name, "slots": indexes, "timeout": timeout,
+            })
+        finally:
+            for index in indexes:
+                self._free.put(index)
+        return np.asarray(response["scores"], dtype=np.float32)
+
+    def predict(self, array, timeout=None):
+        """One image; the server batches it with requests from other workers."""
+        return self._predict_slots([array], timeout)[0]
+
+    def predict_batch(self, batch, timeout=None):
+        """A whole batch, sent in chunks of at most half the slots."""
+        chunk = max(1, self.slot_count // 2)
+        return np.concatenate([
+            self._predict_slots(batch[start:start + chunk], timeout)
+            for start in range(0, len(batch), chunk)
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the screening model to app workers over a Unix socket")
+    parser.add_argument("--socket", default=os.environ.get("INFERENCE_SOCKET", DEFAULT_SOCKET))
+    args = parser.parse_args()
+    service = service_from_env().start(background=False)
+    if service.error is not None:
+        raise SystemExit(f"Model failed to load: {service.error}")
+    InferenceServer(service, args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+"""Snapshot + write-ahead journal for the in-memory stores.
+
+The ``memory`` backend keeps ``patient_records`` and ``users`` in process
+memory and used to lose both on restart. With ``RECORD_JOURNAL_DIR`` set,
+every mutation is also appended to a JSONL journal in that directory. That
+covers screenings, submitted patient data, chat messages and read marks,
+status and follow-up changes, uploads, report paths, deletes and accounts.
+
+- One writer thread does all the writes. Entries queued while it writes
+  and syncs go out together in the next write and share one ``fsync``
+  (group commit).
+- ``JOURNAL_FSYNC=commit`` (default): a mutation returns once its entry is
+  on disk. ``interval``: entries are synced at most every
+  ``JOURNAL_FSYNC_INTERVAL_MS``, and a crash loses at most that window.
+  ``off``: the OS decides when to sync.
+- Every ``JOURNAL_SNAPSHOT_EVERY`` entries (or ``JOURNAL_SNAPSHOT_SECONDS``)
+  a snapshot of both stores is written, and the older journal segments and
+  snapshots are deleted.
+
+A snapshot starts a new journal segment and is then written while requests
+keep running, so it may already contain some changes from that segment.
+Replay is idempotent (sets, deletes, and chat messages keyed by sequence
+number), which makes that harmless. At boot the newest complete snapshot is
+loaded, then the journal segments from its one onwards are replayed. A line
+torn by a crash at the end of a segment is skipped.
+
+If a write or sync fails, the writer stops for good: from then on every
+mutation is refused with ``JournalError`` before it touches memory, the
+``oralscan_journal_failed`` gauge reads 1 and ``/healthz`` and ``/readyz``
+answer 503, so the process is restarted and replays what did reach disk.
+Mutations queued when the write failed stay in memory until then, but with
+``fsync=commit`` their callers get the error.
+
+Files: ``snapshot-<segment>.jsonl`` (a header line with the counts, then
+one line per user, then the records in lines of up to 1000) and ``journal-<segment>.jsonl``
+(one entry per line).
+"""
+import json
+import os
+import threading
+import time
+
+import metrics
+from logs import get_logger
+from record_store import RecordStore
+
+FSYNC_MODES = ("commit", "interval", "off")
+_ROTATE = "rotate"
+
+log = get_logger("journal")
+
+ENTRIES = metrics.REGISTRY.counter("oralscan_journal_entries_total", "Journal entries written")
+GROUP_SIZE = metrics.REGISTRY.histogram(
+    "oralscan_journal_group_size", "Journal entries per write and sync",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+COMMIT_SECONDS = metrics.REGISTRY.histogram(
+    "oralscan_journal_commit_seconds", "Time to write and sync one group of journal entries")
+SNAPSHOT_SECONDS = metrics.REGISTRY.histogram(
+    "oralscan_journal_snapshot_seconds", "Time to write a snapshot of the stores",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+def encode(entry):
+    return json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"journal-{segment:06d}.jsonl")
+
+
+def snapshot_path(directory, segment):
+    return os.path.join(directory, f"snapshot-{segment:06d}.jsonl")
+
+
+def _numbered(directory, prefix):
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(".jsonl"):
+            try:
+                numbers.append(int(name[len(prefix):-len(".jsonl")]))
+            except ValueError:
+                continue
+    return sorted(numbers)
+
+
+def _sync_directory(directory):
+    # Makes a rename or a new file itself durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal:
+    """Append-only JSONL segments, written by one thread with group commit."""
+
+    def __init__(self, directory, segment, fsync="commit", fsync_interval_ms=100):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"JOURNAL_FSYNC must be one of {', '.join(FSYNC_MODES)}, not {fsync!r}")
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.segment = segment
+        self.entries_since_rotate = 0
+        self.groups = 0
+        self.error = None
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended = 0  # entries queued
+        self._written = 0  # entries written, and synced unless fsync=off
+        self._closed = False
+        self._file = open(segment_path(directory, segment), "ab")
+        _sync_directory(directory)
+        metrics.REGISTRY.register_callback("oralscan_journal_failed", "gauge",
+                                           "1 once a journal write has failed and writes are refused",
+                                           lambda: int(self.error is not None))
+        self._thread = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, entry):
+        """Queue ``entry``; returns its number for ``wait``. Callers keep mutation order."""
+        data = encode(entry)
+        with self._cond:
+            self._check()
+            self._pending.append(data)
+            self._appended += 1
+            self.entries_since_rotate += 1
+            self._cond.notify_all()
+            return self._appended
+
+    def rotate(self):
+        """Start a new segment after the entries queued so far; returns its number."""
+        with self._cond:
+            self._check()
+            self.segment += 1
+            self._pending.append((_ROTATE, self.segment))
+            self.entries_since_rotate = 0
+            self._cond.notify_all()
+            return self.segment
+
+    def check(self):
+        """Raise ``JournalError`` if entries can no longer be written."""
+        with self._cond:
+            self._check()
+
+    def _check(self):
+        if self.error is not None:
+            raise JournalError(f"Journal write failed: {self.error}")
+        if self._closed:
+            raise JournalError("The journal is closed")
+
+    def wait(self, number):
+        """With ``fsync=commit``, block until entry ``number`` is on disk."""
+        if self.fsync != "commit":
+            return
+        with self._cond:
+            while self._written < number and self.error is None:
+                self._cond.wait()
+            if self._written < number:
+                raise JournalError(f"Journal write failed: {self.error}")
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync != "off":
+            os.fsync(self._file.fileno())
+
+    def _write_loop(self):
+        last_sync = time.monotonic()
+        dirty = False
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    if dirty:
+                        # interval mode: sync what is written once the interval is up
+                        remaining = self.fsync_interval - (time.monotonic() - last_sync)
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            break
+                    else:
+                        self._cond.wait()
+                batch, self._pending = self._pending, []
+                closing = self._closed
+            started = time.perf_counter()
+            count = 0
+            try:
+                chunk = []
+                for item in batch:
+                    if isinstance(item, tuple):
+                        # Everything queued before the rotation belongs to the old segment
+                        self._file.write(b"".join(chunk))
+                        chunk = []
+                        self._sync()
+                        self._file.close()
+                        self._file = open(segment_path(self.directory, item[1]), "ab")
+                        _sync_directory(self.directory)
+                    else:
+                        chunk.append(item)
+                        count += 1
+                self._file.write(b"".join(chunk))
+                dirty = dirty or count > 0
+                if self.fsync == "commit" or closing or (
+                        dirty and time.monotonic() - last_sync >= self.fsync_interval):
+                    self._sync()
+                    last_sync = time.monotonic()
+                    dirty = False
+                else:
+                    self._file.flush()
+            except Exception as e:
+                log.exception("journal.write_failed", segment=self.segment)
+                with self._cond:
+                    self.error = e
+                    self._pending = []
+                    self._cond.notify_all()
+                return
+            if count:
+                ENTRIES.inc(count)
+                GROUP_SIZE.observe(count)
+                COMMIT_SECONDS.observe(time.perf_counter() - started)
+            with self._cond:
+                self._written += count
+                self.groups += 1 if count else 0
+                self._cond.notify_all()
+            if closing:
+                self._file.close()
+                return
+
+    def close(self):
+        """Write and sync everything queued, then stop the writer."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "segment": self.segment,
+                "fsync": self.fsync,
+                "appended": self._appended,
+                "written": self._written,
+                "groups": self.groups,
+                "entries_per_group": self._written / self.groups if self.groups else None,
+                "entries_since_snapshot": self.entries_since_rotate,
+                "error": None if self.error is None else str(self.error),
+            }
+
+
+class DurableRecordStore(RecordStore):
+    """``RecordStore`` whose mutations are journaled; entries are queued under the store lock."""
+
+    persistent = True
+
+    def __init__(self):
+        super().__init__()
+        self.journal = None  # attached after replay
+
+    def _check(self):
+        # Refuse a mutation up front rather than change memory that cannot be journaled
+        if self.journal is not None:
+            self.journal.check()
+
+    def _log(self, entry):
+        return self.journal.append(entry) if self.journal is not None else 0
+
+    def _commit(self, number):
+        if number:
+            self.journal.wait(number)
+
+    def add(self, record):
+        with self._lock:
+            self._check()
+            super().add(record)
+            number = self._log({"op": "add", "record": record})
+        self._commit(number)
+        return record
+
+    def add_many(self, records):
+        with self._lock:
+            self._check()
+            for record in records:
+                super().add(record)
+            number = self._log({"op": "add_many", "records": records})
+        self._commit(number)
+        return records
+
+    def update(self, key, **fields):
+        with self._lock:
+            self._check()
+            record = super().update(key, **fields)
+            number = self._log({"op": "update", "key": record["id"], "fields": fields}) if record else 0
+        self._commit(number)
+        return record
+
+    def append_to(self, key, field, item):
+        with self._lock:
+            self._check()
+            record = super().append_to(key, field, item)
+            # The whole list, so replaying it twice is harmless
+            number = self._log({"op": "update", "key": record["id"], "fields": {field: record[field]}}) if record else 0
+        self._commit(number)
+        return record
+
+    def append_message(self, key, sender, message, time):
+        with self._lock:
+            self._check()
+            entry = super().append_message(key, sender, message, time)
+            number = self._log({"op": "message", "key": self.resolve(key), "entry": entry}) if entry else 0
+        self._commit(number)
+        return entry
+
+    def mark_read(self, key, role, seq=None):
+        with self._lock:
+            self._check()
+            read = super().mark_read(key, role, seq)
+            number = self._log({"op": "read", "key": self.resolve(key), "role": role, "seq": read}) \
+                if read is not None else 0
+        self._commit(number)
+        return read
+
+    def delete(self, key):
+        with self._lock:
+            self._check()
+            record = super().delete(key)
+            number = self._log({"op": "delete", "key": record["id"]}) if record else 0
+        self._commit(number)
+        return record
+
+
+class DurableUsers(dict):
+    """The ``users`` dict, with assignments and deletes journaled."""
+
+    def __init__(self):
+        super().__init__()
+        self.journal = None
+        self._lock = threading.Lock()
+
+    def __setitem__(self, username, data):
+        with self._lock:
+            if self.journal is not None:
+                self.journal.check()
+            super().__setitem__(username, data)
+            number = self.journal.append({"op": "user", "username": username, "data": data}) if self.journal else 0
+        if number:
+            self.journal.wait(number)
+
+    def __delitem__(self, username):
+        with self._lock:
+            if self.journal is not None:
+                self.journal.check()
+            super().__delitem__(username)
+            number = self.journal.append({"op": "user_delete", "username": username}) if self.journal else 0
+        if number:
+            self.journal.wait(number)
+
+
+def apply(records, users, entry):
+    """Replay one journal entry; every operation may safely be applied twice."""
+    op = entry["op"]
+    if op == "add":
+        records.add(entry["record"])
+    elif op == "add_many":
+        records.add_many(entry["records"])
+    elif op == "update":
+        records.update(entry["key"], **entry["fields"])
+    elif op == "message":
+        message = entry["entry"]
+        record = records.get(entry["key"])
+        if record is not None and message["seq"] > len(record["messages"]):
+            records.append_message(entry["key"], message["sender"], message["message"], message["time"])
+    elif op == "read":
+        records.mark_read(entry["key"], entry["role"], entry["seq"])
+    elif op == "delete":
+        records.delete(entry["key"])
+    elif op == "user":
+        dict.__setitem__(users, entry["username"], entry["data"])
+    elif op == "user_delete":
+        dict.pop(users, entry["username"], None)
+
+
+class Durability:
+    """Loads the stores from disk at boot, journals them and takes snapshots."""
+
+    def __init__(self, directory, fsync="commit", fsync_interval_ms=100, snapshot_every=100000,
+                 snapshot_seconds=3600):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.snapshot_seconds = snapshot_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.records = DurableRecordStore()
+        self.users = DurableUsers()
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_snapshot = None
+        self.replay = self._load()
+        self.journal = Journal(directory, self.replay["next_segment"], fsync, fsync_interval_ms)
+        self.records.journal = self.journal
+        self.users.journal = self.journal
+        self._snapshots = threading.Thread(target=self._snapshot_loop, name="journal-snapshots", daemon=True)
+        self._snapshots.start()
+
+    def _load(self):
+        started = time.perf_counter()
+        snapshots = _numbered(self.directory, "snapshot-")
+        base = snapshots[-1] if snapshots else 0
+        loaded = 0
+        if base:
+            with open(snapshot_path(self.directory, base), "rb") as snapshot:
+                header = json.loads(next(snapshot))
+                for _ in range(header["users"]):
+                    item = json.loads(next(snapshot))
+                    dict.__setitem__(self.users, item["user"], item["data"])
+                for line in snapshot:
+                    chunk = json.loads(line)
+                    self.records.add_many(chunk)
+                    loaded += len(chunk)
+        replayed = 0
+        segments = [segment for segment in _numbered(self.directory, "journal-") if segment >= base]
+        for segment in segments:
+            with open(segment_path(self.directory, segment), "rb") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn write at the end of a segment: the entry never committed
+                        log.warning("journal.torn_entry", segment=segment)
+                        break
+                    apply(self.records, self.users, entry)
+                    replayed += 1
+        # New writes never go into a segment that may end in a torn line
+        next_segment = max(segments + [base, 0]) + 1
+        replay = {"snapshot": base or None, "snapshot_records": loaded, "journal_entries": replayed,
+                  "next_segment": next_segment, "seconds": time.perf_counter() - started}
+        log.info("journal.replayed", records=len(self.records), users=len(self.users),
+                 **{key: value for key, value in replay.items() if key != "seconds"},
+                 seconds=round(replay["seconds"], 3))
+        return replay
+
+    def snapshot(self):
+        """Write a snapshot of both stores and drop the journal it replaces; returns its path or None."""
+        if not self._snapshot_lock.acquire(blocking=False):
+            return None
+        try:
+            started = time.perf_counter()
+            with self.records._lock:
+                segment = self.journal.rotate()
+                keys = list(self.records._order)
+            path = snapshot_path(self.directory, segment)
+            partial = f"{path}.tmp"
+            with open(partial, "wb") as snapshot:
+                users = list(self.users.items())
+                snapshot.write(encode({"snapshot": segment, "users": len(users), "records": len(keys),
+                                       "time": time.time()}))
+                snapshot.write(b"".join(encode({"user": name, "data": data}) for name, data in users))
+                for start in range(0, len(keys), 1000):
+                    # Short lock holds, so requests keep running while the snapshot is written
+                    with self.records._lock:
+                        chunk = [record for record in map(self.records._records.get, keys[start:start + 1000])
+                                 if record is not None]
+                        line = encode(chunk)
+                    snapshot.write(line)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(partial, path)
+            _sync_directory(self.directory)
+            for old in _numbered(self.directory, "snapshot-"):
+                if old < segment:
+                    os.remove(snapshot_path(self.directory, old))
+            for old in _numbered(self.directory, "journal-"):
+                if old < segment:
+                    os.remove(segment_path(self.directory, old))
+            elapsed = time.perf_counter() - started
+            SNAPSHOT_SECONDS.observe(elapsed)
+            self.last_snapshot = {"segment": segment, "records": len(keys), "seconds": elapsed, "time": time.time()}
+            log.info("journal.snapshot", segment=segment, records=len(keys), seconds=round(elapsed, 3))
+            return path
+        finally:
+            self._snapshot_lock.release()
+
+    def _snapshot_loop(self):
+        last = time.monotonic()
+        while not self._stop.wait(1.0):
+            pending = self.journal.entries_since_rotate
+            if pending >= self.snapshot_every or (pending and time.monotonic() - last >= self.snapshot_seconds):
+                try:
+                    self.snapshot()
+                except Exception:
+                    log.exception("journal.snapshot_failed")
+                last = time.monotonic()
+
+    def close(self):
+        self._stop.set()
+        self.journal.close()
+
+    def stats(self):
+        stats = self.journal.stats()
+        stats["last_snapshot"] = self.last_snapshot
+        stats["replay"] = {key: value for key, value in self.replay.items() if key != "next_segment"}
+        return stats
+
+
+def durability_from_env(directory):
+    return Durability(
+        directory,
+        fsync=os.environ.get("JOURNAL_FSYNC", "commit"),
+        fsync_interval_ms=float(os.environ.get("JOURNAL_FSYNC_INTERVAL_MS", 100)),
+        snapshot_every=int(os.environ.get("JOURNAL_SNAPSHOT_EVERY", 100000)),
+        snapshot_seconds=float(os.environ.get("JOURNAL_SNAPSHOT_SECONDS", 3600)),
+    )
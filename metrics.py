@@ -0,0 +1,226 @@
+"""Prometheus-style metrics: counters, latency histograms and stage timers.
+
+Everything is kept in process and rendered in the Prometheus text format at
+``/metrics``:
+
+- ``span("predict.decode")`` times one stage of a request into
+  ``oralscan_stage_seconds{stage=...}``. A stage that raises is also counted
+  in ``oralscan_stage_errors_total``
+- ``instrument(app)`` records the rate, 5xx error rate and latency of
+  every request, labelled by route pattern (``/reports/<job_id>``, not the
+  concrete URL), so the number of series stays bounded
+- ``REGISTRY.register_callback`` exports values owned by other objects,
+  such as the prediction cache counters, and reads them at scrape time
+
+With several workers, each process serves its own numbers; scrape every
+worker or run a single one.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.label_names), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', '+Inf'))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(float(values[-2]))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {values[-1]}")
+        return lines
+
+
+class Callback:
+    """A metric read from ``fn()`` at scrape time; ``fn`` returns a number or None."""
+
+    def __init__(self, name, kind, help_text, fn):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_number(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Callback):
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def register_callback(self, name, kind, help_text, fn):
+        return self._register(Callback(name, kind, help_text, fn))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "oralscan_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "oralscan_stage_errors_total", "Pipeline stages that raised", ("stage",))
+HTTP_REQUESTS = REGISTRY.counter(
+    "oralscan_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_ERRORS = REGISTRY.counter(
+    "oralscan_http_request_errors_total", "HTTP requests answered with a 5xx status", ("route", "method"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "oralscan_http_request_duration_seconds", "Time to produce the response, by route", ("route", "method"))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage``."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def instrument(app):
+    """Count and time every request to ``app`` by route pattern."""
+    from flask import g, request
+
+    def route():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    def record(status):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        labels = {"route": route(), "method": request.method}
+        HTTP_LATENCY.observe(time.perf_counter() - started, **labels)
+        HTTP_REQUESTS.inc(status=str(status), **labels)
+        if status >= 500:
+            HTTP_ERRORS.inc(**labels)
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_response(response):
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _record_failure(exc):
+        # Only reached with the timer still set when no response was made
+        if exc is not None:
+            record(500)
+
+    return app
@@ -0,0 +1,195 @@
+"""Deferred loading of the screening model behind a readiness gate.
+
+Importing TensorFlow/Keras and deserializing ``oral_cancer_model.h5`` takes
+seconds, and app.py used to do both at import time, so every worker, test run
+and ``flask`` CLI call paid for them. ``ModelService`` loads, compiles and
+warms up the model off the import path instead:
+
+- ``MODEL_LOAD=background`` (default): a thread starts loading at boot
+- ``MODEL_LOAD=lazy``: loading starts on the first inference request
+- ``MODEL_LOAD=eager``: boot blocks until the model is ready, as before
+
+``MODEL_BACKEND=tflite`` loads the int8 TFLite build of the model instead
+(see ``tflite_model.py``). Routes that do not run the model never wait for it. Inference routes call
+``wait()``, which raises ``ModelNotReady`` if the model is not up in time;
+the app answers that with 503 and ``Retry-After``.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from logs import get_logger
+from metrics import span
+
+log = get_logger("model")
+
+
+class ModelNotReady(Exception):
+    pass
+
+
+class ModelService:
+    def __init__(self, path, max_batch_size=16, engine_batch_size=16, batch_window_ms=5.0, warmup_runs=2,
+                 backend="keras", threads=None):
+        self.path = path
+        self.backend = backend
+        self.threads = threads
+        self.max_batch_size = max_batch_size
+        self.engine_batch_size = engine_batch_size
+        self.batch_window_ms = batch_window_ms
+        self.warmup_runs = warmup_runs
+        self.compiled = None
+        self.engine = None
+        self.error = None
+        self.load_seconds = None
+        self.model_version = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, background=True):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="model-load", daemon=True)
+                self._thread.start()
+        if not background:
+            self._thread.join()
+        return self
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            # Imported here so importing the app never pulls in TensorFlow
+            from batching import BatchingEngine
+
+            if self.backend == "tflite":
+                from tflite_model import TFLiteModel
+
+                with span("model.load"):
+                    compiled = TFLiteModel(self.path, max_batch_size=self.max_batch_size, threads=self.threads)
+            else:
+                from keras.models import load_model
+                from inference import CompiledModel
+
+                with span("model.load"):
+                    model = load_model(self.path)
+                compiled = CompiledModel(model, max_batch_size=self.max_batch_size)
+            self.model_version = model_version(self.path)
+            # Traced per batch bucket and warmed up before the gate opens, so
+            # the first patient request does not pay graph tracing cost
+            compiled.warmup(runs=self.warmup_runs)
+            # Concurrent /predict calls are grouped into a single forward pass
+            self.engine = BatchingEngine(
+                compiled.predict,
+                max_batch_size=self.engine_batch_size,
+                max_wait_ms=self.batch_window_ms,
+            )
+            self.compiled = compiled
+            self.load_seconds = time.perf_counter() - started
+            log.info("model.ready", backend=self.backend, seconds=round(self.load_seconds, 3), version=self.model_version,
+                     warmup_seconds=round(compiled.warmup_seconds, 3), buckets=compiled.buckets)
+        except Exception as e:
+            self.error = e
+            log.exception("model.load_failed", path=self.path)
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def status(self):
+        if self._thread is None:
+            state = "not_started"
+        elif not self._ready.is_set():
+            state = "loading"
+        elif self.error is not None:
+            state = "failed"
+        else:
+            state = "ready"
+        return {
+            "status": state,
+            "model_path": self.path,
+            "backend": self.backend,
+            "model_version": self.model_version,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+    def stats(self):
+        """Batching and per-bucket latency statistics; only valid once ready."""
+        stats = self.engine.stats()
+        stats["model"] = self.compiled.stats()
+        return stats
+
+    def wait(self, timeout=None):
+        """Block until the model is ready; raises ModelNotReady on timeout or load failure."""
+        self.start()
+        if not self._ready.wait(timeout):
+            raise ModelNotReady("The screening model is still loading, please retry shortly")
+        if self.error is not None:
+            raise ModelNotReady(f"The screening model failed to load: {self.error}")
+        return self
+
+    def predict(self, array, timeout=None):
+        """One image, batched with other in-flight requests."""
+        return self.wait(timeout).engine.predict(array)
+
+    def predict_batch(self, batch, timeout=None):
+        """A whole batch in one forward pass (bulk uploads)."""
+        return self.wait(timeout).compiled.predict(batch)
+
+    @property
+    def can_explain(self):
+        # Grad-CAM needs gradients, which the TFLite interpreter does not give
+        return self.backend == "keras"
+
+    def explain(self, batch, timeout=None):
+        """Scores and Grad-CAM maps for a batch, from one pass (see ``saliency.py``)."""
+        return self.wait(timeout).compiled.explain(batch)
+
+
+def model_version(path):
+    """Short content hash of the model file; cached predictions are keyed on it."""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        # SavedModel directory: every file, in a stable order
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file_path in files:
+        with open(file_path, "rb") as model_file:
+            for chunk in iter(lambda: model_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def service_from_env():
+    """A ModelService configured from the environment, shared by the app and the inference server.
+
+    Bulk uploads use the larger batch buckets; ``PREDICT_MAX_BATCH=1`` disables batching.
+    """
+    predict_max_batch = int(os.environ.get("PREDICT_MAX_BATCH", 16))
+    bulk_batch_size = int(os.environ.get("BULK_BATCH_SIZE", 64))
+    backend = os.environ.get("MODEL_BACKEND", "keras")
+    path = os.environ.get("MODEL_PATH", "oral_cancer_model.h5")
+    max_batch_size = max(predict_max_batch, bulk_batch_size)
+    if backend == "tflite":
+        from tflite_model import default_tflite_path
+        path = os.environ.get("TFLITE_MODEL_PATH") or default_tflite_path(path)
+        # Every bucket keeps an allocated interpreter, and on CPU larger
+        # batches barely raise throughput; bulk batches run in chunks
+        max_batch_size = predict_max_batch
+    elif backend != "keras":
+        raise ValueError(f"MODEL_BACKEND must be keras or tflite, not {backend!r}")
+    threads = os.environ.get("TFLITE_THREADS")
+    return ModelService(
+        path,
+        backend=backend,
+        threads=int(threads) if threads else None,
+        max_batch_size=max_batch_size,
+        engine_batch_size=predict_max_batch,
+        batch_window_ms=float(os.environ.get("PREDICT_BATCH_WINDOW_MS", 5)),
+        warmup_runs=int(os.environ.get("INFERENCE_WARMUP_RUNS", 2)),
+    )
@@ -16,8 +16,9 @@ class User(UserMixin, db.Model):
 
 class PatientRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    timestamp = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.String(26), unique=True, nullable=False)  # ids.new_record_id()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)  # Null for anonymous screenings
+    timestamp = db.Column(db.String(50), nullable=False, index=True)
     image_path = db.Column(db.String(200), nullable=False)
     
     # Store symptoms as individual columns for better querying query
@@ -34,12 +35,30 @@ class PatientRecord(db.Model):
     mouth_pain = db.Column(db.String(50))
     extra_details = db.Column(db.Text)
     
-    status = db.Column(db.String(50), default="Pending")
-    doctor_replies = db.Column(db.Text) # JSON string or simple text for now
-    patient_replies = db.Column(db.Text) # JSON string or complicated text
-    prediction = db.Column(db.String(100))
+    status = db.Column(db.String(50), default="Pending", index=True)
+    follow_up = db.Column(db.Boolean, default=False, index=True)
+    doctor = db.Column(db.String(150))
+    voice_reply_path = db.Column(db.String(200))
+    doctor_replies = db.Column(db.Text) # Legacy JSON, moved into ChatMessage at startup
+    patient_replies = db.Column(db.Text) # Legacy JSON, moved into ChatMessage at startup
+    message_seq = db.Column(db.Integer, default=0) # Last ChatMessage.seq for this record
+    doctor_read_seq = db.Column(db.Integer, default=0)
+    patient_read_seq = db.Column(db.Integer, default=0)
+    prediction = db.Column(db.String(100), index=True)
     confidence = db.Column(db.String(50))
     pdf_path = db.Column(db.String(200))
     audio_path = db.Column(db.String(200))
+    extra = db.Column(db.Text) # JSON object for record fields without a column
     
     user = db.relationship('User', backref=db.backref('records', lazy=True))
+
+class ChatMessage(db.Model):
+    # Append-only chat log; seq orders the messages of one record
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(db.String(26), db.ForeignKey('patient_record.record_id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    sender = db.Column(db.String(20), nullable=False)  # 'doctor' or 'patient'
+    message = db.Column(db.Text)
+    time = db.Column(db.String(50))
+
+    __table_args__ = (db.UniqueConstraint('record_id', 'seq'),)
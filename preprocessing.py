@@ -0,0 +1,62 @@
+"""Single-decode image pipeline for screening uploads.
+
+An upload is decoded exactly once, straight from the request stream. For
+JPEGs, ``Image.draft`` asks libjpeg for a reduced-size DCT decode, so a 12 MP
+phone photo is never fully materialised. The decoded image is then both
+resized into the model tensor and handed to a background pool that writes
+the archival JPEG, keeping the disk write off the request path.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+from uploads import open_image
+
+MODEL_INPUT_SIZE = (224, 224)
+# Large uploads are decoded at a reduced scale that still keeps at least
+# this many pixels on the long side
+ARCHIVE_MIN_SIDE = int(os.environ.get("UPLOAD_ARCHIVE_MIN_SIDE", 1024))
+
+_archive_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="archive")
+
+
+def decode_upload(stream, min_side=ARCHIVE_MIN_SIDE):
+    """Decode an uploaded image once and return it as RGB.
+
+    JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 DCT scale whose long
+    side is still at least ``min_side``; other formats decode at full size.
+    The type and dimensions are checked from the header first, so unsupported
+    files and decompression bombs fail before anything is decoded.
+    """
+    img = open_image(stream)
+    width, height = img.size
+    scale = min(1.0, min_side / float(max(width, height)))
+    img.draft('RGB', (int(width * scale), int(height * scale)))
+    return img.convert('RGB')
+
+
+def to_model_input(img, size=MODEL_INPUT_SIZE):
+    """Resize to the model input and scale to a float32 array in [0, 1].
+
+    Nearest-neighbour resampling matches ``keras.preprocessing.image.load_img``,
+    which the model was used with.
+    """
+    resized = img.resize(size, Image.NEAREST)
+    return np.asarray(resized, dtype=np.float32) * (1.0 / 255.0)
+
+
+def _archive(img, path):
+    # Readers never see a half-written file under the final name
+    partial = f"{path}.{threading.get_ident()}.tmp"
+    with span("archive.write"):
+        img.save(partial, 'JPEG')
+        os.replace(partial, path)
+
+
+def archive_async(img, path):
+    """Write the archival JPEG in the background; returns a Future."""
+    return _archive_pool.submit(_archive, img, path)
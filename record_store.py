@@ -0,0 +1,313 @@
+"""Indexed, thread-safe in-memory store for patient records.
+
+Records stay plain dicts (the templates read them directly), but every
+mutation goes through the store so the secondary indexes stay current:
+
+- primary:   record ID -> record
+- timestamp: legacy timestamp key -> record IDs, for records and links
+             created before IDs existed
+- username:  username -> records of that patient, in insertion order
+- status:    status ("Pending", "Replied", ...) -> record IDs, sorted
+- follow-up: IDs of the records flagged for follow-up, sorted
+
+Record IDs sort by creation time, so a sorted list of IDs gives the
+dashboard cursor pagination without sorting the whole store per request.
+A filtered page walks the smallest sorted list that covers its filters, and
+stops after ``PAGE_SCAN_LIMIT`` records so that rare matches (a risk or date
+filter over the whole store) never hold the lock for long.
+
+Chat lives in one append-only log per record (``record["messages"]``). Each
+message carries a sequence number, so order comes from the log itself and
+"messages since N" is a slice. ``record["read_seq"]`` holds the last
+sequence number each side has read. Unread counts use a per-sender list of
+sequence numbers and a bisect, so they stay cheap for long conversations.
+"""
+import bisect
+import threading
+from collections import defaultdict
+
+
+CHAT_ROLES = ("doctor", "patient")
+# Records examined per page call before it returns what it has, with a cursor
+PAGE_SCAN_LIMIT = 5000
+
+
+def other_role(role):
+    return "patient" if role == "doctor" else "doctor"
+
+
+def messages_from_replies(record):
+    """Build the message log from the old ``doctor_replies`` / ``patient_replies`` lists."""
+    merged = [("doctor", reply) for reply in record.pop("doctor_replies", None) or []]
+    merged += [("patient", reply) for reply in record.pop("patient_replies", None) or []]
+    # The old lists only have second-precise times; this sort runs once, at load
+    merged.sort(key=lambda item: item[1].get("time") or "")
+    return [{"seq": seq, "sender": sender, "message": reply.get("message"), "time": reply.get("time")}
+            for seq, (sender, reply) in enumerate(merged, 1)]
+
+
+def is_high_risk(record):
+    prediction = record.get("prediction") or ""
+    return "Risk" in prediction and "Low" not in prediction
+
+
+def record_matches(record, status=None, follow_up=None, risk=None, date_from=None, date_to=None, username=None):
+    """Dashboard filters. Dates are ``YYYYMMDD`` strings compared against the record timestamp."""
+    if status is not None and record.get("status") != status:
+        return False
+    if follow_up is not None and bool(record.get("follow_up")) != follow_up:
+        return False
+    if risk is not None and is_high_risk(record) != (risk == "high"):
+        return False
+    if username is not None and record.get("username") != username:
+        return False
+    day = (record.get("timestamp") or "")[:8]
+    if date_from and day < date_from:
+        return False
+    if date_to and day > date_to:
+        return False
+    return True
+
+
+def _remove_sorted(ids, key):
+    position = bisect.bisect_left(ids, key)
+    if position < len(ids) and ids[position] == key:
+        del ids[position]
+
+
+class RecordStore:
+    key_field = "id"
+    persistent = False  # records are gone after a restart
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = {}
+        self._order = []
+        self._by_timestamp = defaultdict(dict)
+        self._by_username = defaultdict(dict)
+        self._by_status = defaultdict(list)
+        self._follow_up = []
+        self._message_seqs = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __repr__(self):
+        return f"<RecordStore {len(self)} records>"
+
+    def _index(self, key, record):
+        self._by_timestamp[record.get("timestamp")][key] = record
+        self._by_username[record.get("username")][key] = record
+        bisect.insort(self._by_status[record.get("status")], key)
+        if record.get("follow_up"):
+            bisect.insort(self._follow_up, key)
+
+    def _unindex(self, key, record):
+        for index, value in ((self._by_timestamp, record.get("timestamp")),
+                             (self._by_username, record.get("username"))):
+            bucket = index.get(value)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del index[value]
+        status = record.get("status")
+        ids = self._by_status.get(status)
+        if ids is not None:
+            _remove_sorted(ids, key)
+            if not ids:
+                del self._by_status[status]
+        if record.get("follow_up"):
+            _remove_sorted(self._follow_up, key)
+
+    def _index_messages(self, key, record):
+        if "messages" not in record:
+            record["messages"] = messages_from_replies(record)
+        record.setdefault("read_seq", dict.fromkeys(CHAT_ROLES, 0))
+        seqs = {role: [] for role in CHAT_ROLES}
+        for message in record["messages"]:
+            seqs.setdefault(message["sender"], []).append(message["seq"])
+        self._message_seqs[key] = seqs
+
+    def add(self, record):
+        # Records from before IDs existed are keyed by their timestamp
+        key = record.setdefault(self.key_field, record["timestamp"])
+        with self._lock:
+            previous = self._records.get(key)
+            if previous is not None:
+                self._unindex(key, previous)
+            elif not self._order or key > self._order[-1]:
+                self._order.append(key)
+            else:
+                bisect.insort(self._order, key)
+            self._records[key] = record
+            self._index(key, record)
+            self._index_messages(key, record)
+        return record
+
+    def add_many(self, records):
+        with self._lock:
+            for record in records:
+                self.add(record)
+        return records
+
+    def resolve(self, key):
+        """Map a record ID, or a legacy timestamp key, to the record ID."""
+        if key in self._records:
+            return key
+        with self._lock:
+            matches = self._by_timestamp.get(key)
+            return next(iter(matches)) if matches else None
+
+    def get(self, key):
+        record = self._records.get(key)
+        if record is None:
+            key = self.resolve(key)
+            record = self._records.get(key) if key else None
+        return record
+
+    def update(self, key, **fields):
+        """Set ``fields`` on the record and reindex it; returns the record or None."""
+        with self._lock:
+            key = self.resolve(key)
+            record = self._records.get(key) if key else None
+            if record is None:
+                return None
+            self._unindex(key, record)
+            record.update(fields)
+            self._index(key, record)
+            return record
+
+    def append_to(self, key, field, item):
+        """Append ``item`` to the list stored under ``field``; returns the record or None."""
+        with self._lock:
+            key = self.resolve(key)
+            record = self._records.get(key) if key else None
+            if record is None:
+                return None
+            record.setdefault(field, []).append(item)
+            return record
+
+    # Chat log
+
+    def append_message(self, key, sender, message, time):
+        """Append a chat message; returns it with its sequence number, or None."""
+        with self._lock:
+            key = self.resolve(key)
+            record = self._records.get(key) if key else None
+            if record is None:
+                return None
+            log = record["messages"]
+            entry = {"seq": len(log) + 1, "sender": sender, "message": message, "time": time}
+            log.append(entry)
+            self._message_seqs[key].setdefault(sender, []).append(entry["seq"])
+            return entry
+
+    def messages_since(self, key, seq=0, limit=None):
+        """Messages with a sequence number above ``seq``, oldest first."""
+        record = self.get(key)
+        if record is None:
+            return []
+        with self._lock:
+            # Sequence numbers are 1..n, so seq N sits at index N - 1
+            end = None if limit is None else seq + limit
+            return record["messages"][seq:end]
+
+    def mark_read(self, key, role, seq=None):
+        """Record that ``role`` has read up to ``seq`` (default: everything); returns the read seq."""
+        with self._lock:
+            record = self.get(key)
+            if record is None:
+                return None
+            last = len(record["messages"])
+            seq = last if seq is None else min(seq, last)
+            read_seq = record["read_seq"]
+            read_seq[role] = max(read_seq.get(role, 0), seq)
+            return read_seq[role]
+
+    def unread_counts(self, keys, role):
+        """Map each record ID in ``keys`` to the number of messages ``role`` has not read."""
+        counts = {}
+        with self._lock:
+            for key in keys:
+                record = self._records.get(key)
+                if record is None:
+                    continue
+                seqs = self._message_seqs[key].get(other_role(role), [])
+                counts[key] = len(seqs) - bisect.bisect_right(seqs, record["read_seq"].get(role, 0))
+        return counts
+
+    def unread_count(self, key, role):
+        key = self.resolve(key)
+        return self.unread_counts([key], role).get(key, 0) if key else 0
+
+    def delete(self, key):
+        with self._lock:
+            key = self.resolve(key)
+            record = self._records.pop(key, None) if key else None
+            if record is not None:
+                self._unindex(key, record)
+                self._message_seqs.pop(key, None)
+                del self._order[bisect.bisect_left(self._order, key)]
+            return record
+
+    def all(self):
+        with self._lock:
+            return list(self._records.values())
+
+    def for_username(self, username):
+        with self._lock:
+            return list(self._by_username.get(username, {}).values())
+
+    def with_status(self, status):
+        with self._lock:
+            return [self._records[key] for key in self._by_status.get(status, ())]
+
+    def follow_ups(self):
+        with self._lock:
+            return [self._records[key] for key in self._follow_up]
+
+    def _candidates(self, status=None, follow_up=None, username=None, **filters):
+        # The smallest ID-sorted list that holds every record the filters can match
+        lists = [self._order]
+        if status is not None:
+            lists.append(self._by_status.get(status, []))
+        if follow_up:
+            lists.append(self._follow_up)
+        if username is not None:
+            # A patient has a handful of records; sorting them per call is cheap
+            lists.append(sorted(self._by_username.get(username, ())))
+        return min(lists, key=len)
+
+    def page(self, cursor=None, limit=25, newest_first=True, **filters):
+        """Return ``(records, next_cursor)`` for one page of records matching ``filters``.
+
+        ``cursor`` is the ID of the last record examined by the previous call;
+        the scan starts right after it and stops as soon as the page is full.
+        After ``PAGE_SCAN_LIMIT`` records it stops anyway and returns a short
+        (possibly empty) page with the cursor of the last record it examined.
+        """
+        with self._lock:
+            order = self._candidates(**filters)
+            if newest_first:
+                start = bisect.bisect_left(order, cursor) - 1 if cursor else len(order) - 1
+                positions = range(start, max(start - PAGE_SCAN_LIMIT, -1), -1)
+            else:
+                start = bisect.bisect_right(order, cursor) if cursor else 0
+                positions = range(start, min(start + PAGE_SCAN_LIMIT, len(order)))
+            records = []
+            for position in positions:
+                record = self._records[order[position]]
+                if record_matches(record, **filters):
+                    records.append(record)
+                    if len(records) > limit:
+                        break
+            else:
+                more = positions.stop != (-1 if newest_first else len(order))
+                if more:
+                    return records, order[positions[-1]]
+        if len(records) > limit:
+            return records[:limit], records[limit - 1]["id"]
+        return records, None
@@ -0,0 +1,586 @@
+"""PDF report rendering with a worker pool and a content-addressed cache.
+
+Reports are rendered off the request thread. Each report is keyed on a hash
+of the fields its layout prints (``REPORT_FIELDS``) and ``TEMPLATE_VERSION``,
+so a repeat download is served straight from ``static/reports`` while chat,
+status or follow-up changes leave the report alone. Records with the same
+printed fields share one file, so the service never deletes files itself:
+the artifact store removes a PDF once no record points at it, and the sweep
+removes unowned ones once they are old. ``invalidate()`` only forgets a
+deleted record's jobs. The service remembers the last
+``max_jobs`` finished jobs; older ones are still found on disk by ID.
+
+Rendering is pure Python and holds the GIL. ``processes=True``
+(``REPORT_EXECUTOR=process``) renders in a pool of worker processes instead,
+so reports do not compete with request threads for the interpreter.
+
+Bump ``TEMPLATE_VERSION`` whenever the report layout changes.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fpdf import FPDF
+from PIL import Image
+
+from artifacts import locate, shard_path
+from logs import get_logger
+from metrics import STAGE_SECONDS, span
+
+log = get_logger("reports")
+TEMPLATE_VERSION = "2"
+REPORT_CACHE_DIR = os.path.join("static", "reports")
+
+
+class MyPDF(FPDF):
+    def footer(self):
+        self.set_y(-9.0)  # Adjust this value to position just below the border
+        self.set_font("Arial", 'I', 9)
+        self.set_text_color(0,0,0)  # Nice blue color
+        self.cell(
+            0, 10,
+            "Developed under JITD",
+            align='C'
+        )
+
+
+def generate_clinical_details():
+    locations = [
+        "Left lateral border of the tongue",
+        "Floor of the mouth",
+        "Buccal mucosa (inner cheek)",
+        "Soft palate",
+        "Lower lip"
+    ]
+    colorations = [
+        "White patch (leukoplakia)",
+        "Red patch (erythroplakia)",
+        "White & red mixed patch (erythroleukoplakia)",
+        "Ulcerated red area"
+    ]
+    surfaces = [
+        "Irregular, mildly ulcerated",
+        "Smooth, elevated",
+        "Rough and nodular",
+        "Ulcerated with indurated margins"
+    ]
+    sizes = [
+        "0.5 x 0.5 cm",
+        "1.0 x 0.8 cm",
+        "1.2 x 1.0 cm",
+        "1.5 x 1.0 cm",
+        "1.8 x 1.2 cm",
+        "2.0 x 1.5 cm",
+        "2.2 x 1.7 cm",
+        "2.5 x 2.0 cm",
+        "3.0 x 2.5 cm",
+        "3.5 x 3.0 cm"
+    ]
+    stage = "T1"  
+
+    return {
+        "location": random.choice(locations),
+        "coloration": random.choice(colorations),
+        "surface": random.choice(surfaces),
+        "size": random.choice(sizes),
+        "stage": stage
+    }
+
+
+def pdf_image_path(path, work_dir):
+    """Return a file FPDF can embed for ``path``.
+
+    JPEGs are embedded as they are. Other formats are converted once into
+    ``work_dir`` under a name derived from the source path, instead of
+    leaving ``*_converted.jpg`` files next to the upload.
+    """
+    if not path:
+        return None
+    abs_path = os.path.abspath(path)
+    if not os.path.exists(abs_path):
+        return None
+    if abs_path.lower().endswith(('.jpg', '.jpeg')):
+        return abs_path
+    stat = os.stat(abs_path)
+    digest = hashlib.sha1(f"{abs_path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+    converted_path = shard_path(work_dir, f"img_{digest}.jpg", create=True)
+    if not os.path.exists(converted_path):
+        try:
+            Image.open(abs_path).convert('RGB').save(converted_path, 'JPEG')
+        except Exception as e:
+            log.warning("report.image_unreadable", path=path, error=str(e))
+            return None
+    return converted_path
+
+
+def render_clinical_report(data, output_path, work_dir=None):
+    """Full report with prediction, clinical observation and summary (``/download_pdf``)."""
+    work_dir = work_dir or os.path.dirname(output_path)
+    prediction = data.get("prediction")
+    confidence = data.get("confidence")
+    image_path = data.get("image_path")
+    pain_level = data.get("pain_level")
+    bleeding = data.get("bleeding")
+    swelling = data.get("swelling")
+    duration = data.get("duration")
+    history = data.get("history")
+    symptoms = data.get("symptoms") or {}
+
+    # Create PDF
+    pdf = MyPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_left_margin(15)
+    pdf.set_right_margin(15)
+    pdf.add_page()
+    pdf.set_line_width(0.5)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.rect(7, 7, 196, 283)
+    pdf.set_line_width(0.2)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_font("Arial", size=12)
+
+    # Report Title
+    pdf.set_font("Times", 'B', size=16)
+    pdf.cell(200, 10, txt="Oral Cancer Detection Report", ln=True, align='C')
+    pdf.ln(10)
+    pdf.set_line_width(0.5)
+    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(10)
+
+
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Prediction Results", ln=True)
+    pdf.set_font("Arial", '', 12)
+    pdf.set_fill_color(220, 220, 220)
+    pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
+    pdf.cell(120, 10, "Value", border=1, align='C', fill=True)
+    pdf.ln()
+    pdf.cell(60, 10, "Prediction", border=1)
+    pdf.cell(120, 10, str(prediction), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Confidence", border=1)
+    pdf.cell(120, 10, f"{confidence}%", border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Pain Level", border=1)
+    pdf.cell(120, 10, str(pain_level), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Bleeding", border=1)
+    pdf.cell(120, 10, str(bleeding), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Swelling", border=1)
+    pdf.cell(120, 10, str(swelling), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Duration", border=1)
+    pdf.cell(120, 10, str(duration), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "History", border=1)
+    pdf.cell(120, 10, str(history), border=1)
+    pdf.ln()
+
+    # Add habits and years
+    habits = symptoms.get('habits', []) if symptoms else []
+    pdf.cell(60, 10, "Habits", border=1)
+    pdf.cell(120, 10, ', '.join(habits) if habits else "None", border=1)
+    pdf.ln()
+    if 'Tobacco' in habits:
+        pdf.cell(60, 10, "Tobacco Years", border=1)
+        pdf.cell(120, 10, str(symptoms.get('tobacco_years', '')), border=1)
+        pdf.ln()
+    if 'Smoking' in habits:
+        pdf.cell(60, 10, "Smoking Years", border=1)
+        pdf.cell(120, 10, str(symptoms.get('smoking_years', '')), border=1)
+        pdf.ln()
+
+    # Add trismus test, mouth pain, and extra details
+    pdf.cell(60, 10, "3 Finger Trismus Test", border=1)
+    pdf.cell(120, 10, str(symptoms.get('trismus_test', 'Not answered')), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Pain Opening Mouth", border=1)
+    pdf.cell(120, 10, str(symptoms.get('mouth_pain', 'Not answered')), border=1)
+    pdf.ln()
+    pdf.cell(60, 10, "Extra Details", border=1)
+    pdf.cell(120, 10, str(symptoms.get('extra_details', 'None')), border=1)
+    pdf.ln(15)
+
+    # --- Clinical Observation Table ---
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Clinical Observation", ln=True)
+    pdf.set_font("Arial", '', 12)
+    pdf.set_fill_color(220, 220, 220)
+    pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
+    pdf.cell(120, 10, "Observation", border=1, align='C', fill=True)
+    pdf.ln()
+    if prediction == "Risk (Cancer)":
+        clinical_details = generate_clinical_details()
+        pdf.cell(60, 10, "Location", border=1)
+        pdf.cell(120, 10, clinical_details['location'], border=1)
+        pdf.ln()
+        pdf.cell(60, 10, "Coloration", border=1)
+        pdf.cell(120, 10, clinical_details['coloration'], border=1)
+        pdf.ln()
+        pdf.cell(60, 10, "Surface", border=1)
+        pdf.cell(120, 10, clinical_details['surface'], border=1)
+        pdf.ln()
+        pdf.cell(60, 10, "Approximate Size", border=1)
+        pdf.cell(120, 10, clinical_details['size'], border=1)
+        pdf.ln()
+        pdf.cell(60, 10, "Suggested Stage", border=1)
+        pdf.cell(120, 10, clinical_details['stage'], border=1)
+        pdf.ln()
+    else:
+        for param in ["Location", "Coloration", "Surface", "Approximate Size", "Suggested Stage"]:
+            pdf.cell(60, 10, param, border=1)
+            pdf.cell(120, 10, "-", border=1)
+            pdf.ln()
+    pdf.ln(15)
+
+
+
+    # Compose a summary based on prediction and clinical details
+    if prediction == "Risk (Cancer)":
+        summary_text = (
+            "Based on the uploaded image and provided symptoms, the system predicts a HIGH RISK of oral cancer. "
+            "Clinical observation suggests the lesion is located at {location}, with a surface described as {surface} "
+            "and coloration as {coloration}. The approximate size is {size}, and the suggested stage is {stage}. "
+            "It is strongly recommended to consult a specialist for further evaluation and management."
+        ).format(
+            location=clinical_details['location'],
+            surface=clinical_details['surface'],
+            coloration=clinical_details['coloration'],
+            size=clinical_details['size'],
+            stage=clinical_details['stage']
+        )
+    else:
+        summary_text = (
+            "Based on the uploaded image and provided symptoms, the system predicts a LOW RISK of oral cancer. "
+            "No alarming features were detected in the clinical observation. "
+            "Continue regular monitoring and consult a healthcare provider if symptoms persist or worsen."
+        )
+
+    # --- Summary Section on a New Page with Border ---
+
+    pdf.add_page()
+    pdf.set_line_width(0.5)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.rect(7, 7, 196, 283)  # Draw border like first page
+
+    pdf.set_font("Arial", 'B', 12)
+    pdf.ln(12)  # Some space from top border
+    pdf.cell(0, 10, "Summary", ln=True)
+
+    pdf.set_font("Arial", '', 12)
+    pdf.ln(5)
+
+    # Set position inside the border for the summary text
+    x = pdf.get_x()
+    y = pdf.get_y()
+    pdf.set_xy(15, y)  # 15mm from left, current y
+
+    # Write the summary text (already defined as summary_text)
+    pdf.multi_cell(180, 10, summary_text)  # 180mm width fits inside the border
+
+    # Second page
+    # pdf.add_page()
+    # pdf.set_line_width(0.5)  # Thinner border
+    # pdf.set_draw_color(0, 0, 0)
+    # pdf.rect(7, 7, 196, 283)
+    # pdf.set_line_width(0.2)
+    # pdf.set_draw_color(0, 0, 0)
+    # pdf.set_font("Arial", '', 12)
+    pdf.ln(8)  # Space after summary
+    pdf.set_font("Arial", 'B', 12)
+    pdf.set_x(15)
+    pdf.cell(0, 10, "Patient Uploads", ln=True)
+    pdf.ln(2)
+    # --- Patient Uploaded Image Table ---
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Patient Uploaded Image", ln=True)
+    pdf.set_font("Arial", '', 12)
+    pdf.set_fill_color(220, 220, 220)
+    pdf.cell(60, 10, "Parameter", border=1, align='C', fill=True)
+    pdf.cell(120, 10, "Image", border=1, align='C', fill=True)
+    pdf.ln()
+
+    # Uploaded image row
+    pdf.cell(60, 40, "Uploaded image", border=1, align='C', fill=False)
+    abs_path = pdf_image_path(image_path, work_dir)
+    if abs_path and os.path.exists(abs_path):
+        x_img = pdf.get_x()
+        y_img = pdf.get_y()
+        pdf.cell(120, 40, "", border=1, fill=False)
+        pdf.image(abs_path, x=x_img + 2, y=y_img + 2, w=36, h=36)
+        pdf.ln(40)
+    else:
+        pdf.cell(120, 40, "Image not found", border=1, align='C', fill=False)
+        pdf.ln(40)
+
+    # Detected lesion pattern row (if you have a processed image, use its path)
+    predicted_img_path = pdf_image_path(data.get("predicted_img_path"), work_dir)
+    pdf.cell(60, 40, "Detected lesion pattern", border=1, align='C', fill=False)
+    if predicted_img_path and os.path.exists(predicted_img_path):
+        x_img = pdf.get_x()
+        y_img = pdf.get_y()
+        pdf.cell(120, 40, "", border=1, fill=False)
+        pdf.image(predicted_img_path, x=x_img + 2, y=y_img + 2, w=36, h=36)
+        pdf.ln(40)
+    else:
+        pdf.set_font("Arial", 'I', 12)  # Set italic
+        pdf.cell(120, 40, "Heatmap not available for this screening", border=1, align='C', fill=False)
+        pdf.ln(40)
+        pdf.set_font("Arial", '', 12)   # Reset to normal if needed
+
+    pdf.output(output_path)
+
+
+def render_patient_report(data, output_path, work_dir=None):
+    """Patient-facing report with prediction, symptoms and upload (``/patient_download_pdf``)."""
+    work_dir = work_dir or os.path.dirname(output_path)
+    prediction = data.get("prediction")
+    confidence = data.get("confidence")
+    image_path = data.get("image_path")
+    timestamp = data.get("timestamp")
+    symptoms = data.get("symptoms")
+
+    pdf = MyPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)  # 15mm bottom margin
+    pdf.set_left_margin(15)
+    pdf.set_right_margin(15)
+
+    # First page
+    pdf.add_page()
+    pdf.set_line_width(0.5)  # Thinner border
+    pdf.set_draw_color(0, 0, 0)
+    pdf.rect(7, 7, 196, 283)
+    pdf.set_line_width(0.2)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_font("Times", size=12)
+
+    pdf.set_fill_color(135, 206, 235)  # Sky blue (RGB)
+    pdf.set_text_color(0, 0, 0)  # Black text
+    pdf.set_font("Times", 'B', 14)  # Bold Times New Roman
+    pdf.cell(200, 10, txt="Oral Cancer patient report", ln=True, align='C', fill=True)
+    pdf.set_font("Times", '', 12)  # Reset font to normal after header
+    pdf.ln(10)
+
+
+
+    pdf.cell(200, 10, txt=f"Prediction: {prediction}", ln=True)
+    pdf.cell(200, 10, txt=f"Confidence: {confidence}%", ln=True)
+    pdf.cell(200, 10, txt=f"Timestamp: {timestamp}", ln=True)
+    current_y = pdf.get_y() + 5  # small space below last symptom
+    pdf.set_draw_color(0, 0, 0)  # black line
+    pdf.line(10, current_y, 200, current_y)
+    pdf.ln(10)  # move cursor down for spacing after the line
+
+    if symptoms:
+        pdf.set_font("Times", "B", 12)
+        pdf.cell(200, 10, txt="Symptoms", ln=True)
+        pdf.set_font("Times", "", 12)
+        pdf.cell(200, 10, txt=f"Pain Level: {symptoms.get('pain_level', '')}", ln=True)
+        pdf.cell(200, 10, txt=f"Bleeding: {symptoms.get('bleeding', '')}", ln=True)
+        pdf.cell(200, 10, txt=f"Swelling: {symptoms.get('swelling', '')}", ln=True)
+        pdf.cell(200, 10, txt=f"Duration: {symptoms.get('duration', '')}", ln=True)
+        pdf.cell(200, 10, txt=f"Past History: {symptoms.get('history', '')}", ln=True)
+
+        # Add habits and years
+        habits = symptoms.get('habits', [])
+        if habits:
+            pdf.cell(200, 10, txt=f"Habits: {', '.join(habits)}", ln=True)
+            if 'Tobacco' in habits and symptoms.get('tobacco_years'):
+                pdf.cell(200, 10, txt=f"Tobacco Years: {symptoms.get('tobacco_years')}", ln=True)
+            if 'Alcohol' in habits and symptoms.get('alcohol_years'):
+                pdf.cell(200, 10, txt=f"Alcohol Years: {symptoms.get('alcohol_years')}", ln=True)
+            if 'Smoking' in habits and symptoms.get('smoking_years'):
+                pdf.cell(200, 10, txt=f"Smoking Years: {symptoms.get('smoking_years')}", ln=True)
+        else:
+            pdf.cell(200, 10, txt="Habits: None", ln=True)
+
+        # Add trismus test, mouth pain, and extra details
+        pdf.cell(200, 10, txt=f"3 Finger Trismus Test: {symptoms.get('trismus_test', 'Not answered')}", ln=True)
+        pdf.cell(200, 10, txt=f"Pain Opening Mouth: {symptoms.get('mouth_pain', 'Not answered')}", ln=True)
+        pdf.cell(200, 10, txt=f"Extra Details: {symptoms.get('extra_details', 'None')}", ln=True)
+
+        # Draw a straight horizontal line after symptoms
+        current_y = pdf.get_y() + 5  # small space below last symptom
+        pdf.set_draw_color(0, 0, 0)  # black line
+        pdf.line(10, current_y, 200, current_y)
+        pdf.ln(10)  # move cursor down for spacing after the line
+
+        pdf.set_font("Times", "B", 12)
+        pdf.cell(200, 10, txt="Patient Uploaded Images", ln=True)
+
+    x_start = 10
+    img_width = 60
+    abs_path = pdf_image_path(image_path, work_dir)
+    if abs_path:
+        pdf.image(abs_path, x=x_start, y=pdf.get_y(), w=img_width)
+    predicted_img_path = pdf_image_path(data.get("predicted_img_path"), work_dir)
+    if predicted_img_path:
+        pdf.image(predicted_img_path, x=x_start + img_width + 10, y=pdf.get_y(), w=img_width)
+    pdf.ln(70)
+    pdf.output(output_path)
+
+
+RENDERERS = {
+    "clinical": render_clinical_report,
+    "patient": render_patient_report,
+}
+# What each layout reads from its data; only these go into the cache key
+REPORT_FIELDS = {
+    "clinical": ("prediction", "confidence", "image_path", "pain_level", "bleeding", "swelling",
+                 "duration", "history", "symptoms", "predicted_img_path"),
+    "patient": ("prediction", "confidence", "image_path", "timestamp", "symptoms", "predicted_img_path"),
+}
+
+
+def render_report(kind, data, path, work_dir=None):
+    """Render one report to ``path``; runs in a worker thread or process."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        # Write then rename so a half-written file is never served
+        RENDERERS[kind](data, tmp_path, work_dir)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ReportJob:
+    def __init__(self, job_id, kind, record_id, path):
+        self.id = job_id
+        self.kind = kind
+        self.record_id = record_id
+        self.path = path
+        self.records = {record_id} if record_id else set()  # records that asked for this report
+        self.status = "queued"
+        self.error = None
+        self.future = None
+        self.submitted = time.perf_counter()
+
+    def wait(self, timeout=None):
+        if self.future is not None:
+            self.future.result(timeout)
+        return self
+
+    def to_dict(self):
+        return {"job_id": self.id, "status": self.status, "record_id": self.record_id, "error": self.error}
+
+
+class ReportService:
+    def __init__(self, cache_dir=REPORT_CACHE_DIR, max_workers=2, processes=False, max_jobs=1000):
+        self.cache_dir = cache_dir
+        self.max_jobs = max_jobs
+        os.makedirs(cache_dir, exist_ok=True)
+        # Job threads track status; with processes=True each one hands the
+        # render to a process and waits. Spawned, not forked: the app process
+        # may already run TensorFlow threads
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reports")
+        self._processes = None
+        if processes:
+            self._processes = ProcessPoolExecutor(max_workers=max_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # least recently submitted first
+        self._by_record = {}
+
+    @staticmethod
+    def cache_key(kind, data):
+        printed = {field: data.get(field) for field in REPORT_FIELDS[kind]}
+        payload = json.dumps({"kind": kind, "version": TEMPLATE_VERSION, "data": printed},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def submit(self, kind, data, record_id=None):
+        """Return the job for this report, starting a render unless it is cached or in flight."""
+        job_id = self.cache_key(kind, data)
+        path = shard_path(self.cache_dir, f"{job_id}.pdf", create=True)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # A finished report whose file has since been swept is rendered again
+            if job is not None and job.status != "failed" and (job.status != "done" or os.path.exists(job.path)):
+                self._jobs.move_to_end(job_id)
+                if record_id:
+                    job.records.add(record_id)
+                    self._by_record.setdefault(record_id, set()).add(job_id)
+                return job
+            job = ReportJob(job_id, kind, record_id, path)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            if record_id:
+                self._by_record.setdefault(record_id, set()).add(job_id)
+            self._trim()
+            cached = locate(self.cache_dir, f"{job_id}.pdf")
+            if cached is not None:
+                job.path = cached
+                job.status = "done"
+                return job
+            job.future = self._pool.submit(self._render, job, data)
+        return job
+
+    def _trim(self):
+        # Forget the least recently submitted finished jobs; their files stay cached
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            job = self._jobs[job_id]
+            if job.status not in ("done", "failed"):
+                continue
+            del self._jobs[job_id]
+            excess -= 1
+            for record_id in job.records:
+                job_ids = self._by_record.get(record_id)
+                if job_ids is not None:
+                    job_ids.discard(job_id)
+                    if not job_ids:
+                        del self._by_record[record_id]
+
+    def _render(self, job, data):
+        job.status = "running"
+        STAGE_SECONDS.observe(time.perf_counter() - job.submitted, stage="report.queue")
+        try:
+            with span(f"report.render.{job.kind}"):
+                if self._processes is not None:
+                    self._processes.submit(render_report, job.kind, data, job.path, self.cache_dir).result()
+                else:
+                    render_report(job.kind, data, job.path, self.cache_dir)
+            job.status = "done"
+        except Exception as e:
+            log.exception("report.render_failed", job_id=job.id, kind=job.kind, record_id=job.record_id)
+            job.status = "failed"
+            job.error = str(e)
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.status == "done" and not os.path.exists(job.path):
+            job = None  # swept since it was rendered
+        if job is None:
+            # Cached by an earlier process
+            path = locate(self.cache_dir, f"{job_id}.pdf")
+            if path is not None:
+                job = ReportJob(job_id, None, None, path)
+                job.status = "done"
+        return job
+
+    def invalidate(self, record_id):
+        """Forget the report jobs of ``record_id``; called when the record is deleted.
+
+        Jobs other records also asked for are kept. Files are left to the
+        artifact store, which knows whether another record still owns them.
+        """
+        with self._lock:
+            for job_id in self._by_record.pop(record_id, set()):
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job.records.discard(record_id)
+                if not job.records:
+                    del self._jobs[job_id]
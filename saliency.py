@@ -0,0 +1,80 @@
+"""Grad-CAM heatmaps for the "Detected lesion pattern" slot of the reports.
+
+With ``SALIENCY_HEATMAPS=1`` (Keras backend only), a single screening's
+forward pass also returns a class activation map. ``CompiledModel.explain``
+runs the model under a gradient tape and keeps the last convolutional
+layer's activations. Each channel is weighted by the mean gradient of the
+cancer-class probability, and the weighted channels are summed into a
+coarse map. The score from that pass is the screening's prediction, so
+there is no second model call.
+
+``overlay`` upsamples the map to the photo, colours it and blends it in.
+Each step is a whole-array NumPy operation. The result is written once
+per image and model version as ``<image hash>-<model version>.jpg`` in a
+shard directory of ``static/heatmaps``. The record keeps its path as
+``heatmap_path``, and the result page and both PDF reports show it.
+"""
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from artifacts import shard_path, touch
+from metrics import span
+
+HEATMAP_DIR = os.path.join("static", "heatmaps")
+MAX_SIDE = 512  # the PDF slot is 36 mm, the result page a half-width card
+ALPHA = 0.5
+
+
+def colormap(heat):
+    """Jet-style RGB colours for values in [0, 1], as float32 in [0, 1]."""
+    scaled = 4.0 * heat[..., None] - np.array([3.0, 2.0, 1.0], dtype=np.float32)
+    return np.clip(1.5 - np.abs(scaled), 0.0, 1.0)
+
+
+# 256-entry lookup table: indexing it is much cheaper than evaluating the colormap per pixel
+COLORS = colormap(np.linspace(0.0, 1.0, 256, dtype=np.float32)).astype(np.float32)
+
+
+def overlay(img, cam, max_side=MAX_SIDE, alpha=ALPHA):
+    """``img`` with the activation map ``cam`` blended in, as an RGB image."""
+    base = img.copy() if img.mode == "RGB" else img.convert("RGB")
+    base.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+    cam = np.asarray(cam, dtype=np.float32)
+    cam = cam - cam.min()
+    peak = cam.max()
+    if peak > 0:
+        cam /= peak
+    heat = np.clip(np.asarray(Image.fromarray(cam).resize(base.size, Image.BICUBIC)), 0.0, 1.0)
+    levels = (heat * 255.0 + 0.5).astype(np.uint8)
+    # Cold regions keep the photo; hot ones take the colour
+    weight = (alpha / 255.0) * levels[..., None].astype(np.float32)
+    pixels = np.asarray(base, dtype=np.float32)
+    blended = pixels + (COLORS[levels] * 255.0 - pixels) * weight
+    return Image.fromarray((blended + 0.5).astype(np.uint8))
+
+
+class HeatmapStore:
+    def __init__(self, folder=HEATMAP_DIR):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path_for(self, image_hash, model_version):
+        return shard_path(self.folder, f"{image_hash}-{model_version}.jpg", create=True)
+
+    def exists(self, path):
+        """Whether the overlay is there; one that is reused is touched, so the sweep keeps it."""
+        if not os.path.exists(path):
+            return False
+        touch(path)
+        return True
+
+    def save(self, img, cam, path):
+        """Write the overlay for ``img`` to ``path`` (atomically); returns the path."""
+        with span("predict.heatmap"):
+            partial = f"{path}.{threading.get_ident()}.tmp"
+            overlay(img, cam).save(partial, "JPEG", quality=85)
+            os.replace(partial, path)
+        return path
@@ -87,6 +87,141 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 300);
     });
 
+    // PDF reports render in the background: post the form, then poll the job
+    // status instead of holding the request open.
+    const reportForms = document.querySelectorAll('form[data-async-report]');
+    reportForms.forEach(function(form) {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            const button = form.querySelector('button[type="submit"]');
+            const label = button ? button.innerHTML : '';
+            if (button) {
+                button.disabled = true;
+                button.innerHTML = '<span class="spinner-border spinner-border-sm me-1"></span>Preparing...';
+            }
+            const restore = function() {
+                if (button) {
+                    button.disabled = false;
+                    button.innerHTML = label;
+                }
+            };
+            const poll = function(job) {
+                if (job.status === 'done') {
+                    window.location = job.download_url;
+                    restore();
+                } else if (job.status === 'failed' || job.status === 'unknown') {
+                    restore();
+                    alert('PDF generation failed' + (job.error ? ': ' + job.error : ''));
+                } else {
+                    setTimeout(function() {
+                        fetch(job.status_url, { headers: { 'Accept': 'application/json' } })
+                            .then(response => response.json())
+                            .then(status => poll(Object.assign(job, status)))
+                            .catch(restore);
+                    }, 500);
+                }
+            };
+            fetch(form.action, {
+                method: 'POST',
+                body: new FormData(form),
+                headers: { 'Accept': 'application/json' }
+            })
+                .then(response => response.json())
+                .then(poll)
+                .catch(restore);
+        });
+    });
+
+    // Live chat: new messages arrive over Server-Sent Events and the send form
+    // posts JSON, so the page never reloads. Without JS the plain form still works.
+    const chatContainer = document.getElementById('chatContainer');
+    if (chatContainer && chatContainer.dataset.streamUrl && window.EventSource) {
+        const me = chatContainer.dataset.self;
+        let lastId = parseInt(chatContainer.dataset.since || '0', 10);
+        const appendMessage = function(msg) {
+            const empty = document.getElementById('chatEmpty');
+            if (empty) empty.remove();
+            const row = document.createElement('div');
+            row.className = 'chat-message ' + (msg.sender === me ? 'sent' : 'received');
+            row.dataset.seq = msg.seq;
+            const bubble = document.createElement('div');
+            bubble.className = 'message-bubble bg-' + msg.sender;
+            const sender = document.createElement('div');
+            sender.className = 'message-sender';
+            const icon = document.createElement('i');
+            icon.className = 'fas ' + (msg.sender === 'doctor' ? 'fa-user-md' : 'fa-user') + ' me-1';
+            sender.appendChild(icon);
+            sender.appendChild(document.createTextNode(
+                msg.sender === me ? chatContainer.dataset.selfLabel : chatContainer.dataset.otherLabel));
+            const text = document.createElement('p');
+            text.className = 'mb-1';
+            text.textContent = msg.message;
+            const time = document.createElement('small');
+            time.className = 'message-time';
+            time.textContent = msg.time;
+            if (msg.sender === me) {
+                const receipt = document.createElement('i');
+                receipt.className = 'fas fa-check-double ms-1 read-receipt d-none';
+                receipt.title = 'Read';
+                time.appendChild(receipt);
+            }
+            bubble.append(sender, text, time);
+            row.appendChild(bubble);
+            chatContainer.appendChild(row);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        };
+        const source = new EventSource(chatContainer.dataset.streamUrl + '&since=' + lastId);
+        source.addEventListener('message', function(e) {
+            const id = parseInt(e.lastEventId, 10);
+            // The stream may repeat a message the page already shows
+            if (id <= lastId) return;
+            lastId = id;
+            const msg = JSON.parse(e.data);
+            appendMessage(msg);
+            if (msg.sender !== me) {
+                // The window is open, so the message has been read
+                fetch(chatContainer.dataset.readUrl, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ role: me, seq: msg.seq })
+                });
+            }
+        });
+        source.addEventListener('read', function(e) {
+            const receipt = JSON.parse(e.data);
+            if (receipt.role === me) return;
+            chatContainer.querySelectorAll('.chat-message.sent').forEach(function(row) {
+                if (parseInt(row.dataset.seq, 10) <= receipt.read_seq) {
+                    const tick = row.querySelector('.read-receipt');
+                    if (tick) tick.classList.remove('d-none');
+                }
+            });
+        });
+
+        const chatForm = document.querySelector('form[data-chat-form]');
+        if (chatForm) {
+            chatForm.addEventListener('submit', function(e) {
+                e.preventDefault();
+                const input = chatForm.querySelector('input[name="message"]');
+                const message = input.value.trim();
+                if (!message) return;
+                fetch(chatContainer.dataset.postUrl, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ message: message, sender: me })
+                }).then(function(response) {
+                    if (response.ok) {
+                        input.value = '';
+                    } else {
+                        chatForm.submit();
+                    }
+                }).catch(function() {
+                    chatForm.submit();
+                });
+            });
+        }
+    }
+
     const toasts = document.querySelectorAll('.toast');
     toasts.forEach(function(toast) {
         setTimeout(function() {
@@ -0,0 +1,506 @@
+"""Pluggable storage backends for users and patient records.
+
+``STORAGE_BACKEND=memory`` (the default) keeps users in a dict and records in
+the in-process ``RecordStore``. ``STORAGE_BACKEND=sql`` persists both to the
+``User`` / ``PatientRecord`` models in models.py through Flask-SQLAlchemy
+(``DATABASE_URL``, default ``sqlite:///oralscan.db`` in the instance folder),
+so data survives restarts and several worker processes can share it.
+
+Both backends expose the same interface, so routes do not care which one is
+active: records are returned as plain dicts shaped like the ones ``predict()``
+builds.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import and_, event, func, not_, or_
+
+from logs import get_logger
+from models import db, User, PatientRecord, ChatMessage
+from record_store import RecordStore, CHAT_ROLES, messages_from_replies, other_role
+
+log = get_logger("storage")
+
+COMMIT_ERROR_AFTER = 20  # failed chat commits in a row before they are logged as errors
+MAX_COMMIT_BACKOFF = 5.0  # seconds
+
+SYMPTOM_FIELDS = (
+    "pain_level", "bleeding", "swelling", "duration", "history", "habits",
+    "tobacco_years", "alcohol_years", "smoking_years", "trismus_test",
+    "mouth_pain", "extra_details",
+)
+COLUMN_FIELDS = (
+    "timestamp", "image_path", "status", "follow_up", "doctor", "voice_reply_path",
+    "prediction", "confidence", "pdf_path", "audio_path",
+)
+
+
+def create_stores(app, backend=None, database_url=None):
+    """Return ``(users, patient_records)`` for the configured backend."""
+    backend = backend or os.environ.get("STORAGE_BACKEND", "memory")
+    if backend == "memory":
+        journal_dir = os.environ.get("RECORD_JOURNAL_DIR")
+        if journal_dir:
+            # Same in-memory stores, journaled to disk and reloaded at boot
+            from journal import durability_from_env
+            durability = durability_from_env(journal_dir)
+            app.extensions["record_journal"] = durability
+            atexit.register(durability.close)
+            return durability.users, durability.records
+        return {}, RecordStore()
+    if backend != "sql":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+    url = database_url or os.environ.get("DATABASE_URL", "sqlite:///oralscan.db")
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    if url.startswith("sqlite"):
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            "connect_args": {"check_same_thread": False, "timeout": 30},
+            "pool_size": int(os.environ.get("DATABASE_POOL_SIZE", 10)),
+            "max_overflow": 20,
+        })
+    else:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            "pool_size": int(os.environ.get("DATABASE_POOL_SIZE", 10)),
+            "max_overflow": 20,
+            "pool_pre_ping": True,
+        })
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_pragmas)
+        db.create_all()
+    records = SQLRecordStore(app)
+    records.migrate_replies()
+    return SQLUserStore(app), records
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets dashboard reads proceed while a chat batch is being committed
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+class SQLUserStore:
+    """Dict-like view over the ``User`` table, as used by the login route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _find(self, username):
+        with self.app.app_context():
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                return None
+            return {"password": user.password, "role": user.role}
+
+    def __contains__(self, username):
+        return self._find(username) is not None
+
+    def __getitem__(self, username):
+        user = self._find(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def get(self, username, default=None):
+        user = self._find(username)
+        return default if user is None else user
+
+    def __setitem__(self, username, data):
+        with self.app.app_context():
+            db.session.add(User(
+                username=username,
+                email=f"{username}@example.com",
+                password=data.get("password"),
+                role=data.get("role", "patient"),
+            ))
+            db.session.commit()
+
+
+class SQLRecordStore:
+    """``RecordStore`` interface backed by the ``PatientRecord`` table.
+
+    Chat messages go to the ``ChatMessage`` log, but not one transaction per
+    message: they are queued and committed in batches by a background thread
+    every ``commit_interval_ms``. A queued message has no sequence number
+    yet; the commit takes it from the record row (see ``flush``) and then
+    hands the messages to ``on_commit(record_id, entries)``, which is where
+    they should be published. Reads only see committed messages, so every
+    sequence number a client sees is final.
+    """
+
+    persistent = True
+
+    def __init__(self, app, commit_interval_ms=None):
+        self.app = app
+        if commit_interval_ms is None:
+            commit_interval_ms = float(os.environ.get("CHAT_COMMIT_INTERVAL_MS", 50))
+        self.commit_interval = commit_interval_ms / 1000.0
+        self._pending = defaultdict(list)
+        self._flushing = {}
+        self._commit_failures = 0
+        self.on_commit = None
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="chat-commit", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        with self.app.app_context():
+            return db.session.query(func.count(PatientRecord.id)).scalar()
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __repr__(self):
+        return f"<SQLRecordStore {self.app.config['SQLALCHEMY_DATABASE_URI']}>"
+
+    # Conversion between rows and record dicts
+
+    def _query(self):
+        return db.session.query(PatientRecord, User.username).outerjoin(User, PatientRecord.user_id == User.id)
+
+    def _to_dict(self, row, username):
+        symptoms = {field: getattr(row, field) for field in SYMPTOM_FIELDS}
+        symptoms["habits"] = row.habits.split(",") if row.habits else []
+        record = {field: getattr(row, field) for field in COLUMN_FIELDS}
+        record.update({
+            "id": row.record_id,
+            "username": username,
+            "symptoms": symptoms,
+            "follow_up": bool(row.follow_up),
+            "read_seq": {"doctor": row.doctor_read_seq or 0, "patient": row.patient_read_seq or 0},
+        })
+        if row.extra:
+            record.update(json.loads(row.extra))
+        return record
+
+    def _user_id(self, username):
+        if username is None:
+            return None
+        user = User.query.filter_by(username=username).first()
+        return user.id if user else None
+
+    def _apply(self, row, fields):
+        extra = json.loads(row.extra) if row.extra else {}
+        for field, value in fields.items():
+            if field == "id":
+                row.record_id = value
+            elif field == "username":
+                row.user_id = self._user_id(value)
+            elif field == "symptoms":
+                for name in SYMPTOM_FIELDS:
+                    setattr(row, name, (value or {}).get(name))
+                row.habits = ",".join((value or {}).get("habits") or [])
+            elif field == "read_seq":
+                row.doctor_read_seq = (value or {}).get("doctor", 0)
+                row.patient_read_seq = (value or {}).get("patient", 0)
+            elif field in COLUMN_FIELDS:
+                if field == "confidence" and value is not None:
+                    value = str(value)
+                setattr(row, field, value)
+            else:
+                extra[field] = value
+        row.extra = json.dumps(extra) if extra else None
+
+    def _row(self, key):
+        row = self._query().filter(PatientRecord.record_id == key).first()
+        if row is None:
+            # Records and links from before IDs existed
+            row = self._query().filter(PatientRecord.timestamp == key).order_by(PatientRecord.id).first()
+        return row
+
+    # RecordStore interface
+
+    def _insert(self, record):
+        record.setdefault("id", record["timestamp"])
+        if "messages" not in record:
+            record["messages"] = messages_from_replies(record)
+        messages = record["messages"]
+        row = PatientRecord(message_seq=len(messages))
+        self._apply(row, {field: value for field, value in record.items() if field != "messages"})
+        db.session.add(row)
+        for message in messages:
+            db.session.add(ChatMessage(record_id=record["id"], **message))
+
+    def add(self, record):
+        with self.app.app_context():
+            self._insert(record)
+            db.session.commit()
+        return record
+
+    def add_many(self, records):
+        """Insert ``records`` in one transaction."""
+        with self.app.app_context():
+            for record in records:
+                self._insert(record)
+            db.session.commit()
+        return records
+
+    def resolve(self, key):
+        if not key:
+            return None
+        with self.app.app_context():
+            row = self._row(key)
+            return row[0].record_id if row else None
+
+    def get(self, key):
+        if not key:
+            return None
+        with self.app.app_context():
+            row = self._row(key)
+            return self._to_dict(*row) if row else None
+
+    def update(self, key, **fields):
+        if not key:
+            return None
+        with self.app.app_context():
+            row = self._row(key)
+            if row is None:
+                return None
+            self._apply(row[0], fields)
+            db.session.commit()
+            return self._to_dict(*row)
+
+    def append_to(self, key, field, item):
+        record = self.get(key)
+        if record is None:
+            return None
+        return self.update(record["id"], **{field: record.get(field, []) + [item]})
+
+    def delete(self, key):
+        if not key:
+            return None
+        with self.app.app_context():
+            row = self._row(key)
+            if row is None:
+                return None
+            record = self._to_dict(*row)
+            with self._pending_lock:
+                self._pending.pop(row[0].record_id, None)
+            ChatMessage.query.filter_by(record_id=row[0].record_id).delete()
+            db.session.delete(row[0])
+            db.session.commit()
+            return record
+
+    def _list(self, *criteria, **filters):
+        with self.app.app_context():
+            query = self._query().filter(*criteria).filter_by(**filters)
+            return [self._to_dict(*row) for row in query.order_by(PatientRecord.record_id)]
+
+    def all(self):
+        return self._list()
+
+    def for_username(self, username):
+        return self._list(User.username == username)
+
+    def with_status(self, status):
+        return self._list(PatientRecord.status == status)
+
+    def follow_ups(self):
+        return self._list(PatientRecord.follow_up.is_(True))
+
+    def page(self, cursor=None, limit=25, newest_first=True, status=None, follow_up=None,
+             risk=None, date_from=None, date_to=None, username=None):
+        criteria = []
+        if status is not None:
+            criteria.append(PatientRecord.status == status)
+        if follow_up is not None:
+            criteria.append(PatientRecord.follow_up.is_(True) if follow_up
+                            else or_(PatientRecord.follow_up.is_(False), PatientRecord.follow_up.is_(None)))
+        if risk is not None:
+            high = and_(PatientRecord.prediction.like("%Risk%"), not_(PatientRecord.prediction.like("%Low%")))
+            criteria.append(high if risk == "high" else not_(high))
+        if username is not None:
+            criteria.append(User.username == username)
+        # Timestamps are "%Y%m%d_%H%M%S", so whole days compare as string prefixes
+        if date_from:
+            criteria.append(PatientRecord.timestamp >= date_from)
+        if date_to:
+            criteria.append(PatientRecord.timestamp < date_to + "~")
+        if cursor:
+            criteria.append(PatientRecord.record_id < cursor if newest_first else PatientRecord.record_id > cursor)
+        order = PatientRecord.record_id.desc() if newest_first else PatientRecord.record_id
+        with self.app.app_context():
+            rows = self._query().filter(*criteria).order_by(order).limit(limit + 1).all()
+            records = [self._to_dict(*row) for row in rows]
+        if len(records) > limit:
+            return records[:limit], records[limit - 1]["id"]
+        return records, None
+
+    # Chat log
+
+    def _last_seq(self, record_id):
+        with self.app.app_context():
+            return db.session.query(PatientRecord.message_seq).filter_by(record_id=record_id).scalar() or 0
+
+    def append_message(self, key, sender, message, time):
+        """Queue a chat message for the next batch commit; returns it, with ``seq`` set at the commit."""
+        record_id = self.resolve(key)
+        if record_id is None:
+            return None
+        entry = {"seq": None, "sender": sender, "message": message, "time": time}
+        with self._pending_lock:
+            self._pending[record_id].append(entry)
+        self._wakeup.set()
+        return entry
+
+    def messages_since(self, key, seq=0, limit=None):
+        """Messages with a sequence number above ``seq``, oldest first."""
+        record_id = self.resolve(key)
+        if record_id is None:
+            return []
+        with self.app.app_context():
+            query = ChatMessage.query.filter(ChatMessage.record_id == record_id, ChatMessage.seq > seq)
+            query = query.order_by(ChatMessage.seq)
+            if limit is not None:
+                query = query.limit(limit)
+            return [{"seq": row.seq, "sender": row.sender, "message": row.message, "time": row.time}
+                    for row in query]
+
+    def mark_read(self, key, role, seq=None):
+        """Record that ``role`` has read up to ``seq`` (default: everything); returns the read seq."""
+        record_id = self.resolve(key)
+        if record_id is None or role not in CHAT_ROLES:
+            return None
+        last = self._last_seq(record_id)
+        seq = last if seq is None else min(seq, last)
+        column = getattr(PatientRecord, f"{role}_read_seq")
+        with self.app.app_context():
+            # Only ever moves forward, even with two windows open
+            PatientRecord.query.filter(PatientRecord.record_id == record_id,
+                                       or_(column.is_(None), column < seq)).update({column: seq})
+            db.session.commit()
+            return db.session.query(column).filter(PatientRecord.record_id == record_id).scalar()
+
+    def unread_counts(self, keys, role):
+        """Map each record ID in ``keys`` to the number of messages ``role`` has not read."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        read_column = getattr(PatientRecord, f"{role}_read_seq")
+        with self.app.app_context():
+            rows = db.session.query(PatientRecord.record_id).filter(PatientRecord.record_id.in_(keys)).all()
+            counts = {record_id: 0 for record_id, in rows}
+            query = (db.session.query(ChatMessage.record_id, func.count(ChatMessage.id))
+                     .join(PatientRecord, PatientRecord.record_id == ChatMessage.record_id)
+                     .filter(ChatMessage.record_id.in_(keys), ChatMessage.sender == other_role(role),
+                             ChatMessage.seq > func.coalesce(read_column, 0))
+                     .group_by(ChatMessage.record_id))
+            counts.update(query.all())
+        return counts
+
+    def unread_count(self, key, role):
+        record_id = self.resolve(key)
+        return self.unread_counts([record_id], role).get(record_id, 0) if record_id else 0
+
+    def migrate_replies(self):
+        """Move chat kept in the old ``doctor_replies`` / ``patient_replies`` JSON columns into the log."""
+        with self.app.app_context():
+            rows = PatientRecord.query.filter(or_(PatientRecord.doctor_replies.isnot(None),
+                                                  PatientRecord.patient_replies.isnot(None))).all()
+            for row in rows:
+                messages = messages_from_replies({
+                    "doctor_replies": json.loads(row.doctor_replies or "[]"),
+                    "patient_replies": json.loads(row.patient_replies or "[]"),
+                })
+                for message in messages:
+                    db.session.add(ChatMessage(record_id=row.record_id, **message))
+                row.message_seq = len(messages)
+                row.doctor_replies = row.patient_replies = None
+            db.session.commit()
+        return len(rows)
+
+    # Batched chat commits
+
+    def flush(self):
+        """Commit all queued chat messages in one transaction.
+
+        Each record's sequence numbers are taken from its ``message_seq`` row
+        in the commit's own transaction, so workers sharing the database never
+        reuse one. A batch that fails stays queued and is retried with backoff;
+        the messages were already accepted, so they are never dropped.
+        """
+        with self._pending_lock:
+            if self._flushing:
+                return 0
+            pending, self._pending = self._pending, defaultdict(list)
+            self._flushing = pending
+        if not pending:
+            return 0
+        written = 0
+        committed = {}
+        try:
+            with self.app.app_context():
+                for record_id, entries in pending.items():
+                    last = self._allocate_seqs(record_id, len(entries))
+                    if last is None:
+                        continue  # record deleted meanwhile
+                    for seq, entry in enumerate(entries, last - len(entries) + 1):
+                        entry["seq"] = seq
+                    db.session.add_all(ChatMessage(record_id=record_id, **entry) for entry in entries)
+                    committed[record_id] = entries
+                    written += len(entries)
+                db.session.commit()
+        except Exception as e:
+            # The app context's teardown has rolled the session back
+            self._commit_failures += 1
+            with self._pending_lock:
+                self._flushing = {}
+                for record_id, entries in pending.items():
+                    for entry in entries:
+                        entry["seq"] = None
+                    self._pending[record_id][:0] = entries
+            fields = {"records": len(pending), "messages": sum(len(entries) for entries in pending.values()),
+                      "attempt": self._commit_failures, "error": str(e)}
+            if self._commit_failures < COMMIT_ERROR_AFTER:
+                log.warning("chat.commit_failed", **fields)
+            else:
+                log.error("chat.commit_failed", **fields)
+            self._wakeup.set()
+            return 0
+        self._commit_failures = 0
+        with self._pending_lock:
+            self._flushing = {}
+        if self.on_commit is not None:
+            for record_id, entries in committed.items():
+                try:
+                    self.on_commit(record_id, entries)
+                except Exception:
+                    log.exception("chat.on_commit_failed", record_id=record_id)
+        return written
+
+    def _allocate_seqs(self, record_id, count):
+        """Reserve ``count`` sequence numbers on the record row; returns the last, or None."""
+        # The UPDATE locks the row (the database in SQLite) until the commit,
+        # so concurrent workers take turns
+        updated = (PatientRecord.query.filter_by(record_id=record_id)
+                   .update({PatientRecord.message_seq: func.coalesce(PatientRecord.message_seq, 0) + count},
+                           synchronize_session=False))
+        if not updated:
+            return None
+        last = db.session.query(PatientRecord.message_seq).filter_by(record_id=record_id).scalar()
+        # Messages written without moving message_seq (older versions) must not be collided with
+        highest = db.session.query(func.max(ChatMessage.seq)).filter_by(record_id=record_id).scalar() or 0
+        if highest > last - count:
+            last = highest + count
+            PatientRecord.query.filter_by(record_id=record_id).update(
+                {PatientRecord.message_seq: last}, synchronize_session=False)
+        return last
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            # Let more messages arrive so they share one commit; back off while commits fail
+            time.sleep(min(MAX_COMMIT_BACKOFF, self.commit_interval * (1 + self._commit_failures)))
+            self._wakeup.clear()
+            self.flush()
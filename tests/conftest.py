@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir(tmp_path_factory):
+    # The app writes uploads, reports and its database under the working directory
+    path = tmp_path_factory.mktemp("oralscan")
+    previous = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(previous)
+
+
+@pytest.fixture(scope="session")
+def client(workdir):
+    from app import app
+    app.config["TESTING"] = True
+    return app.test_client()
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+# Run in a fresh interpreter, as a restarted app would be
+RUN = """
+import json, os, sys
+from app import artifacts, patient_records
+if sys.argv[1] == "save":
+    patient_records.add({"timestamp": "20260101_000000", "username": "p", "image_path": sys.argv[2]})
+else:
+    artifacts.sweep()
+print(json.dumps([os.path.exists(path) for path in sys.argv[2:]]))
+"""
+
+
+def run(workdir, env, *args):
+    result = subprocess.run([sys.executable, "-c", RUN, *args], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def upload(workdir, name):
+    from artifacts import shard_path
+    path = shard_path(os.path.join(workdir, "static", "uploads"), name, create=True)
+    with open(path, "wb") as output:
+        output.write(b"\xff\xd8\xff")
+    # Older than any grace period
+    os.utime(path, (1, 1))
+    # Records keep paths relative to the app's working directory
+    return os.path.relpath(path, workdir)
+
+
+@pytest.mark.parametrize("journal", [False, True])
+def test_uploads_survive_a_restart(tmp_path, journal):
+    env = dict(os.environ, PYTHONPATH=ROOT, ARTIFACT_GRACE_SECONDS="0", ARTIFACT_SWEEP_SECONDS="0",
+               STORAGE_BACKEND="memory")
+    env.pop("RECORD_JOURNAL_DIR", None)
+    if journal:
+        env["RECORD_JOURNAL_DIR"] = str(tmp_path / "journal")
+    owned = upload(tmp_path, "owned.jpg")
+    orphan = upload(tmp_path, "orphan.jpg")
+
+    assert run(tmp_path, env, "save", owned) == [True]
+    # After the restart the owned upload is kept; an orphan goes only when the records were restored
+    assert run(tmp_path, env, "sweep", owned, orphan) == [True, not journal]
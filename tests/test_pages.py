@@ -0,0 +1,8 @@
+def test_result_page_renders_without_tta(client):
+    response = client.get("/result")
+    assert response.status_code == 200
+    assert b"views of the photo" not in response.data
+
+
+def test_healthz(client):
+    assert client.get("/healthz").status_code == 200
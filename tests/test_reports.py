@@ -0,0 +1,21 @@
+import os
+
+from reports import ReportService
+
+DATA = {"prediction": "Low Risk (Non-Cancer)", "confidence": "91", "image_path": None, "timestamp": "20260101_000000"}
+
+
+def test_invalidate_keeps_a_file_another_record_shares(tmp_path):
+    service = ReportService(cache_dir=str(tmp_path))
+    first = service.submit("patient", DATA, record_id="A").wait()
+    second = service.submit("patient", DATA, record_id="B").wait()
+    assert first is second and first.status == "done"
+
+    service.invalidate("A")
+    assert os.path.exists(first.path)
+    assert service.job(first.id) is first
+
+    service.invalidate("B")
+    # Forgotten by the service, but the file stays until the artifact store releases it
+    assert os.path.exists(first.path)
+    assert service.job(first.id) is not first
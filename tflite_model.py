@@ -0,0 +1,263 @@
+"""Int8-quantized TFLite backend for the screening model.
+
+The float32 Keras graph is the largest thing in every worker's memory and
+the slowest step of a screening on CPU-only nodes, for a single sigmoid
+output. ``MODEL_BACKEND=tflite`` serves a post-training int8 quantization of
+the same model on the TFLite interpreter instead (``TFLITE_THREADS`` threads
+per call). The interpreter comes from ``ai-edge-litert`` or
+``tflite-runtime`` when installed, so a serving node does not need to import
+TensorFlow at all; otherwise ``tf.lite`` is used.
+
+The ``.tflite`` file is built once, at deploy time, and must pass the
+parity check against the Keras model before it is used:
+
+    python -m tflite_model convert --calibration static/uploads
+    python -m tflite_model parity --calibration path/to/held-out/photos
+
+``convert`` calibrates the int8 ranges on real screening photos, writes
+``oral_cancer_model.int8.tflite`` next to the Keras model and runs the
+parity check on the photos it did not calibrate on. ``parity`` compares the
+two models' scores on a set of photos and exits non-zero when they drift
+apart: the largest score difference past ``--max-diff`` or label agreement
+at the 0.5 threshold below ``--min-agreement``.
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+from inference import CompiledModel, INPUT_SHAPE, batch_buckets
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+THRESHOLD = 0.5
+
+
+def default_tflite_path(model_path):
+    return os.path.splitext(model_path)[0] + ".int8.tflite"
+
+
+def interpreter_class():
+    # Standalone runtimes first: importing them costs a fraction of TensorFlow
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel(CompiledModel):
+    """The ``CompiledModel`` interface over a ``.tflite`` file.
+
+    One interpreter per batch bucket, each resized and allocated once; an
+    interpreter runs one call at a time, so each has its own lock.
+    """
+
+    def __init__(self, path, max_batch_size=16, threads=None, stats_window=1024):
+        self.path = path
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.buckets = batch_buckets(self.max_batch_size)
+        self.threads = threads or os.cpu_count() or 1
+        with open(path, "rb") as model_file:
+            self._content = model_file.read()
+        self._interpreter_class = interpreter_class()
+        self._interpreters = {}
+        self._interpreters_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=stats_window))
+        self.warmup_seconds = None
+
+    def _interpreter_for(self, size):
+        with self._interpreters_lock:
+            entry = self._interpreters.get(size)
+            if entry is None:
+                interpreter = self._interpreter_class(model_content=self._content, num_threads=self.threads)
+                input_detail = interpreter.get_input_details()[0]
+                interpreter.resize_tensor_input(input_detail["index"], (size,) + INPUT_SHAPE, strict=False)
+                interpreter.allocate_tensors()
+                # Details are re-read after the resize
+                entry = (interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0],
+                         threading.Lock())
+                self._interpreters[size] = entry
+            return entry
+
+    def _invoke(self, bucket, batch):
+        interpreter, input_detail, output_detail, lock = self._interpreter_for(bucket)
+        batch = _quantize(batch, input_detail)
+        with lock:
+            interpreter.set_tensor(input_detail["index"], batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_detail["index"])
+        return _dequantize(output, output_detail)
+
+    def stats(self):
+        stats = super().stats()
+        stats["backend"] = "tflite"
+        stats["threads"] = self.threads
+        return stats
+
+
+def _quantize(batch, detail):
+    # Models converted with int8 inputs take quantized tensors; the default
+    # conversion keeps float32 inputs and quantizes inside the graph
+    if detail["dtype"] == np.float32:
+        return batch
+    scale, zero_point = detail["quantization"]
+    info = np.iinfo(detail["dtype"])
+    return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(detail["dtype"])
+
+
+def _dequantize(output, detail):
+    if detail["dtype"] == np.float32:
+        return output
+    scale, zero_point = detail["quantization"]
+    return (output.astype(np.float32) - zero_point) * scale
+
+
+def iter_calibration_images(folder):
+    """Model inputs for the photos under ``folder`` and its (sharded) subfolders, in a stable order."""
+    from preprocessing import decode_upload, to_model_input
+
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                with open(os.path.join(root, name), "rb") as stream:
+                    array = to_model_input(decode_upload(stream))
+            except Exception as e:
+                print(f"skipping {name}: {e}", file=sys.stderr)
+                continue
+            yield array
+
+
+def calibration_images(folder, limit=200):
+    """The first ``limit`` model inputs under ``folder`` (None: all of them, which may not fit in memory)."""
+    return list(itertools.islice(iter_calibration_images(folder), limit))
+
+
+def convert(keras_path, output_path, calibration):
+    """Write an int8 quantization of the Keras model, calibrated on ``calibration`` arrays."""
+    import tensorflow as tf
+    from keras.models import load_model
+
+    model = load_model(keras_path)
+    export_dir = tempfile.mkdtemp(prefix="oralscan-export-")
+    try:
+        if hasattr(model, "export"):
+            # Keras 3 models convert through a SavedModel
+            model.export(export_dir)
+            converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        else:
+            converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([array[None]] for array in calibration)
+        # Integer kernels throughout; inputs and outputs stay float32
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        content = converter.convert()
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    partial = f"{output_path}.tmp"
+    with open(partial, "wb") as output_file:
+        output_file.write(content)
+    os.replace(partial, output_path)
+    return len(content)
+
+
+def parity(keras_path, tflite_path, images, threads=None, batch_size=16):
+    """Score ``images`` (any iterable) with both models, ``batch_size`` at a time, and compare."""
+    from keras.models import load_model
+
+    reference = CompiledModel(load_model(keras_path), max_batch_size=batch_size)
+    quantized = TFLiteModel(tflite_path, max_batch_size=batch_size, threads=threads)
+    expected, actual = [], []
+    images = iter(images)
+    while True:
+        # Only one batch of inputs is held at a time; the scores are small
+        chunk = list(itertools.islice(images, batch_size))
+        if not chunk:
+            break
+        batch = np.stack(chunk)
+        expected.append(reference.predict(batch)[:, 0])
+        actual.append(quantized.predict(batch)[:, 0])
+    if not expected:
+        raise ValueError("No photos to check parity on")
+    expected, actual = np.concatenate(expected), np.concatenate(actual)
+    diff = np.abs(expected - actual)
+    agreement = np.mean((expected > THRESHOLD) == (actual > THRESHOLD))
+    return {
+        "images": len(expected),
+        "max_diff": float(diff.max()),
+        "mean_diff": float(diff.mean()),
+        "p99_diff": float(np.percentile(diff, 99)),
+        "label_agreement": float(agreement),
+        "disagreements": int(np.sum((expected > THRESHOLD) != (actual > THRESHOLD))),
+    }
+
+
+def check(report, max_diff, min_agreement):
+    print(json.dumps(report, indent=2))
+    failures = []
+    if report["max_diff"] > max_diff:
+        failures.append(f"max score difference {report['max_diff']:.4f} > {max_diff}")
+    if report["label_agreement"] < min_agreement:
+        failures.append(f"label agreement {report['label_agreement']:.4f} < {min_agreement}")
+    for failure in failures:
+        print(f"PARITY FAILED: {failure}", file=sys.stderr)
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and check the int8 TFLite screening model")
+    parser.add_argument("command", choices=("convert", "parity"))
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "oral_cancer_model.h5"))
+    parser.add_argument("--output", help="TFLite file (default: next to the Keras model, .int8.tflite)")
+    parser.add_argument("--calibration", default=os.path.join("static", "uploads"),
+                        help="folder of screening photos")
+    parser.add_argument("--calibration-size", type=int, default=200,
+                        help="photos used to calibrate; convert checks parity on the ones after them")
+    parser.add_argument("--parity-size", type=int, default=1000,
+                        help="most photos the parity check scores (0: all)")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--max-diff", type=float, default=0.05)
+    parser.add_argument("--min-agreement", type=float, default=0.98)
+    args = parser.parse_args()
+    output = args.output or default_tflite_path(args.model)
+
+    # Photos are decoded as they are scored, so large folders do not have to fit in memory
+    images = iter_calibration_images(args.calibration)
+    parity_size = args.parity_size or None
+    if args.command == "convert":
+        calibration = list(itertools.islice(images, args.calibration_size))
+        if not calibration:
+            raise SystemExit(f"No usable photos in {args.calibration}")
+        size = convert(args.model, output, calibration)
+        print(f"wrote {output} ({size / 1024 / 1024:.1f} MB), calibrated on {len(calibration)} photos")
+        held_out = list(itertools.islice(images, 1))
+        if not held_out:
+            print("no photos left over for a held-out check; checking on the calibration photos", file=sys.stderr)
+            images = calibration[:parity_size]
+        else:
+            images = itertools.chain(held_out, images)
+    images = itertools.islice(images, parity_size)
+    try:
+        report = parity(args.model, output, images, args.threads)
+    except ValueError:
+        raise SystemExit(f"No usable photos in {args.calibration}")
+    if not check(report, args.max_diff, args.min_agreement):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Test-time augmentation (TTA) for single screenings.
+
+With ``PREDICT_TTA=1``, ``/predict`` scores several views of the upload
+instead of one: the photo itself, flips, 90% crops and brighter or darker
+copies. All views go through the model as one batch in one forward pass.
+The sigmoid outputs are averaged. The mean is the score, and the spread
+across views is reported as the score variance: a photo whose views
+disagree is one the model is unsure about.
+
+Each extra view makes the forward pass longer, so the number of views
+adapts to load. ``ViewPolicy`` tracks the scoring time (augmentation plus
+forward pass, including any wait for the batch) of recent screenings:
+
+- p95 over budget (``TTA_LATENCY_BUDGET_MS``): halve the views
+- p95 under 60% of the budget: add one view, up to ``TTA_MAX_VIEWS``
+
+The added cost of TTA on each screening is estimated against a one-view
+pass and exported as ``oralscan_tta_added_seconds``, next to
+``oralscan_tta_views``.
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from preprocessing import to_model_input
+
+# Most informative first; a screening with n views uses the first n
+VIEWS = ("identity", "hflip", "crop_center", "brighter", "vflip", "darker", "crop_top_left", "crop_bottom_right")
+CROP = 0.9
+BRIGHTNESS = 0.1
+
+VIEWS_USED = metrics.REGISTRY.histogram(
+    "oralscan_tta_views", "Augmented views scored per screening", buckets=(1, 2, 3, 4, 5, 6, 7, 8))
+ADDED_SECONDS = metrics.REGISTRY.histogram(
+    "oralscan_tta_added_seconds", "Estimated scoring time TTA added to a screening over a single view")
+
+
+def _crop(img, corner):
+    width, height = img.size
+    crop_width, crop_height = int(width * CROP), int(height * CROP)
+    if corner == "center":
+        left, top = (width - crop_width) // 2, (height - crop_height) // 2
+    elif corner == "top_left":
+        left, top = 0, 0
+    else:
+        left, top = width - crop_width, height - crop_height
+    return to_model_input(img.crop((left, top, left + crop_width, top + crop_height)))
+
+
+def augment(img, views):
+    """The first ``views`` augmented model inputs of a decoded upload, as one (n, 224, 224, 3) batch."""
+    base = to_model_input(img)
+    batch = []
+    for name in VIEWS[:max(1, views)]:
+        if name == "identity":
+            batch.append(base)
+        elif name == "hflip":
+            batch.append(base[:, ::-1])
+        elif name == "vflip":
+            batch.append(base[::-1])
+        elif name == "brighter":
+            batch.append(np.minimum(base * (1.0 + BRIGHTNESS), 1.0))
+        elif name == "darker":
+            batch.append(base * (1.0 - BRIGHTNESS))
+        else:
+            batch.append(_crop(img, name[len("crop_"):]))
+    return np.stack(batch).astype(np.float32, copy=False)
+
+
+def aggregate(scores):
+    """``(mean, variance)`` of the sigmoid outputs of one screening's views."""
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    return float(scores.mean()), float(scores.var())
+
+
+class ViewPolicy:
+    """Number of views per screening, kept within a p95 latency budget."""
+
+    def __init__(self, budget_ms=400.0, max_views=len(VIEWS), min_views=1, window=40):
+        self.budget = budget_ms / 1000.0
+        self.max_views = max(1, min(max_views, len(VIEWS)))
+        self.min_views = max(1, min(min_views, self.max_views))
+        self.window = window
+        self._views = self.max_views
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=window)
+        # Moving averages of a one-view pass and of each extra view, for the added-cost estimate
+        self._base_seconds = None
+        self._per_view_seconds = None
+        self.screenings = 0
+        self.added_seconds = 0.0
+        metrics.REGISTRY.register_callback("oralscan_tta_target_views", "gauge",
+                                           "Views the next screening will use", lambda: self._views)
+
+    def views(self):
+        return self._views
+
+    def _p95(self):
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def observe(self, views, seconds):
+        """Record one screening's scoring time; returns the estimated seconds TTA added."""
+        with self._lock:
+            self._recent.append(seconds)
+            if views == 1:
+                self._base_seconds = _ewma(self._base_seconds, seconds)
+            elif self._base_seconds is not None:
+                self._per_view_seconds = _ewma(self._per_view_seconds,
+                                               max(0.0, seconds - self._base_seconds) / (views - 1))
+            if self._base_seconds is None:
+                # No one-view screening seen yet: assume cost grows linearly with views
+                added = seconds * (views - 1) / views
+            else:
+                added = max(0.0, seconds - self._base_seconds)
+            self.screenings += 1
+            self.added_seconds += added
+            if len(self._recent) >= self.window // 2:
+                p95 = self._p95()
+                if p95 > self.budget and self._views > self.min_views:
+                    self._views = max(self.min_views, self._views // 2)
+                    self._recent.clear()
+                elif p95 < 0.6 * self.budget and self._views < self.max_views:
+                    self._views += 1
+                    self._recent.clear()
+        VIEWS_USED.observe(views)
+        ADDED_SECONDS.observe(added)
+        return added
+
+    def stats(self):
+        with self._lock:
+            return {
+                "views": self._views,
+                "max_views": self.max_views,
+                "budget_ms": self.budget * 1000.0,
+                "recent_p95_ms": self._p95() * 1000.0 if self._recent else None,
+                "screenings": self.screenings,
+                "mean_added_ms": self.added_seconds / self.screenings * 1000.0 if self.screenings else None,
+                "per_extra_view_ms": self._per_view_seconds * 1000.0 if self._per_view_seconds is not None else None,
+            }
+
+
+def _ewma(current, sample, alpha=0.1):
+    return sample if current is None else (1 - alpha) * current + alpha * sample
+
+
+def score_views(img, policy, predict_batch):
+    """Score an upload with TTA; returns ``(mean, variance, views, added_seconds)``."""
+    views = policy.views()
+    started = time.perf_counter()
+    with metrics.span("predict.tta_augment"):
+        batch = augment(img, views)
+    with metrics.span("predict.inference"):
+        scores = predict_batch(batch)
+    mean, variance = aggregate(scores)
+    added = policy.observe(views, time.perf_counter() - started)
+    return mean, variance, views, added
@@ -0,0 +1,149 @@
+"""Streaming, size-bounded ingest for image and audio uploads.
+
+Uploads are checked from their first bytes before anything is decoded or
+stored:
+
+- the magic bytes must match a supported image or audio format, whatever
+  the file name says
+- image dimensions are read from the header only, and anything over
+  ``UPLOAD_MAX_PIXELS`` is rejected before a single pixel is decoded. This
+  stops decompression bombs: a small file that declares an enormous image
+- files are copied to disk in fixed-size chunks through a temporary
+  ``.part`` file. A file over its byte limit is aborted mid-copy and the
+  partial file is removed
+
+``UploadRequest`` makes Werkzeug spool multipart file parts to disk once
+they pass ``UPLOAD_SPOOL_KB``. Memory per upload stays at roughly one spool
+buffer plus one chunk, however large the file or the burst of uploads.
+"""
+import os
+import tempfile
+
+from flask import Request
+from PIL import Image
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_KB", 64)) * 1024
+IMAGE_MAX_BYTES = int(os.environ.get("UPLOAD_IMAGE_MAX_MB", 20)) * 1024 * 1024
+AUDIO_MAX_BYTES = int(os.environ.get("UPLOAD_AUDIO_MAX_MB", 20)) * 1024 * 1024
+MAX_PIXELS = int(os.environ.get("UPLOAD_MAX_PIXELS", 50_000_000))
+
+# Pillow's own bomb check (a warning above the limit, an error above twice
+# it) backs up the header check for images opened anywhere else
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+IMAGE_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "BMP": ".bmp"}
+AUDIO_FORMATS = {"mp3": ".mp3", "wav": ".wav", "ogg": ".ogg", "webm": ".webm", "m4a": ".m4a", "flac": ".flac"}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadRequest(Request):
+    """Request that spools file parts to disk once they pass ``SPOOL_BYTES``."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="rb+")
+
+
+def _peek(stream, size=32):
+    position = stream.tell()
+    head = stream.read(size)
+    stream.seek(position)
+    return head
+
+
+def sniff_image(head):
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head.startswith(b"BM"):
+        return "BMP"
+    return None
+
+
+def sniff_audio(head):
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    return None
+
+
+def open_image(stream, max_pixels=MAX_PIXELS):
+    """Open an image from ``stream`` reading only its header; nothing is decoded yet."""
+    image_format = sniff_image(_peek(stream))
+    if image_format is None:
+        raise UploadError("Unsupported image type; upload a JPEG, PNG, WebP or BMP photo", 415)
+    try:
+        img = Image.open(stream, formats=[image_format])
+    except Image.DecompressionBombError:
+        raise UploadError("Image dimensions are too large", 413)
+    except Exception as e:
+        raise UploadError(f"Could not read image header: {e}")
+    width, height = img.size
+    if width < 1 or height < 1:
+        raise UploadError("Image has no pixels")
+    if width * height > max_pixels:
+        raise UploadError(f"Image is {width}x{height}; the limit is {max_pixels} pixels", 413)
+    return img
+
+
+def save_stream(stream, path, max_bytes, chunk_size=CHUNK_SIZE):
+    """Copy ``stream`` to ``path`` in chunks, aborting past ``max_bytes``; returns the size."""
+    # A unique partial file, so concurrent uploads to the same path cannot collide
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadError(f"File is larger than {max_bytes // (1024 * 1024)} MB", 413)
+                out.write(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return written
+
+
+def save_image_upload(file, path_without_extension, max_bytes=IMAGE_MAX_BYTES):
+    """Validate an uploaded image's header and store the original bytes; returns the path.
+
+    The extension comes from the sniffed format, not the client's file name.
+    """
+    # Header only: the image is never decoded, and closing it would close the stream
+    image_format = open_image(file.stream).format
+    path = path_without_extension + IMAGE_FORMATS[image_format]
+    file.stream.seek(0)
+    save_stream(file.stream, path, max_bytes)
+    return path
+
+
+def save_audio_upload(file, path_without_extension, max_bytes=AUDIO_MAX_BYTES):
+    """Check an uploaded audio file's magic bytes and store it in chunks; returns the path."""
+    audio_format = sniff_audio(_peek(file.stream))
+    if audio_format is None:
+        raise UploadError("Unsupported audio type; upload MP3, WAV, OGG, WebM, M4A or FLAC", 415)
+    path = path_without_extension + AUDIO_FORMATS[audio_format]
+    save_stream(file.stream, path, max_bytes)
+    return path